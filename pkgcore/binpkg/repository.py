@@ -5,7 +5,8 @@
 binpkg ebuild repository
 """
 
-__all__ = ("tree", "ConfiguredBinpkgTree", "force_unpacking")
+__all__ = (
+    "tree", "ConfiguredBinpkgTree", "force_unpacking", "merged_data_rewrite")
 
 import os
 
@@ -50,13 +51,39 @@ class force_unpacking(triggers.base):
     _label = 'forced decompression'
     _engine_type = triggers.INSTALLING_MODES
 
+    # hooks whose triggers run prior to files being merged
+    _premerge_hooks = ('sanity_check', 'pre_merge', 'merge')
+
     def __init__(self, format_op):
         self.format_op = format_op
 
+    def requires_unpacking(self, engine, op):
+        """Determine if the binpkg needs extracting into ${D} prior to merging.
+
+        If neither the format op nor any trigger running prior to the merge
+        requires files on disk, they're streamed from the archive straight
+        into their final locations by the merge itself.
+        """
+        if 'preinst' in getattr(engine.new, 'mandatory_phases', ()) or \
+                frozenset(['selinux', 'suidctl']).intersection(getattr(op, 'features', ())):
+            # pkg_preinst and dyn_preinst operate on ${D}
+            return True
+        for hook in self._premerge_hooks:
+            for trigger in engine.hooks.get(hook, ()):
+                if trigger is not self and getattr(trigger, 'requires_image', True):
+                    return True
+        return False
+
     def trigger(self, engine, cset):
         op = self.format_op
         op = getattr(op, 'install_op', op)
         op.setup_workdir()
+        if not self.requires_unpacking(engine, op):
+            # files are read from the archive in its order during the merge,
+            # afterwards their data is pulled from the merged files instead
+            merged_data_rewrite().register(engine)
+            return
+
         merge_contents = get_plugin("fs_ops.merge_contents")
         merge_cset = cset
         if engine.offset != '/':
@@ -88,6 +115,20 @@ class force_unpacking(triggers.base):
         engine.replace_cset('new_cset', cset)
 
 
+class merged_data_rewrite(triggers.base):
+    """Point the data of files streamed from a binpkg at their merged copies."""
+
+    required_csets = ('install',)
+    priority = 100
+    _hooks = ('merge',)
+    _engine_types = triggers.INSTALLING_MODES
+    requires_image = False
+
+    def trigger(self, engine, cset):
+        cset.update([x.change_attributes(data=local_source(x.location))
+                     for x in cset.iterfiles()])
+
+
 def wrap_factory(klass, *args, **kwds):
 
     class new_factory(klass):
@@ -0,0 +1,273 @@
+# License: GPL2/BSD
+
+"""
+single file backend with a sorted, memory-mapped cpv index
+"""
+
+__all__ = ("database",)
+
+import atexit
+import errno
+import mmap
+import os
+import struct
+
+from snakeoil.compatibility import raise_from, is_py3k
+from snakeoil.fileutils import AtomicWriteFile
+from snakeoil.osutils import pjoin
+
+from pkgcore.cache import flat_hash, errors
+from pkgcore.config import ConfigHint
+from pkgcore.log import logger
+
+# file layout: header, fixed size index records sorted by cpv, then the
+# key and entry blobs the records point into.  Entries are stored in
+# md5-cache (key=value lines) form.
+_magic = b'PKGCPACK'
+_version = 1
+_header = struct.Struct('<8sII')
+_record = struct.Struct('<IIII')
+
+
+class database(flat_hash.md5_cache):
+    """Stores md5-cache entries in one file behind a sorted cpv index.
+
+    Lookups are a binary search over the memory-mapped index followed by a
+    slice of the entry blob, so no per-entry syscalls are required. Updates
+    are queued and written out by rebuilding the file atomically on commit;
+    since every commit rewrites the whole file they're batched, and anything
+    still pending is written out on exit.
+    """
+
+    pkgcore_config_type = ConfigHint(
+        {'readonly': 'bool', 'location': 'str', 'label': 'str',
+         'auxdbkeys': 'list'},
+        required=['location'],
+        positional=['location'],
+        typename='cache')
+
+    autocommits = False
+    default_sync_rate = 5000
+    filename = 'md5-cache.pack'
+
+    def __init__(self, location, **config):
+        self._repo_location = location
+        flat_hash.database.__init__(self, pjoin(location, 'metadata'), **config)
+        self.path = pjoin(self.location, self.filename)
+        self._pending = {}
+        self._map = None
+        self._count = 0
+        self._registered = False
+
+    def _load(self):
+        if self._map is not None:
+            return
+        self._count = 0
+        try:
+            with open(self.path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < _header.size:
+                    self._map = b''
+                    return
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise_from(errors.InitializationError(self.__class__, e))
+            self._map = b''
+            return
+        magic, version, count = _header.unpack_from(self._map, 0)
+        if magic != _magic or version != _version:
+            self._map.close()
+            self._map = None
+            raise errors.GeneralCacheCorruption(
+                "%s: unknown format (magic %r, version %r)" % (self.path, magic, version))
+        self._count = count
+
+    def _close(self):
+        if self._map:
+            self._map.close()
+        self._map = None
+
+    def _key(self, idx):
+        key_offset, key_len = _record.unpack_from(
+            self._map, _header.size + idx * _record.size)[:2]
+        return self._map[key_offset:key_offset + key_len]
+
+    def _find(self, key):
+        """Binary search the index, returning the record index or -1."""
+        self._load()
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self._key(mid)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def _raw_entry(self, idx):
+        data_offset, data_len = _record.unpack_from(
+            self._map, _header.size + idx * _record.size)[2:]
+        return self._map[data_offset:data_offset + data_len]
+
+    @staticmethod
+    def _encode(s):
+        if is_py3k:
+            return s.encode('utf8')
+        return s
+
+    @staticmethod
+    def _decode(s):
+        if is_py3k:
+            return s.decode('utf8')
+        return s
+
+    def _get_raw(self, cpv):
+        """Return the serialized entry for a cpv, or None if it doesn't exist."""
+        if cpv in self._pending:
+            return self._pending[cpv]
+        idx = self._find(self._encode(cpv))
+        if idx == -1:
+            return None
+        return self._raw_entry(idx)
+
+    def _getitem(self, cpv):
+        data = self._get_raw(cpv)
+        if data is None:
+            raise KeyError(cpv)
+        try:
+            return self._parse_data(self._decode(data).splitlines(), None)
+        except (KeyError, ValueError) as e:
+            raise_from(errors.CacheCorruption(cpv, e))
+
+    def _queue(self, cpv, data):
+        self._pending[cpv] = data
+        if not self._registered:
+            self._registered = True
+            atexit.register(self._flush_on_exit)
+
+    def _flush_on_exit(self):
+        try:
+            self.commit()
+        except errors.CacheError as e:
+            logger.warning("failed writing pending cache updates to %r: %s", self.path, e)
+
+    def _setitem(self, cpv, values):
+        known = self._known_keys
+        self._queue(cpv, self._encode(''.join(
+            "%s=%s\n" % (k, v) for k, v in sorted(values.iteritems()) if k in known)))
+
+    def _delitem(self, cpv):
+        if cpv not in self:
+            raise KeyError(cpv)
+        self._queue(cpv, None)
+
+    def __contains__(self, cpv):
+        if cpv in self._pending:
+            return self._pending[cpv] is not None
+        return self._find(self._encode(cpv)) != -1
+
+    def _iter_raw(self):
+        """Yield (key, serialized entry) pairs from the on-disk file in order."""
+        self._load()
+        for idx in xrange(self._count):
+            yield self._key(idx), self._raw_entry(idx)
+
+    def iterkeys(self):
+        pending = self._pending
+        for key, _data in self._iter_raw():
+            key = self._decode(key)
+            if key not in pending:
+                yield key
+        for key, data in pending.iteritems():
+            if data is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for x in self.iterkeys())
+
+    def commit(self, force=False):
+        if not self._pending and not force:
+            return
+        if self.readonly:
+            raise errors.ReadOnly()
+        entries = {}
+        for key, data in self._iter_raw():
+            entries[key] = data
+        for key, data in self._pending.iteritems():
+            key = self._encode(key)
+            if data is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = data
+        self._write(entries)
+        self._pending = {}
+
+    def _write(self, entries):
+        """Atomically replace the on-disk file with the given entries.
+
+        :param entries: mapping of encoded cpv to encoded entry data
+        """
+        if not self._ensure_dirs():
+            raise errors.GeneralCacheCorruption(
+                "failed creating directory %r" % (self.location,))
+        keys = sorted(entries)
+        key_offset = _header.size + len(keys) * _record.size
+        data_offset = key_offset + sum(len(k) for k in keys)
+        records = []
+        for key in keys:
+            data_len = len(entries[key])
+            records.append(_record.pack(key_offset, len(key), data_offset, data_len))
+            key_offset += len(key)
+            data_offset += data_len
+        if data_offset >= 2 ** 32:
+            raise errors.GeneralCacheCorruption(
+                "%s: too much data to pack (%i bytes)" % (self.path, data_offset))
+
+        handler = None
+        try:
+            try:
+                handler = AtomicWriteFile(self.path, binary=True)
+                handler.write(_header.pack(_magic, _version, len(keys)))
+                handler.write(b''.join(records))
+                handler.write(b''.join(keys))
+                for key in keys:
+                    handler.write(entries[key])
+                # drop our mapping prior to the rename replacing the file
+                self._close()
+                handler.close()
+                self._ensure_access(self.path)
+            except EnvironmentError as e:
+                raise_from(errors.GeneralCacheCorruption(e))
+        finally:
+            if handler is not None:
+                handler.discard()
+
+    def rebuild(self, source=None):
+        """Atomically replace the cache contents with an md5-cache tree's.
+
+        Entries are copied as is, without any parsing or validation.
+
+        :param source: md5-cache directory to read from, defaults to the
+            repo's metadata/md5-cache
+        """
+        if self.readonly:
+            raise errors.ReadOnly()
+        if source is None:
+            source = pjoin(self._repo_location, 'metadata', 'md5-cache')
+        md5_cache = flat_hash.database(source, readonly=True)
+        entries = {}
+        for cpv in md5_cache.iterkeys():
+            # skip update files left over from concurrent or aborted writes
+            if os.path.basename(cpv).startswith('.update.'):
+                continue
+            try:
+                with open(pjoin(source, cpv), 'rb') as f:
+                    entries[self._encode(cpv)] = f.read()
+            except EnvironmentError as e:
+                if e.errno != errno.ENOENT:
+                    raise_from(errors.CacheCorruption(cpv, e))
+        self._write(entries)
+        self._pending = {}
@@ -371,10 +371,15 @@ def mk_cpv_cls(base_cls):
             return cls(versioned=False, *args)
 
         def __reduce__(self):
-            return (self.__class__, (self.cpvstr,), None, None, None)
+            return (_unpickle_cpv, (self.__class__, self.cpvstr,
+                                    self.version is not None))
 
     return CPV
 
+
+def _unpickle_cpv(cls, cpvstr, versioned):
+    return cls(cpvstr, versioned=versioned)
+
 native_CPV = mk_cpv_cls(_native_CPV)
 
 try:
@@ -32,6 +32,7 @@ from pkgcore.ebuild.misc import (
     non_incremental_collapsed_restrict_to_data, optimize_incrementals,
     package_keywords_splitter)
 from pkgcore.ebuild.repo_objs import OverlayedLicenses
+from pkgcore.ebuild.use_universe import UseUniverse
 from pkgcore.repository import visibility
 from pkgcore.restrictions import packages, values
 from pkgcore.restrictions.delegated import delegate
@@ -45,7 +46,7 @@ demandload(
     're',
     'tempfile',
     'pkgcore.binpkg:repository@binary_repo',
-    'pkgcore.ebuild:repository@ebuild_repo',
+    'pkgcore.ebuild:processor,repository@ebuild_repo',
     'pkgcore.ebuild.triggers:generate_triggers@ebuild_generate_triggers',
     'pkgcore.fs.livefs:iter_scan',
     'pkgcore.log:logger',
@@ -283,6 +284,7 @@ class domain(config_domain):
         self.config_dir = config_dir
         self.prefix = prefix
         self.settings = ProtectedDict(settings)
+        self._configure_processor_pool()
 
         for data in self.settings.get('bashrc', ()):
             source = local_source(data)
@@ -293,6 +295,9 @@ class domain(config_domain):
                     'user-specified bashrc %r does not exist' % (data,))
             self.bashrcs.append((packages.AlwaysTrue, source))
 
+        # interned flags backing the immutable per package USE sets
+        self.use_universe = UseUniverse()
+
         # stack use stuff first, then profile.
         self.enabled_use = ChunkedDataDict()
         self.enabled_use.add_bare_global(*split_negations(self.use))
@@ -372,6 +377,27 @@ class domain(config_domain):
             "^(?:[+-])?(%s)_(.*)$" %
             "|".join(x.lower() for x in sorted(profile.use_expand, reverse=True)))
 
+    # make.conf settings tuning the ebuild processor pool
+    _processor_pool_settings = (
+        ('max_idle', 'PKGCORE_EBD_POOL_SIZE'),
+        ('max_uses', 'PKGCORE_EBD_MAX_USES'),
+        ('min_warm', 'PKGCORE_EBD_MIN_WARM'),
+    )
+
+    def _configure_processor_pool(self):
+        pool = {}
+        for key, var in self._processor_pool_settings:
+            val = self.settings.get(var)
+            if val is None:
+                continue
+            try:
+                pool[key] = int(val)
+                if pool[key] < 0:
+                    raise ValueError
+            except ValueError:
+                raise Failure("%s must be a non-negative integer: %r" % (var, val))
+        processor.configure_processor_pool(**pool)
+
     def _extend_use_for_features(self, features):
         # hackish implementation; if test is on, flip on the flag
         if "test" in features:
@@ -489,7 +515,9 @@ class domain(config_domain):
 
         Returns:
             Three groups of use flags for the package in the following order:
-            immutable flags, enabled flags, and disabled flags.
+            immutable flags, enabled flags, and disabled flags. The immutable
+            and disabled groups are
+            :obj:`pkgcore.ebuild.use_universe.UseFlagSet` instances.
         """
 
         pre_defaults = [x[1:] for x in pkg.iuse if x[0] == '+']
@@ -500,8 +528,10 @@ class domain(config_domain):
 
         attr = 'stable_' if self.stable_arch in pkg.keywords \
             and self.unstable_arch not in self.settings['ACCEPT_KEYWORDS'] else ''
-        disabled = getattr(self, attr + 'disabled_use').pull_data(pkg)
-        immutable = getattr(self, attr + 'forced_use').pull_data(pkg)
+        disabled = getattr(self, attr + 'disabled_use').pull_flagset(
+            pkg, self.use_universe)
+        immutable = getattr(self, attr + 'forced_use').pull_flagset(
+            pkg, self.use_universe)
 
         # lock the configurable use flags to only what's in IUSE, and what's forced
         # from the profiles (things like userland_GNU and arch)
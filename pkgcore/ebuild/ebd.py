@@ -30,7 +30,8 @@ from snakeoil.process.spawn import (
 from pkgcore.ebuild import ebuild_built, const
 from pkgcore.ebuild.processor import (
     request_ebuild_processor, release_ebuild_processor,
-    expected_ebuild_env, chuck_UnhandledCommand, inherit_handler)
+    expected_ebuild_env, chuck_UnhandledCommand, inherit_handler,
+    note_inherited_eclasses)
 from pkgcore.operations import observer, format
 from pkgcore.os_data import portage_gid, portage_uid, xargs
 
@@ -740,6 +741,7 @@ class buildable(ebd, setup_mixin, format.build):
                     self.env["CCACHE_DIR"],
                     "failed ensuring perms/group owner for CCACHE_DIR"))
 
+        note_inherited_eclasses(self.eclass_cache, self.pkg.inherited)
         return setup_mixin.setup(self)
 
     def configure(self):
@@ -8,7 +8,7 @@ package class for buildable ebuilds
 __all__ = ("base", "package", "package_factory")
 
 from functools import partial
-from itertools import imap, chain
+from itertools import imap, izip, chain
 import os
 
 from pkgcore.cache import errors as cache_errors
@@ -31,6 +31,7 @@ demandload(
     "pkgcore.ebuild.eapi:get_eapi",
     "pkgcore:fetch",
     "pkgcore.log:logger",
+    "pkgcore.util.thread_pool:map_async",
 )
 
 demand_compile_regexp(
@@ -308,6 +309,15 @@ class package(base):
             return ebp.get_ebuild_environment(self, self.repo.eclass_cache)
 
 
+def _has_metadata(pkg):
+    """Check if a package's metadata was loaded without triggering a load."""
+    try:
+        object.__getattribute__(pkg, 'data')
+    except AttributeError:
+        return False
+    return True
+
+
 class package_factory(metadata.factory):
     child_class = package
 
@@ -339,17 +349,30 @@ class package_factory(metadata.factory):
         return os.stat(self._get_ebuild_path(pkg)).st_mtime
 
     def _get_metadata(self, pkg, ebp=None, force_regen=False):
-        caches = self._cache
-        if force_regen:
-            caches = ()
-        ebuild_hash = chksum.LazilyHashedPath(pkg.path)
-        for cache in caches:
+        if not force_regen:
+            data = self._get_cached_metadata(pkg)
+            if data is not None:
+                return data
+
+        # no cache entries, regen
+        return self._update_metadata(pkg, ebp=ebp)
+
+    def _get_cached_metadata(self, pkg, purge_stale=True, ebuild_hash=None):
+        """Return valid cached metadata for a package, None if there isn't any.
+
+        :param purge_stale: remove stale entries from writable caches
+        :param ebuild_hash: precomputed :obj:`snakeoil.chksum.LazilyHashedPath`
+            for the ebuild
+        """
+        if ebuild_hash is None:
+            ebuild_hash = chksum.LazilyHashedPath(pkg.path)
+        for cache in self._cache:
             if cache is not None:
                 try:
                     data = cache[pkg.cpvstr]
                     if cache.validate_entry(data, ebuild_hash, self._ecache):
                         return data
-                    if not cache.readonly:
+                    if purge_stale and not cache.readonly:
                         del cache[pkg.cpvstr]
                 except KeyError:
                     continue
@@ -357,9 +380,69 @@ class package_factory(metadata.factory):
                     logger.warning("caught cache error: %s", e)
                     del e
                     continue
-
-        # no cache entries, regen
-        return self._update_metadata(pkg, ebp=ebp)
+        return None
+
+    def validate_metadata(self, pkgs, threads=None):
+        """Bulk validate the cache entries for a batch of packages.
+
+        Ebuilds are stat'd and hashed in parallel up front while eclass
+        checks are memoized by the eclass cache.  Packages with valid cache
+        entries get their metadata primed; note the factory only holds weak
+        refs to its packages so the caller must keep them alive to benefit.
+
+        :param pkgs: package instances from this factory
+        :param threads: number of hashing threads, defaults to the cpu count
+        :return: list of packages lacking valid cache entries
+        """
+        pkgs = [pkg for pkg in pkgs if not _has_metadata(pkg)]
+        caches = [cache for cache in self._cache if cache is not None]
+        if not pkgs or not caches:
+            return pkgs
+
+        chf_types = frozenset(cache.chf_type for cache in caches)
+        hashes = [None] * len(pkgs)
+
+        def _hash(iterable):
+            for i, pkg in iterable:
+                ebuild_hash = chksum.LazilyHashedPath(pkg.path)
+                for chf_type in chf_types:
+                    try:
+                        getattr(ebuild_hash, chf_type)
+                    except EnvironmentError:
+                        # leave it to validation to deal with
+                        break
+                hashes[i] = ebuild_hash
+
+        map_async(list(enumerate(pkgs)), _hash, threads=threads)
+
+        stale = []
+        for pkg, ebuild_hash in izip(pkgs, hashes):
+            try:
+                data = self._get_cached_metadata(pkg, ebuild_hash=ebuild_hash)
+            except EnvironmentError:
+                data = None
+            if data is None:
+                stale.append(pkg)
+            else:
+                object.__setattr__(pkg, 'data', data)
+        return stale
+
+    def _get_raw_metadata(self, pkg, ebp=None, force_regen=False):
+        """Source the raw metadata keys for a package requiring regeneration.
+
+        Nothing is written to the caches, the returned mapping is meant to be
+        passed to :obj:`_store_metadata`.
+
+        :return: mapping of raw metadata keys, or None if the package has
+            valid cache entries or an unsupported EAPI
+        """
+        if not force_regen and \
+                self._get_cached_metadata(pkg, purge_stale=False) is not None:
+            return None
+        if not pkg.eapi.is_supported:
+            return None
+        with processor.reuse_or_request(ebp) as my_proc:
+            return my_proc.get_keys(pkg, self._ecache)
 
     def _update_metadata(self, pkg, ebp=None):
         parsed_eapi = pkg.eapi
@@ -368,7 +451,11 @@ class package_factory(metadata.factory):
 
         with processor.reuse_or_request(ebp) as my_proc:
             mydata = my_proc.get_keys(pkg, self._ecache)
+        return self._store_metadata(pkg, mydata)
 
+    def _store_metadata(self, pkg, mydata):
+        """Convert raw metadata keys into cache form and store them."""
+        parsed_eapi = pkg.eapi
         inherited = mydata.pop("INHERITED", None)
         # Rewrite defined_phases as needed, since we now know the EAPI.
         eapi = get_eapi(mydata["EAPI"])
@@ -33,6 +33,9 @@ class base(object):
 
     def __init__(self, location=None, eclassdir=None):
         self._eclass_data_inst_cache = WeakValCache()
+        # validation results per unique set of eclass checksums, tied to the
+        # eclasses mapping they were generated against
+        self._rebuild_results = (None, {})
         # generate this.
         # self.eclasses = {} # {"Name": ("location", "_mtime_")}
         self.location = location
@@ -62,16 +65,42 @@ class base(object):
 
     eclasses = jit_attr_ext_method("_load_eclasses", "_eclasses")
 
+    def reload(self):
+        """Force eclasses to be rescanned, dropping all cached results."""
+        try:
+            del self._eclasses
+        except AttributeError:
+            pass
+        self._eclass_data_inst_cache.clear()
+        self._rebuild_results = (None, {})
+
     def rebuild_cache_entry(self, entry_eclasses):
         """Check if eclass data is still valid.
 
         Given a dict as returned by get_eclass_data, walk it comparing
-        it to internal eclass view.
+        it to internal eclass view.  Results are memoized per unique set of
+        eclass checksums until the eclasses are reloaded.
 
         :return: a boolean representing whether that eclass data is still
             up to date, or not
         """
         ec = self.eclasses
+        owner, results = self._rebuild_results
+        if owner is not ec:
+            results = {}
+            self._rebuild_results = (ec, results)
+        key = tuple((eclass, tuple(chksums)) for eclass, chksums in entry_eclasses)
+        try:
+            return results[key]
+        except KeyError:
+            pass
+        d = self._rebuild_cache_entry(ec, key)
+        if d is not None:
+            d = ImmutableDict(d)
+        results[key] = d
+        return d
+
+    def _rebuild_cache_entry(self, ec, entry_eclasses):
         d = {}
 
         for eclass, chksums in entry_eclasses:
@@ -144,3 +173,8 @@ class StackedCaches(base):
 
     def _load_eclasses(self):
         return StackedDict(*[ec.eclasses for ec in self._caches])
+
+    def reload(self):
+        for ec in self._caches:
+            ec.reload()
+        base.reload(self)
@@ -0,0 +1,383 @@
+# License: GPL2/BSD
+
+"""
+inverted indexes of ebuild repository metadata
+
+Queries on attributes such as USE flags, licenses, maintainers, or
+dependencies normally require loading the metadata of every package in a
+repo.  The index maps each value of those attributes to the cpvs using it,
+dependencies being indexed by the keys of their atoms, allowing candidate
+packages to be found without touching package metadata.  It's maintained
+incrementally: entries are tagged with the mtimes of the ebuild, its
+metadata.xml, and its inherited eclasses, so only changed packages are
+reloaded on update.
+
+The index lives in the repo, so it's stored as JSON; loading it can't do
+more than feed bogus metadata to queries.
+"""
+
+__all__ = ("MetadataIndex",)
+
+from collections import defaultdict
+import errno
+from functools import partial
+from itertools import izip
+import json
+import os
+import time
+
+from snakeoil import compatibility
+from snakeoil.demandload import demandload
+from snakeoil.osutils import pjoin
+from snakeoil.sequences import iflatten_instance
+
+from pkgcore.restrictions import boolean, packages, values
+
+demandload(
+    'snakeoil.fileutils:AtomicWriteFile',
+    'snakeoil.osutils:ensure_dirs',
+    'pkgcore.ebuild:atom,repo_objs,restricts',
+    'pkgcore.log:logger',
+)
+
+
+def _maintainers(pkg):
+    return tuple((m.email, m.name, m.description) for m in pkg.maintainers)
+
+
+def _licenses(pkg):
+    return tuple(set(
+        x for x in iflatten_instance(pkg.license) if isinstance(x, basestring)))
+
+
+def _dep_keys(attr, pkg):
+    return tuple(set(
+        x.key for x in iflatten_instance(getattr(pkg, attr), atom.atom)
+        if isinstance(x, atom.atom)))
+
+
+# indexed attributes mapped to functions pulling their values from a package
+_fields = {
+    'eapi': lambda pkg: (str(pkg.eapi),),
+    'iuse_stripped': lambda pkg: tuple(pkg.iuse_stripped),
+    'license': _licenses,
+    'maintainers': _maintainers,
+    'inherited': lambda pkg: tuple(pkg.inherited),
+    # reverse dependencies, mapping keys to the packages depending on them
+    'depends': partial(_dep_keys, 'depends'),
+    'rdepends': partial(_dep_keys, 'rdepends'),
+    'post_rdepends': partial(_dep_keys, 'post_rdepends'),
+}
+
+# entries store values in this order
+_field_names = tuple(sorted(_fields))
+_inherited = _field_names.index('inherited')
+
+# attributes holding a single value instead of a sequence
+_scalar_fields = frozenset(['eapi'])
+
+# attributes holding dependency keys
+_dep_fields = frozenset(['depends', 'rdepends', 'post_rdepends'])
+
+
+def _stat_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except EnvironmentError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            raise
+        return None
+
+
+def _thaw_entry(entry):
+    """Convert an entry decoded from JSON back into its tuple form."""
+    token, data = entry
+    if token is not None:
+        ebuild_mtime, xml_mtime, eclasses = token
+        token = (ebuild_mtime, xml_mtime, tuple(eclasses))
+    data = tuple(
+        tuple(tuple(x) for x in vals) if field == 'maintainers' else tuple(vals)
+        for field, vals in izip(_field_names, data))
+    if len(data) != len(_field_names):
+        raise ValueError("wrong number of fields: %r" % (data,))
+    return token, data
+
+
+def _build_index(entries):
+    """Map the values of each field to the cpvs of the entries holding them."""
+    index = {k: defaultdict(set) for k in _field_names}
+    for cpv, (_, data) in entries.iteritems():
+        for field, vals in izip(_field_names, data):
+            field_index = index[field]
+            for val in vals:
+                field_index[val].add(cpv)
+    return {k: {val: frozenset(cpvs) for val, cpvs in v.iteritems()}
+            for k, v in index.iteritems()}
+
+
+class MetadataIndex(object):
+    """Persistent inverted index of the metadata of an ebuild repo.
+
+    Synced repos are trusted to be unchanged as long as the mtime of their
+    metadata/timestamp.chk file matches the one recorded at update time,
+    skipping the stat calls validating each entry.
+
+    :ivar fields: attribute names that are indexed
+    """
+
+    version = 3
+    fields = frozenset(_fields)
+
+    def __init__(self, repo, path):
+        """
+        :param repo: :obj:`pkgcore.ebuild.repository._UnconfiguredTree` instance
+        :param path: location of the index file
+        """
+        self.repo = repo
+        self.path = path
+        self._entries = None
+        self._index = None
+        self._timestamp = None
+        self._stale = None
+
+    @property
+    def _timestamp_path(self):
+        return pjoin(self.repo.location, 'metadata', 'timestamp.chk')
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or data.get('version') != self.version \
+                    or data.get('location') != self.repo.location:
+                return None
+            entries = {str(cpv): _thaw_entry(entry)
+                       for cpv, entry in data['entries'].iteritems()}
+            timestamp = data['timestamp']
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("failed reading metadata index %r: %s", self.path, e)
+            return None
+        except compatibility.IGNORED_EXCEPTIONS:
+            raise
+        except Exception as e:
+            logger.warning("ignoring corrupt metadata index %r: %s", self.path, e)
+            return None
+        return entries, timestamp
+
+    def _load(self):
+        if self._entries is None:
+            data = self._read()
+            if data is None:
+                self._entries, self._index = {}, None
+            else:
+                self._entries, self._timestamp = data
+                self._index = _build_index(self._entries)
+        return self._index is not None
+
+    @property
+    def exists(self):
+        """Whether the repo has an index built for it."""
+        return self._load()
+
+    def _token(self, cat, pkg, ebuild_path, inherited, _mtimes):
+        """Return the validation token of a package, None if it's unstable.
+
+        :param _mtimes: dict memoizing the mtimes of files shared between
+            packages
+        """
+        xml_path = pjoin(self.repo.base, cat, pkg, 'metadata.xml')
+        xml_mtime = _mtimes.get(xml_path, False)
+        if xml_mtime is False:
+            xml_mtime = _mtimes[xml_path] = _stat_mtime(xml_path)
+        ebuild_mtime = _stat_mtime(ebuild_path)
+        if ebuild_mtime is None:
+            return None
+        now = time.time()
+        if abs(now - ebuild_mtime) < 2 or \
+                (xml_mtime is not None and abs(now - xml_mtime) < 2):
+            # racy; the file may change again without its mtime changing
+            return None
+        eclasses = []
+        for eclass in inherited:
+            mtime = _mtimes.get(eclass, False)
+            if mtime is False:
+                obj = self.repo.eclass_cache.eclasses.get(eclass)
+                mtime = _mtimes[eclass] = None if obj is None else obj.mtime
+            eclasses.append(mtime)
+        return (ebuild_mtime, xml_mtime, tuple(eclasses))
+
+    def _iter_ebuilds(self):
+        """Yield (cpvstr, category, package, ebuild path) for all packages."""
+        repo = self.repo
+        for (cat, pkg), versions in repo.versions.iteritems():
+            for ver in versions:
+                yield ('%s/%s-%s' % (cat, pkg, ver), cat, pkg,
+                       pjoin(repo.base, cat, pkg, '%s-%s%s' % (pkg, ver, repo.extension)))
+
+    def stale(self):
+        """Return the cpvs lacking valid index entries.
+
+        The result is computed once per instance.
+        """
+        if self._stale is None and self._load() and self._timestamp is not None \
+                and self._timestamp == _stat_mtime(self._timestamp_path):
+            # unchanged since the last sync; only packages that failed
+            # loading or had racy mtimes at update time are stale
+            self._stale = frozenset(
+                cpv for cpv, entry in self._entries.iteritems() if entry[0] is None)
+        if self._stale is None:
+            stale = set()
+            mtimes = {}
+            for cpv, cat, pkg, path in self._iter_ebuilds():
+                entry = self._entries.get(cpv)
+                if entry is None or entry[0] is None or entry[0] != self._token(
+                        cat, pkg, path, entry[1][_inherited], mtimes):
+                    stale.add(cpv)
+            self._stale = frozenset(stale)
+        return self._stale
+
+    def update(self):
+        """Update the index, reloading the metadata of changed packages only.
+
+        :return: (number of updated entries, list of (cpv, exception) tuples
+            for packages that failed loading)
+        """
+        self._load()
+        timestamp = _stat_mtime(self._timestamp_path)
+        entries = {}
+        failures = []
+        updated = 0
+        mtimes = {}
+        for pkg in self.repo:
+            cpv = pkg.cpvstr
+            entry = self._entries.get(cpv)
+            if entry is not None and entry[0] is not None and entry[0] == self._token(
+                    pkg.category, pkg.package, pkg.path, entry[1][_inherited], mtimes):
+                entries[cpv] = entry
+                continue
+            try:
+                data = tuple(_fields[k](pkg) for k in _field_names)
+            except compatibility.IGNORED_EXCEPTIONS:
+                raise
+            except Exception as e:
+                failures.append((cpv, e))
+                # keep it stale
+                entries[cpv] = (None, tuple(() for k in _field_names))
+                continue
+            token = self._token(
+                pkg.category, pkg.package, pkg.path, data[_inherited], mtimes)
+            entries[cpv] = (token, data)
+            updated += 1
+
+        self._entries, self._index, self._stale = entries, _build_index(entries), None
+        self._timestamp = timestamp
+        self._write()
+        return updated, failures
+
+    def _write(self):
+        data = {
+            'version': self.version,
+            'location': self.repo.location,
+            'timestamp': self._timestamp,
+            'entries': self._entries,
+        }
+        handler = None
+        try:
+            if not ensure_dirs(os.path.dirname(self.path), mode=0755):
+                raise EnvironmentError(
+                    errno.EACCES, "failed creating directory", os.path.dirname(self.path))
+            handler = AtomicWriteFile(self.path)
+            json.dump(data, handler)
+            handler.close()
+        finally:
+            if handler is not None:
+                handler.discard()
+
+    def counts(self, attr):
+        """Return a mapping of the values of an attribute to their package counts.
+
+        :return: None if there's no index or it's out of date
+        """
+        if not self._load() or self.stale():
+            return None
+        return {k: len(v) for k, v in self._index[attr].iteritems()}
+
+    def __len__(self):
+        self._load()
+        return len(self._entries)
+
+    def candidates(self, restrict):
+        """Find the cpvs of packages possibly matching a restriction.
+
+        Packages lacking valid index entries are always included, so the
+        result is a superset of the matching packages; the restriction still
+        has to be applied to them.
+
+        :return: frozenset of cpvstrs, or None if the index can't narrow
+            down the restriction
+        """
+        if not self._load():
+            return None
+        cpvs = self._candidates(restrict)
+        if cpvs is None:
+            return None
+        return frozenset(cpvs).union(self.stale())
+
+    def _candidates(self, restrict):
+        cls = restrict.__class__
+        if cls is boolean.AndRestriction and not restrict.negate:
+            result = None
+            for x in restrict.restrictions:
+                cpvs = self._candidates(x)
+                if cpvs is not None:
+                    result = cpvs if result is None else result.intersection(cpvs)
+            return result
+        elif cls is boolean.OrRestriction and not restrict.negate:
+            result = set()
+            for x in restrict.restrictions:
+                cpvs = self._candidates(x)
+                if cpvs is None:
+                    return None
+                result.update(cpvs)
+            return result
+        elif isinstance(restrict, packages.PackageRestriction) and \
+                not isinstance(restrict, packages.PackageRestrictionMulti) and \
+                not restrict.negate and restrict.attr in self.fields:
+            return self._value_candidates(restrict.attr, restrict.restriction)
+        return None
+
+    def _value_candidates(self, attr, restrict):
+        index = self._index[attr]
+        if restrict.negate:
+            return None
+        if attr in _dep_fields:
+            # only the keys of dependency atoms are indexed
+            if isinstance(restrict, restricts.DependencyMatch):
+                return self._union(index.get(x, frozenset()) for x in restrict.keys)
+            return None
+        elif attr in _scalar_fields:
+            return self._union(
+                v for k, v in index.iteritems() if restrict.match(k))
+        elif isinstance(restrict, values.ContainmentMatch2):
+            matches = [index.get(x, frozenset()) for x in restrict.vals]
+            if restrict.all:
+                if not matches:
+                    return None
+                return frozenset.intersection(*matches)
+            return self._union(matches)
+        elif isinstance(restrict, values.AnyMatch):
+            child = restrict.restriction
+            if attr == 'maintainers':
+                return self._union(
+                    v for k, v in index.iteritems()
+                    if child.match(repo_objs.Maintainer(*k)))
+            return self._union(v for k, v in index.iteritems() if child.match(k))
+        return None
+
+    @staticmethod
+    def _union(sets):
+        result = set()
+        for x in sets:
+            result.update(x)
+        return result
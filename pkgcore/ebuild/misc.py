@@ -467,6 +467,27 @@ class ChunkedDataDict(object):
             else:
                 self.add_global(cinst)
 
+    def __getstate__(self):
+        # chunks are stored as plain tuples; snakeoil's namedtuples aren't
+        # picklable
+        encode = lambda items: tuple(
+            (isinstance(x, restrict_payload), tuple(x)) for x in items)
+        return {
+            'global_settings': encode(self._global_settings),
+            'dict': {k: encode(v) for k, v in self._dict.iteritems()},
+            'frozen': self.frozen,
+        }
+
+    def __setstate__(self, state):
+        decode = lambda items: [
+            restrict_payload(*x) if payload else chunked_data(*x)
+            for payload, x in items]
+        self._global_settings = decode(state['global_settings'])
+        self._dict = defaultdict(partial(list, self._global_settings))
+        self._dict.update((k, decode(v)) for k, v in state['dict'].iteritems())
+        if state['frozen']:
+            self.freeze()
+
     def freeze(self):
         if not isinstance(self._dict, mappings.ImmutableDict):
             self._dict = mappings.ImmutableDict(
@@ -530,6 +551,18 @@ class ChunkedDataDict(object):
 
     pull_data = render_pkg
 
+    def pull_flagset(self, pkg, universe):
+        """Render the data of a package as an immutable flag set.
+
+        :param universe: :obj:`pkgcore.ebuild.use_universe.UseUniverse`
+            instance the returned set belongs to
+        :return: :obj:`pkgcore.ebuild.use_universe.UseFlagSet` instance
+        """
+        items = self._dict.get(pkg.key)
+        if items is None:
+            items = self._global_settings
+        return universe.render_chunks(cinst for cinst in items if cinst.key.match(pkg))
+
 
 class PayloadDict(ChunkedDataDict):
 
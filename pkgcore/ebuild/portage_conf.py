@@ -208,12 +208,14 @@ def add_profile(config, config_dir, profile_override=None):
             "parent_path": paths[0],
             "parent_profile": paths[1],
             "user_path": user_profile_path,
+            "cache_location": '/var/cache/edb/profiles',
         })
     else:
         config["profile"] = basics.AutoConfigSection({
             "class": "pkgcore.ebuild.profiles.OnDiskProfile",
             "basepath": paths[0],
             "profile": paths[1],
+            "cache_location": '/var/cache/edb/profiles',
         })
 
 
@@ -20,7 +20,8 @@ design) reduces regen time by over 40% compared to portage-2.1
 
 __all__ = (
     "request_ebuild_processor", "release_ebuild_processor", "EbuildProcessor",
-    "UnhandledCommand", "expected_ebuild_env")
+    "UnhandledCommand", "expected_ebuild_env", "configure_processor_pool",
+    "warm_processor_pool", "note_inherited_eclasses")
 
 try:
     import threading
@@ -28,6 +29,8 @@ try:
     _acquire_global_ebp_lock = _global_ebp_lock.acquire
     _release_global_ebp_lock = _global_ebp_lock.release
 except ImportError:
+    threading = None
+
     def _acquire_global_ebp_lock():
         pass
 
@@ -35,13 +38,21 @@ except ImportError:
         pass
 
 
+def _in_main_thread():
+    """Signal handlers can only be installed from the main thread."""
+    return threading is None or isinstance(
+        threading.current_thread(), threading._MainThread)
+
+
 inactive_ebp_list = []
 active_ebp_list = []
 
 import contextlib
 import errno
+from collections import Counter
 from functools import partial
 import os
+import select
 import signal
 
 import pkgcore
@@ -65,6 +76,26 @@ demandload(
 )
 
 
+def _pool_env_setting(var, default):
+    try:
+        return max(int(os.environ.get(var, default)), 0)
+    except ValueError:
+        return default
+
+# processor pool tuning; see configure_processor_pool()
+_pool_settings = {
+    'max_idle': _pool_env_setting('PKGCORE_EBD_POOL_SIZE', 8),
+    'max_uses': _pool_env_setting('PKGCORE_EBD_MAX_USES', 100),
+    'min_warm': _pool_env_setting('PKGCORE_EBD_MIN_WARM', 1),
+}
+# eclass cache and eclasses warmed processors preload; if no eclasses were
+# specified the most frequently inherited ones (tracked via _hot_eclasses) are used
+_pool_preload = {'eclass_cache': None, 'eclasses': None}
+_hot_eclasses = Counter()
+_hot_eclass_limit = 30
+_pool_refilling = {}
+
+
 def _single_thread_allowed(functor):
     def _inner(*args, **kwds):
         _acquire_global_ebp_lock()
@@ -79,13 +110,28 @@ def _single_thread_allowed(functor):
 
 @_single_thread_allowed
 def forget_all_processors():
+    """Drop all known processors without shutting them down.
+
+    Intended for use in forked children; the forgotten processors are marked
+    dead so their finalizers don't talk to daemons owned by the parent.
+    """
+    for ebp in chain(active_ebp_list, inactive_ebp_list):
+        ebp.pid = None
     active_ebp_list[:] = []
     inactive_ebp_list[:] = []
+    _pool_refilling.clear()
 
 
-@_single_thread_allowed
 def shutdown_all_processors():
     """Kill off all known processors."""
+    # wait on any background pool warming so nothing is spawned afterwards
+    for t in list(_pool_refilling.values()):
+        t.join()
+    _shutdown_all_processors()
+
+
+@_single_thread_allowed
+def _shutdown_all_processors():
     try:
         while active_ebp_list:
             try:
@@ -108,10 +154,150 @@ def shutdown_all_processors():
 spawn.atexit_register(shutdown_all_processors)
 
 
+@_single_thread_allowed
+def configure_processor_pool(max_idle=None, max_uses=None, min_warm=None,
+                             eclass_cache=None, eclasses=None):
+    """Tune the pool of idle processors kept for reuse.
+
+    Settings left unspecified are kept as is; initial values are pulled from
+    the PKGCORE_EBD_POOL_SIZE, PKGCORE_EBD_MAX_USES, and PKGCORE_EBD_MIN_WARM
+    environment variables, defaulting to 8 idle processors recycled after 100
+    requests, with one kept warm.  Domains override them via the same
+    make.conf settings, `pmaint regen` via its --ebd-* options.
+
+    :param max_idle: max number of idle processors kept, 0 for unbounded
+    :param max_uses: number of requests a processor serves before it's
+        recycled, 0 to disable recycling
+    :param min_warm: number of idle processors kept spawned in the background
+    :param eclass_cache: :obj:`pkgcore.ebuild.eclass_cache` instance warmed
+        processors preload eclasses from
+    :param eclasses: eclass names to preload into warmed processors; defaults
+        to the eclasses most often inherited by packages during this run
+    """
+    for key, val in (('max_idle', max_idle), ('max_uses', max_uses),
+                     ('min_warm', min_warm)):
+        if val is not None:
+            if val < 0:
+                raise ValueError("%s must be non-negative: %r" % (key, val))
+            _pool_settings[key] = val
+    if eclass_cache is not None:
+        _pool_preload['eclass_cache'] = eclass_cache
+    if eclasses is not None:
+        _pool_preload['eclasses'] = tuple(eclasses)
+
+
+def _count_idle(userpriv, sandbox):
+    return sum(1 for x in inactive_ebp_list
+               if x.userprived() == userpriv and (x.sandboxed() or not sandbox))
+
+
+def note_inherited_eclasses(eclass_cache, eclasses):
+    """Record eclasses inherited by a package.
+
+    The most often inherited eclasses of the pool's eclass cache are
+    preloaded by warmed processors, see :obj:`configure_processor_pool`.
+    """
+    if eclass_cache is not None and eclass_cache is _pool_preload['eclass_cache']:
+        _hot_eclasses.update(eclasses)
+
+
+def _spawn_warm_processor(userpriv, sandbox):
+    ebp = EbuildProcessor(userpriv, sandbox)
+    cache = _pool_preload['eclass_cache']
+    if cache is not None:
+        eclasses = _pool_preload['eclasses']
+        if eclasses is None:
+            eclasses = [x[0] for x in _hot_eclasses.most_common(_hot_eclass_limit)]
+        eclasses = [x for x in eclasses if x in cache.eclasses]
+        if eclasses and not ebp.preload_eclasses(cache, limited_to=eclasses):
+            ebp.shutdown_processor()
+            return None
+    return ebp
+
+
+def _fill_pool(userpriv, sandbox, count, background=False):
+    """Spawn idle processors until ``count`` matching ones are available.
+
+    Processors are spawned without holding the global lock so requests can
+    proceed in the meantime.
+
+    :param background: run as the background fill registered by
+        :obj:`_start_pool_fill`, unregistering it when done
+    """
+    try:
+        while True:
+            _acquire_global_ebp_lock()
+            try:
+                if _count_idle(userpriv, sandbox) >= count:
+                    return
+            finally:
+                _release_global_ebp_lock()
+            ebp = _spawn_warm_processor(userpriv, sandbox)
+            if ebp is None:
+                return
+            _acquire_global_ebp_lock()
+            try:
+                inactive_ebp_list.append(ebp)
+            finally:
+                _release_global_ebp_lock()
+    except Exception as e:
+        logger.warning("failed warming ebuild processor pool: %s", e)
+    finally:
+        if background:
+            _pool_refilling.pop((userpriv, sandbox), None)
+
+
+def _start_pool_fill(userpriv, sandbox, count):
+    """Fill the pool in a background thread; must be called with the lock held."""
+    key = (userpriv, sandbox)
+    if key in _pool_refilling or _count_idle(userpriv, sandbox) >= count:
+        return
+    try:
+        t = threading.Thread(
+            target=_fill_pool, args=(userpriv, sandbox, count, True))
+    except NameError:
+        # no threading support, warming only happens on demand
+        return
+    _pool_refilling[key] = t
+    t.daemon = True
+    t.start()
+
+
+def warm_processor_pool(count=None, userpriv=False, sandbox=None,
+                        background=False):
+    """Spawn idle processors ahead of time.
+
+    Warmed processors have the pool's hot eclasses preloaded, see
+    :obj:`configure_processor_pool`.
+
+    :param count: number of idle processors wanted, defaults to the pool's
+        min_warm setting
+    :param background: spawn the processors in a separate thread
+    """
+    if sandbox is None:
+        sandbox = spawn.is_sandbox_capable()
+    if count is None:
+        count = _pool_settings['min_warm']
+    if not count:
+        return
+    if background:
+        _acquire_global_ebp_lock()
+        try:
+            _start_pool_fill(userpriv, sandbox, count)
+        finally:
+            _release_global_ebp_lock()
+    else:
+        _fill_pool(userpriv, sandbox, count)
+
+
 @_single_thread_allowed
 def request_ebuild_processor(userpriv=False, sandbox=None):
     """Request an ebuild_processor instance, creating a new one if needed.
 
+    Idle processors are health checked before being reused, and if the pool
+    is configured to keep processors warm, replacements for the returned
+    processor are spawned in the background.
+
     :return: :obj:`EbuildProcessor`
     :param userpriv: should the processor be deprived to
         :obj:`pkgcore.os_data.portage_gid` and :obj:`pkgcore.os_data.portage_uid`?
@@ -121,17 +307,21 @@ def request_ebuild_processor(userpriv=False, sandbox=None):
     if sandbox is None:
         sandbox = spawn.is_sandbox_capable()
 
-    for x in inactive_ebp_list:
+    e = None
+    for x in inactive_ebp_list[:]:
         if x.userprived() == userpriv and (x.sandboxed() or not sandbox):
+            inactive_ebp_list.remove(x)
             if not x.is_alive:
-                inactive_ebp_list.remove(x)
                 continue
-            inactive_ebp_list.remove(x)
-            active_ebp_list.append(x)
-            return x
+            e = x
+            break
 
-    e = EbuildProcessor(userpriv, sandbox)
+    if e is None:
+        e = EbuildProcessor(userpriv, sandbox)
+    e.uses += 1
     active_ebp_list.append(e)
+    if _pool_settings['min_warm']:
+        _start_pool_fill(userpriv, sandbox, _pool_settings['min_warm'])
     return e
 
 
@@ -155,9 +345,19 @@ def release_ebuild_processor(ebp):
         return False
 
     assert ebp not in inactive_ebp_list
+    max_idle = _pool_settings['max_idle']
+    max_uses = _pool_settings['max_uses']
     if ebp.locked:
         # ok, so the thing is not reusable either way.
         ebp.shutdown_processor()
+    elif max_uses and ebp.uses >= max_uses:
+        # recycle long running processors; replacements get spawned as needed
+        ebp.shutdown_processor()
+        if _pool_settings['min_warm']:
+            _start_pool_fill(
+                ebp.userprived(), ebp.sandboxed(), _pool_settings['min_warm'])
+    elif max_idle and len(inactive_ebp_list) >= max_idle:
+        ebp.shutdown_processor()
     else:
         inactive_ebp_list.append(ebp)
     return True
@@ -222,7 +422,8 @@ def chuck_KeyboardInterrupt(*arg):
         os.killpg(ebp.pid, signal.SIGKILL)
     raise KeyboardInterrupt("ctrl+c encountered")
 
-signal.signal(signal.SIGINT, chuck_KeyboardInterrupt)
+if _in_main_thread():
+    signal.signal(signal.SIGINT, chuck_KeyboardInterrupt)
 
 
 def chuck_UnhandledCommand(processor, line):
@@ -262,7 +463,9 @@ class EbuildProcessor(object):
         spawn_opts = {'umask': 0002}
 
         self._preloaded_eclasses = {}
+        self._preload_source = None
         self._eclass_caching = False
+        self.uses = 0
         self._outstanding_expects = []
         self._metadata_paths = None
 
@@ -376,6 +579,10 @@ class EbuildProcessor(object):
         :return: True for success, False for everything else
         """
 
+        # preloaded eclasses are only verified against eclass caches during
+        # metadata sourcing, don't let them leak into build phases
+        if self._preloaded_eclasses and not self.clear_preloaded_eclasses():
+            return False
         self.write("process_ebuild %s" % phase)
         if not self.send_env(env, tmpdir=tmpdir):
             return False
@@ -433,9 +640,12 @@ class EbuildProcessor(object):
         """Read from the daemon, check if the returned string is expected.
 
         :param want: string we're expecting
+        :param timeout: if nonzero, seconds to wait for the daemon; off
+            the main thread this is only supported for synchronous expects
         :return: boolean, was what was read == want?
         """
-        if timeout:
+        alarm = timeout and _in_main_thread()
+        if alarm:
             signal.signal(signal.SIGALRM, self._timeout_ebp)
             signal.setitimer(signal.ITIMER_REAL, timeout)
 
@@ -445,12 +655,16 @@ class EbuildProcessor(object):
         if flush:
             self.ebd_write.flush()
         if not self._outstanding_expects:
+            if timeout and not alarm:
+                # other threads can't use SIGALRM, wait on the pipe instead
+                if not select.select([self.ebd_read], [], [], timeout)[0]:
+                    return False
             try:
                 return want == self.read().rstrip('\n')
             except TimeoutError:
                 return False
             finally:
-                if timeout:
+                if alarm:
                     signal.setitimer(signal.ITIMER_REAL, 0)
                     signal.signal(signal.SIGALRM, signal.SIG_DFL)
 
@@ -519,10 +733,28 @@ class EbuildProcessor(object):
     def clear_preloaded_eclasses(self):
         if self.is_alive:
             self.write("clear_preloaded_eclasses")
-            if not self.expect("clear_preload_eclasses succeeded", flush=True):
+            if not self.expect("clear_preloaded_eclasses succeeded", flush=True):
                 self.shutdown_processor()
                 return False
         self._preloaded_eclasses.clear()
+        self._preload_source = None
+        return True
+
+    def _verify_preloaded_eclasses(self, cache):
+        """Clear preloaded eclasses if the eclass cache resolves them differently.
+
+        Bash side, preloaded eclasses are used by name, so processors reused
+        across repos (or warmed by the pool) must be checked before sourcing.
+        """
+        if self._preload_source is not cache and self._preloaded_eclasses:
+            ec = cache.eclasses
+            for eclass, path in self._preloaded_eclasses.iteritems():
+                data = ec.get(eclass)
+                if data is None or data.path != path:
+                    if not self.clear_preloaded_eclasses():
+                        return False
+                    break
+        self._preload_source = cache
         return True
 
     def preload_eclasses(self, cache, async=False, limited_to=None):
@@ -535,6 +767,8 @@ class EbuildProcessor(object):
         :param ec_file: filepath of eclass to preload
         :return: boolean, True for success
         """
+        if not self._verify_preloaded_eclasses(cache):
+            return False
         ec = cache.eclasses
         if limited_to:
             i = ((eclass, ec[eclass]) for eclass in limited_to)
@@ -730,6 +964,8 @@ class EbuildProcessor(object):
         # ebuild is not allowed to run any external programs during
         # depend phases; use /dev/null since "" == "."
         self._ensure_metadata_paths(("/dev/null",))
+        if not self._verify_preloaded_eclasses(eclass_cache):
+            raise InternalError(None, "failed clearing preloaded eclasses")
 
         env = expected_ebuild_env(package_inst, depends=True)
         data = self._generate_env_str(env)
@@ -802,6 +1038,8 @@ class EbuildProcessor(object):
         self._run_depend_like_phase('gen_metadata', package_inst, eclass_cache,
                                     {"key": receive_key})
 
+        note_inherited_eclasses(
+            eclass_cache, metadata_keys.get('INHERITED', '').split())
         return metadata_keys
 
     # this basically handles all hijacks from the daemon, whether
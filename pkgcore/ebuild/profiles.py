@@ -10,6 +10,12 @@ import errno
 from functools import partial
 from itertools import chain
 import os
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 from snakeoil import caching, compatibility, klass, sequences
 from snakeoil.bash import iter_read_bash, read_bash_dict
@@ -19,6 +25,7 @@ from snakeoil.fileutils import readlines_utf8
 from snakeoil.osutils import abspath, pjoin
 from snakeoil.sequences import split_negations
 
+from pkgcore import __version__
 from pkgcore.config import ConfigHint, errors
 from pkgcore.ebuild import const, ebuild_src
 from pkgcore.ebuild.misc import (
@@ -28,12 +35,16 @@ from pkgcore.util.parserestrict import parse_match
 
 demandload(
     'collections:defaultdict',
+    'hashlib:md5',
     'snakeoil.data_source:local_source',
+    'snakeoil.fileutils:AtomicWriteFile',
     'snakeoil.mappings:ImmutableDict',
+    'snakeoil.osutils:ensure_dirs',
     'pkgcore.ebuild:cpv,repo_objs',
     'pkgcore.ebuild.atom:atom',
     'pkgcore.ebuild.eapi:get_eapi',
     'pkgcore.fs.livefs:sorted_scan',
+    'pkgcore.log:logger',
     'pkgcore.repository.util:SimpleTree',
     'pkgcore.restrictions:packages',
 )
@@ -49,6 +60,11 @@ class ProfileError(errors.ParsingError):
             self.filename, self.path, self.error)
 
 
+# files of a profile node its properties are loaded from, used to validate
+# cached profile stacks
+_node_files = set(['profile.bashrc'])
+
+
 def load_property(filename, handler=iter_read_bash, fallback=(),
                   read_func=readlines_utf8, allow_recurse=False, eapi_optional=None):
     """Decorator simplifying parsing profile files to generate a profile property.
@@ -66,6 +82,8 @@ def load_property(filename, handler=iter_read_bash, fallback=(),
         the fallback is returned and no ondisk activity occurs.
     :return: A :py:`klass.jit.attr_named` property instance.
     """
+    _node_files.add(filename)
+
     def f(func):
         f2 = klass.jit_attr_named('_%s' % (func.__name__,))
         return f2(partial(
@@ -435,13 +453,68 @@ def _empty_provides_has_match(*args, **kwds):
     return False
 
 
+def _stat_files(path, now):
+    """Return (path, mtime, size) tuples of a file or directory tree.
+
+    Missing files are included with mtimes of None; if any file was modified
+    too recently to be trusted, None is returned instead.
+    """
+    try:
+        st = os.stat(path)
+    except EnvironmentError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            raise
+        return [(path, None, None)]
+    if abs(now - st.st_mtime) < 2:
+        # racy; the file may change again without its mtime changing
+        return None
+    l = [(path, st.st_mtime, st.st_size)]
+    if os.path.isdir(path):
+        for x in sorted(os.listdir(path)):
+            files = _stat_files(pjoin(path, x), now)
+            if files is None:
+                return None
+            l.extend(files)
+    return l
+
+
+# repo files affecting the collapsed profile stack
+_repo_files = ('metadata/layout.conf', 'profiles/arch.list', 'profiles/repo_name')
+
+# names of ProfileStack attributes stored in its cache
+_cached_attrs = []
+
+
+def _cached_attr(func):
+    """Decorator creating a jit attribute stored in the profile stack cache."""
+    name = func.__name__
+    _cached_attrs.append(name)
+
+    def f(self):
+        data = self._load_cache()
+        if data is not None and name in data:
+            return data[name]
+        return func(self)
+    f.__name__, f.__doc__ = name, func.__doc__
+    return klass.jit_attr_named('_%s' % (name,))(f)
+
+
 class ProfileStack(object):
 
     _node_kls = ProfileNode
-
-    def __init__(self, profile):
+    _cache_version = 1
+
+    def __init__(self, profile, cache_location=None):
+        """
+        :param profile: path of the profile
+        :param cache_location: directory to cache the collapsed stack in,
+            caching is disabled if None
+        """
         self.profile = profile
         self.node = self._node_kls._autodetect_and_create(profile)
+        self.cache_location = cache_location
+        self._cache = None
+        self._cache_loaded = False
 
     @property
     def arch(self):
@@ -467,23 +540,23 @@ class ProfileStack(object):
         d.freeze()
         return d
 
-    @klass.jit_attr
+    @_cached_attr
     def forced_use(self):
         return self._collapse_use_dict("forced_use")
 
-    @klass.jit_attr
+    @_cached_attr
     def masked_use(self):
         return self._collapse_use_dict("masked_use")
 
-    @klass.jit_attr
+    @_cached_attr
     def stable_forced_use(self):
         return self._collapse_use_dict("stable_forced_use")
 
-    @klass.jit_attr
+    @_cached_attr
     def stable_masked_use(self):
         return self._collapse_use_dict("stable_masked_use")
 
-    @klass.jit_attr
+    @_cached_attr
     def pkg_use(self):
         return self._collapse_use_dict("pkg_use")
 
@@ -497,6 +570,10 @@ class ProfileStack(object):
 
     @klass.jit_attr
     def default_env(self):
+        return ImmutableDict(self._rendered_env.iteritems())
+
+    @_cached_attr
+    def _rendered_env(self):
         d = dict(self.node.default_env.iteritems())
         for incremental in const.incrementals:
             v = d.pop(incremental, '').split()
@@ -510,7 +587,7 @@ class ProfileStack(object):
                         (incremental, v))
                     if v:
                         d[incremental] = tuple(v)
-        return ImmutableDict(d.iteritems())
+        return d
 
     @property
     def profile_only_variables(self):
@@ -568,7 +645,7 @@ class ProfileStack(object):
             return frozenset(self.default_env.get("USE_EXPAND_UNPREFIXED", ()))
         return frozenset(self.default_env.get("USE_EXPAND_UNPREFIXED", "").split())
 
-    @klass.jit_attr
+    @_cached_attr
     def iuse_effective(self):
         # prefer main system profile; otherwise, fallback to custom user profile
         for profile in reversed(self.stack):
@@ -596,7 +673,7 @@ class ProfileStack(object):
     @klass.jit_attr
     def provides_repo(self):
         d = {}
-        for pkg in self._collapse_generic("pkg_provided"):
+        for pkg in self._pkg_provided:
             d.setdefault(pkg.category, {}).setdefault(pkg.package,
                          []).append(pkg.fullver)
         intermediate_parent = PkgProvidedParent()
@@ -610,34 +687,51 @@ class ProfileStack(object):
             repo.has_match = _empty_provides_has_match
         return repo
 
-    @klass.jit_attr
+    @_cached_attr
+    def _pkg_provided(self):
+        return self._collapse_generic("pkg_provided")
+
+    @_cached_attr
     def masks(self):
         return frozenset(chain(
             self._collapse_generic("masks"),
             self._collapse_generic("visibility")))
 
-    @klass.jit_attr
+    @_cached_attr
     def unmasks(self):
         return frozenset(chain.from_iterable(x.unmasks for x in self.stack))
 
-    @klass.jit_attr
+    @_cached_attr
     def keywords(self):
         return tuple(chain.from_iterable(x.keywords for x in self.stack))
 
-    @klass.jit_attr
+    @_cached_attr
     def accept_keywords(self):
         return tuple(chain.from_iterable(x.accept_keywords for x in self.stack))
 
+    @property
+    def _mask_stack(self):
+        """Nodes whose masks and unmasks are applied incrementally."""
+        return self.stack
+
     def _incremental_masks(self, stack_override=None):
         if stack_override is None:
-            stack_override = self.stack
+            return self._stacked_masks
         return [node.masks for node in stack_override]
 
     def _incremental_unmasks(self, stack_override=None):
         if stack_override is None:
-            stack_override = self.stack
+            return self._stacked_unmasks
         return [node.unmasks for node in stack_override]
 
+    @_cached_attr
+    def _stacked_masks(self):
+        return [node.masks for node in self._mask_stack]
+
+    @_cached_attr
+    def _stacked_unmasks(self):
+        return [node.unmasks for node in self._mask_stack]
+
     @klass.jit_attr
     def bashrcs(self):
         return tuple(x.bashrc for x in self.stack if x.bashrc is not None)
@@ -645,21 +739,139 @@ class ProfileStack(object):
     bashrc = klass.alias_attr("bashrcs")
     path = klass.alias_attr("node.path")
 
-    @klass.jit_attr
+    @_cached_attr
     def system(self):
         return self._collapse_generic('system')
 
+    @property
+    def cache_path(self):
+        """Location of the cache file of the stack, None if caching is disabled."""
+        if self.cache_location is None:
+            return None
+        key = '\0'.join(
+            [self.__class__.__name__] + [node.path for node in self.stack])
+        return pjoin(self.cache_location, md5(key).hexdigest())
+
+    def _cache_token(self):
+        """Return the stat info of all files the stack is built from.
+
+        None is returned if any of them are too recently modified to be trusted.
+        """
+        now = time.time()
+        token = [__version__]
+        repos = set()
+        for node in self.stack:
+            paths = [pjoin(node.path, x) for x in sorted(_node_files)]
+            repoconfig = node.repoconfig
+            if repoconfig is not None and repoconfig.location not in repos:
+                repos.add(repoconfig.location)
+                paths.extend(pjoin(repoconfig.location, x) for x in _repo_files)
+            for path in paths:
+                files = _stat_files(path, now)
+                if files is None:
+                    return None
+                token.extend(files)
+        return tuple(token)
+
+    def _load_cache(self):
+        """Return a mapping of cached attribute values, None if unavailable.
+
+        On a cache miss all cached attributes are computed and written to the
+        cache instead.
+        """
+        if self._cache_loaded:
+            return self._cache
+        # set first so attributes computed while updating bypass the cache
+        self._cache_loaded = True
+        path = self.cache_path
+        if path is None:
+            return None
+        token = self._cache_token()
+        if token is None:
+            return None
+        self._cache = self._read_cache(path, token)
+        if self._cache is None:
+            self._write_cache(path, token)
+        return self._cache
+
+    def _read_cache(self, path, token):
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("failed reading profile cache %r: %s", path, e)
+            return None
+        except compatibility.IGNORED_EXCEPTIONS:
+            raise
+        except Exception as e:
+            logger.warning("ignoring corrupt profile cache %r: %s", path, e)
+            return None
+        if not isinstance(data, dict) or data.get('version') != self._cache_version \
+                or data.get('token') != token:
+            return None
+        payload = data.get('payload')
+        if not isinstance(payload, bytes) or md5(payload).hexdigest() != data.get('checksum'):
+            logger.warning("ignoring profile cache %r failing its checksum", path)
+            return None
+        try:
+            return pickle.loads(payload)
+        except compatibility.IGNORED_EXCEPTIONS:
+            raise
+        except Exception as e:
+            logger.warning("ignoring corrupt profile cache %r: %s", path, e)
+            return None
+
+    def _write_cache(self, path, token):
+        # check first, building every cached attribute is wasted otherwise
+        if not ensure_dirs(self.cache_location, mode=0755) or \
+                not os.access(self.cache_location, os.W_OK | os.X_OK):
+            # caching is optional, e.g. unprivileged users can't update it
+            logger.debug(
+                "profile cache location %r isn't writable", self.cache_location)
+            return
+        values = {}
+        for attr in _cached_attrs:
+            # attributes failing to build are left to raise on access, while
+            # values that don't survive a round trip, e.g. restrictions from
+            # package.unmask globs, are recomputed on each load
+            try:
+                val = getattr(self, attr)
+                pickle.loads(pickle.dumps(val, pickle.HIGHEST_PROTOCOL))
+            except compatibility.IGNORED_EXCEPTIONS:
+                raise
+            except Exception:
+                continue
+            values[attr] = val
+        payload = pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
+        data = {
+            'version': self._cache_version,
+            'token': token,
+            'checksum': md5(payload).hexdigest(),
+            'payload': payload,
+        }
+        handler = None
+        try:
+            handler = AtomicWriteFile(path, binary=True)
+            pickle.dump(data, handler, pickle.HIGHEST_PROTOCOL)
+            handler.close()
+        except EnvironmentError as e:
+            logger.debug("failed writing profile cache %r: %s", path, e)
+        finally:
+            if handler is not None:
+                handler.discard()
+
 
 class OnDiskProfile(ProfileStack):
 
     pkgcore_config_type = ConfigHint(
-        {'basepath': 'str', 'profile': 'str'},
+        {'basepath': 'str', 'profile': 'str', 'cache_location': 'str'},
         required=('basepath', 'profile'),
         typename='profile',
     )
 
-    def __init__(self, basepath, profile, load_profile_base=True):
-        ProfileStack.__init__(self, pjoin(basepath, profile))
+    def __init__(self, basepath, profile, load_profile_base=True, cache_location=None):
+        ProfileStack.__init__(self, pjoin(basepath, profile), cache_location)
         self.basepath = basepath
         self.load_profile_base = load_profile_base
 
@@ -691,17 +903,12 @@ class OnDiskProfile(ProfileStack):
             l = (EmptyRootNode._autodetect_and_create(self.basepath),) + l
         return l
 
-    def _incremental_masks(self):
-        stack = self.stack
-        if self.load_profile_base:
-            stack = stack[1:]
-        return ProfileStack._incremental_masks(self, stack_override=stack)
-
-    def _incremental_unmasks(self):
+    @property
+    def _mask_stack(self):
         stack = self.stack
         if self.load_profile_base:
             stack = stack[1:]
-        return ProfileStack._incremental_unmasks(self, stack_override=stack)
+        return stack
 
 
 class UserProfileNode(ProfileNode):
@@ -724,13 +931,16 @@ class UserProfileNode(ProfileNode):
 class UserProfile(OnDiskProfile):
 
     pkgcore_config_type = ConfigHint(
-        {'user_path': 'str', 'parent_path': 'str', 'parent_profile': 'str'},
+        {'user_path': 'str', 'parent_path': 'str', 'parent_profile': 'str',
+         'cache_location': 'str'},
         required=('user_path', 'parent_path', 'parent_profile'),
         typename='profile',
     )
 
-    def __init__(self, user_path, parent_path, parent_profile, load_profile_base=True):
-        OnDiskProfile.__init__(self, parent_path, parent_profile, load_profile_base)
+    def __init__(self, user_path, parent_path, parent_profile, load_profile_base=True,
+                 cache_location=None):
+        OnDiskProfile.__init__(
+            self, parent_path, parent_profile, load_profile_base, cache_location)
         self.node = UserProfileNode(user_path, pjoin(parent_path, parent_profile))
 
 
@@ -9,10 +9,11 @@ __all__ = ("tree",)
 
 from functools import partial, wraps
 from itertools import imap, ifilterfalse
+import json
 import os
 import stat
 
-from snakeoil import klass
+from snakeoil import compatibility, klass
 from snakeoil.bash import iter_read_bash, read_dict
 from snakeoil.compatibility import intern, raise_from
 from snakeoil.containers import InvertedContains
@@ -29,17 +30,23 @@ from pkgcore.operations import repo as _repo_ops
 from pkgcore.repository import prototype, errors, configured
 
 demandload(
+    'atexit',
     'errno',
     'locale',
+    'time',
     'operator:attrgetter',
     'random:shuffle',
     'snakeoil.chksum:get_chksums',
     'snakeoil.data_source:local_source',
+    'snakeoil.fileutils:AtomicWriteFile',
+    'snakeoil.osutils:ensure_dirs',
     'snakeoil.sequences:iflatten_instance',
     'pkgcore:fetch',
     'pkgcore.ebuild:cpv,digest,ebd,repo_objs,atom,restricts,profiles,processor',
     'pkgcore.ebuild:errors@ebuild_errors',
+    'pkgcore.ebuild.metadata_index:MetadataIndex',
     'pkgcore.fs.livefs:sorted_scan',
+    'pkgcore.log:logger',
     'pkgcore.package:errors@pkg_errors',
     'pkgcore.restrictions:packages',
     'pkgcore.util.packages:groupby_pkg',
@@ -186,10 +193,11 @@ def _sort_eclasses(config, repo_config, eclasses):
         'eclass_override': 'ref:eclass_cache',
         'default_mirrors': 'list',
         'ignore_paludis_versioning': 'bool',
-        'allow_missing_manifests': 'bool'},
+        'allow_missing_manifests': 'bool', 'indexed': 'bool'},
     requires_config='config')
 def tree(config, repo_config, cache=(), eclass_override=None, default_mirrors=None,
-         ignore_paludis_versioning=False, allow_missing_manifests=False):
+         ignore_paludis_versioning=False, allow_missing_manifests=False,
+         indexed=False):
     eclass_override = _sort_eclasses(config, repo_config, eclass_override)
 
     try:
@@ -207,12 +215,112 @@ def tree(config, repo_config, cache=(), eclass_override=None, default_mirrors=No
         default_mirrors=default_mirrors,
         ignore_paludis_versioning=ignore_paludis_versioning,
         allow_missing_manifests=allow_missing_manifests,
-        repo_config=repo_config)
+        repo_config=repo_config, indexed=indexed)
 
 
 metadata_offset = "profiles"
 
 
+class _ListingIndex(object):
+    """Persistent index of the category, package, and version listings of a repo.
+
+    Each listing is tagged with its directory's mtime and revalidated on
+    access; adding or removing entries from a directory changes its mtime,
+    so a stat replaces reading the directory for unchanged listings.  The
+    index is written back on exit if anything changed.  It's stored in the
+    repo, so it's kept in JSON to stay data only.
+    """
+
+    version = 2
+
+    def __init__(self, location, path):
+        self.location = location
+        self.path = path
+        self._entries = None
+        self._dirty = False
+        self._registered = False
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or data.get('version') != self.version \
+                    or data.get('location') != self.location:
+                return {}
+            return {
+                str(relpath): (mtime, tuple(intern(str(x)) for x in listing))
+                for relpath, (mtime, listing) in data['entries'].iteritems()}
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("failed reading repo index %r: %s", self.path, e)
+            return {}
+        except compatibility.IGNORED_EXCEPTIONS:
+            raise
+        except Exception as e:
+            logger.warning("ignoring corrupt repo index %r: %s", self.path, e)
+            return {}
+
+    def flush(self):
+        """Write the index if it was modified."""
+        if not self._dirty:
+            return
+        data = {
+            'version': self.version,
+            'location': self.location,
+            'entries': self._entries,
+        }
+        handler = None
+        try:
+            try:
+                if not ensure_dirs(os.path.dirname(self.path), mode=0755):
+                    raise EnvironmentError(
+                        errno.EACCES, "failed creating directory", os.path.dirname(self.path))
+                handler = AtomicWriteFile(self.path)
+                json.dump(data, handler)
+                handler.close()
+                self._dirty = False
+            except EnvironmentError as e:
+                # unprivileged users just don't get the persistent index
+                logger.debug("failed writing repo index %r: %s", self.path, e)
+        finally:
+            if handler is not None:
+                handler.discard()
+
+    def get(self, relpath, listing_func):
+        """Return the listing of a directory.
+
+        :param relpath: directory path relative to the repo
+        :param listing_func: callable generating the listing if the indexed
+            one is missing or stale
+        """
+        if self._entries is None:
+            self._entries = self._read()
+        try:
+            # stat prior to listing; changes during the listing are caught
+            # by the next mtime check
+            mtime = os.stat(pjoin(self.location, relpath)).st_mtime
+        except EnvironmentError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            # let the listing func handle it
+            return listing_func()
+        entry = self._entries.get(relpath)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+        listing = listing_func()
+        if abs(time.time() - mtime) < 2:
+            # racy; the dir may change again without its mtime changing
+            # due to timestamp granularity, so force a relisting next time
+            mtime = None
+        if entry != (mtime, listing):
+            self._entries[relpath] = (mtime, listing)
+            self._dirty = True
+            if not self._registered:
+                self._registered = True
+                atexit.register(self.flush)
+        return listing
+
+
 class _UnconfiguredTree(prototype.tree):
     """Raw implementation supporting standard ebuild tree.
 
@@ -241,12 +349,17 @@ class _UnconfiguredTree(prototype.tree):
         'ignore_paludis_versioning': 'bool',
         'allow_missing_manifests': 'bool',
         'repo_config': 'ref:repo_config',
+        'indexed': 'bool',
         },
         typename='repo')
 
+    index_filename = 'pkg-index.json'
+    metadata_index_filename = 'pkg-metadata-index.json'
+
     def __init__(self, location, eclass_cache=None, masters=(), cache=(),
                  default_mirrors=None, ignore_paludis_versioning=False,
-                 allow_missing_manifests=False, repo_config=None):
+                 allow_missing_manifests=False, repo_config=None,
+                 indexed=False):
 
         """
         :param location: on disk location of the tree
@@ -260,6 +373,9 @@ class _UnconfiguredTree(prototype.tree):
             fetching from first, then falling back to other uri
         :param ignore_paludis_versioning: If False, fail when -scm is encountered.  if True,
             silently ignore -scm ebuilds.
+        :param indexed: keep a persistent index of the tree's categories,
+            packages, and versions in the repo's metadata dir, avoiding
+            directory reads for unchanged parts of the tree
         """
 
         prototype.tree.__init__(self)
@@ -314,6 +430,10 @@ class _UnconfiguredTree(prototype.tree):
         self.package_class = self.package_factory(
             self, cache, self.eclass_cache, self.mirrors, self.default_mirrors)
         self._shared_pkg_cache = WeakValCache()
+        self._index = None
+        if indexed:
+            self._index = _ListingIndex(
+                self.location, pjoin(self.location, 'metadata', self.index_filename))
 
     repo_id = klass.alias_attr("config.repo_id")
     repo_name = klass.alias_attr("config.repo_name")
@@ -377,6 +497,12 @@ class _UnconfiguredTree(prototype.tree):
         o.versions = self.versions
         return o
 
+    @klass.jit_attr
+    def metadata_index(self):
+        """Inverted index of package metadata, built via pmaint regen."""
+        return MetadataIndex(
+            self, pjoin(self.location, 'metadata', self.metadata_index_filename))
+
     @klass.jit_attr
     def hardcoded_categories(self):
         # try reading $LOC/profiles/categories if it's available.
@@ -399,6 +525,11 @@ class _UnconfiguredTree(prototype.tree):
                 categories.update(repo.hardcoded_categories)
         if categories:
             return tuple(categories)
+        if self._index is not None:
+            return self._index.get('', self._list_categories)
+        return self._list_categories()
+
+    def _list_categories(self):
         try:
             return tuple(imap(intern, ifilterfalse(
                 self.false_categories.__contains__,
@@ -407,6 +538,12 @@ class _UnconfiguredTree(prototype.tree):
             raise_from(KeyError("failed fetching categories: %s" % str(e)))
 
     def _get_packages(self, category):
+        if self._index is not None:
+            return self._index.get(
+                category.strip(os.path.sep), partial(self._list_packages, category))
+        return self._list_packages(category)
+
+    def _list_packages(self, category):
         cpath = pjoin(self.base, category.lstrip(os.path.sep))
         try:
             return tuple(ifilterfalse(
@@ -420,35 +557,42 @@ class _UnconfiguredTree(prototype.tree):
                 "failed fetching packages for category %s: %s" %
                 (pjoin(self.base, category.lstrip(os.path.sep)), str(e))))
 
-    def _get_versions(self, catpkg):
+    def _list_versions(self, catpkg):
         cppath = pjoin(self.base, catpkg[0], catpkg[1])
         pkg = catpkg[-1] + "-"
         lp = len(pkg)
         extension = self.extension
         ext_len = -len(extension)
         try:
-            ret = tuple(x[lp:ext_len] for x in listdir_files(cppath)
-                        if x[ext_len:] == extension and x[:lp] == pkg)
-            if any(('scm' in x or '-try' in x) for x in ret):
-                if not self.ignore_paludis_versioning:
-                    for x in ret:
-                        if 'scm' in x:
-                            raise ebuild_errors.InvalidCPV(
-                                "%s/%s-%s has nonstandard -scm "
-                                "version component" % (catpkg + (x,)))
-                        elif 'try' in x:
-                            raise ebuild_errors.InvalidCPV(
-                                "%s/%s-%s has nonstandard -try "
-                                "version component" % (catpkg + (x,)))
-                    raise AssertionError('unreachable codepoint was reached')
-                return tuple(x for x in ret
-                             if ('scm' not in x and 'try' not in x))
-            return ret
+            return tuple(x[lp:ext_len] for x in listdir_files(cppath)
+                         if x[ext_len:] == extension and x[:lp] == pkg)
         except EnvironmentError as e:
             raise_from(KeyError(
                 "failed fetching versions for package %s: %s" %
                 (pjoin(self.base, '/'.join(catpkg)), str(e))))
 
+    def _get_versions(self, catpkg):
+        if self._index is not None:
+            ret = self._index.get(
+                '/'.join(catpkg[:2]), partial(self._list_versions, catpkg))
+        else:
+            ret = self._list_versions(catpkg)
+        if any(('scm' in x or '-try' in x) for x in ret):
+            if not self.ignore_paludis_versioning:
+                for x in ret:
+                    if 'scm' in x:
+                        raise ebuild_errors.InvalidCPV(
+                            "%s/%s-%s has nonstandard -scm "
+                            "version component" % (catpkg + (x,)))
+                    elif 'try' in x:
+                        raise ebuild_errors.InvalidCPV(
+                            "%s/%s-%s has nonstandard -try "
+                            "version component" % (catpkg + (x,)))
+                raise AssertionError('unreachable codepoint was reached')
+            return tuple(x for x in ret
+                         if ('scm' not in x and 'try' not in x))
+        return ret
+
     def _get_ebuild_path(self, pkg):
         if pkg.revision is None:
             if pkg.fullver not in self.versions[(pkg.category, pkg.package)]:
@@ -527,17 +671,46 @@ class _UnconfiguredTree(prototype.tree):
                 'package.mask', ma))
         return [neg, pos]
 
+    def validate_metadata(self, category=None, threads=None):
+        """Bulk validate the metadata cache for a category or the entire repo.
+
+        Packages with valid cache entries have their metadata primed, see
+        :obj:`pkgcore.ebuild.ebuild_src.package_factory.validate_metadata`.
+
+        :param category: category to validate, defaults to all of them
+        :param threads: number of hashing threads, defaults to the cpu count
+        :return: tuple of valid and stale package lists
+        """
+        if category is None:
+            pkgs = list(self)
+        else:
+            pkgs = [
+                self.package_class(category, package, ver)
+                for package in self.packages.get(category, ())
+                for ver in self.versions[(category, package)]]
+        stale = self.package_class.validate_metadata(pkgs, threads=threads)
+        stale_ids = frozenset(id(pkg) for pkg in stale)
+        valid = [pkg for pkg in pkgs if id(pkg) not in stale_ids]
+        return valid, stale
+
     def _regen_operation_helper(self, **kwds):
         return _RegenOpHelper(
             self, force=bool(kwds.get('force', False)),
             eclass_caching=bool(kwds.get('eclass_caching', True)))
 
+    def _regen_operation_process_helper(self, **kwds):
+        return _ProcessRegenOpHelper(
+            self, force=bool(kwds.get('force', False)),
+            eclass_caching=bool(kwds.get('eclass_caching', True)))
+
 
 class _RegenOpHelper(object):
 
     def __init__(self, repo, force=False, eclass_caching=True):
         self.force = force
         self.eclass_caching = eclass_caching
+        # let warmed processors preload this repo's commonly used eclasses
+        processor.configure_processor_pool(eclass_cache=repo.eclass_cache)
         self.ebp = processor.request_ebuild_processor()
         if eclass_caching:
             self.ebp.allow_eclass_caching()
@@ -552,6 +725,43 @@ class _RegenOpHelper(object):
         self.ebp = None
 
 
+class _ProcessRegenOpHelper(object):
+    """Regen helper splitting metadata generation from cache updates.
+
+    Generation is done by forked worker processes, each owning its own ebuild
+    processor (and thus its own preloaded eclasses), while the parent process
+    does all cache writes.
+    """
+
+    def __init__(self, repo, force=False, eclass_caching=True):
+        self.repo = repo
+        self.force = force
+        self.eclass_caching = eclass_caching
+        self.ebp = None
+
+    def start_worker(self):
+        # processors inherited from the parent belong to it
+        processor.forget_all_processors()
+        self.ebp = processor.request_ebuild_processor()
+        if self.eclass_caching:
+            self.ebp.allow_eclass_caching()
+
+    def generate(self, cpv):
+        pkg = self.repo[cpv]
+        return pkg._parent._get_raw_metadata(
+            pkg, ebp=self.ebp, force_regen=self.force)
+
+    def store(self, cpv, data):
+        pkg = self.repo[cpv]
+        pkg._parent._store_metadata(pkg, data)
+
+    def finish_worker(self):
+        processor.release_ebuild_processor(self.ebp)
+        self.ebp = None
+        # workers exit without running atexit hooks
+        processor.shutdown_all_processors()
+
+
 class _ConfiguredTree(configured.tree):
     """Wrapper around a :obj:`_UnconfiguredTree` binding build/configuration data (USE)."""
 
@@ -618,8 +828,14 @@ class _ConfiguredTree(configured.tree):
 
     @_wrap_attr(config_wrappables)
     def _iuse_effective(self, raw_pkg_iuse_effective, _enabled_use, pkg):
-        profile_iuse_effective = self.domain.profile.iuse_effective
-        return frozenset(profile_iuse_effective.union(raw_pkg_iuse_effective))
+        universe = self.domain.use_universe
+        return universe.from_mask(
+            self._profile_iuse_effective | universe.mask(raw_pkg_iuse_effective))
+
+    @klass.jit_attr
+    def _profile_iuse_effective(self):
+        """Bitmask of the flags implicitly in IUSE for all packages."""
+        return self.domain.use_universe.mask(self.domain.profile.iuse_effective)
 
     @_wrap_attr(config_wrappables)
     def _distfiles(self, _raw_pkg_distfiles, enabled_use, pkg):
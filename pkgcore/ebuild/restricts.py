@@ -8,13 +8,19 @@
 atom version restrict
 """
 
-__all__ = ("VersionMatch",)
+__all__ = ("VersionMatch", "DependencyMatch")
 
+from snakeoil.demandload import demandload
 from snakeoil.klass import generic_equality
 
 from pkgcore.ebuild import cpv, errors
 from pkgcore.restrictions import packages, restriction, values
 
+demandload(
+    'snakeoil.sequences:iflatten_instance',
+    'pkgcore.ebuild:atom',
+)
+
 
 # TODO: change values.EqualityMatch so it supports le, lt, gt, ge, eq,
 # ne ops, and convert this to it.
@@ -286,6 +292,49 @@ class UseDepDefault(packages.PackageRestrictionMulti):
         packages.PackageRestrictionMulti.__init__(self, ('iuse', 'use'), v)
 
 
+class DependencyMatch(values.base):
+    """Match any dependency atom on a set of package keys.
+
+    Only atoms on the given keys are checked against the child restriction,
+    allowing dependency indexes to look up candidate packages by key.
+    """
+
+    __slots__ = __attr_comparison__ = ('keys', 'restriction', 'negate')
+    __metaclass__ = generic_equality
+
+    def __init__(self, keys, childrestriction, negate=False):
+        """
+        :param keys: iterable of package keys, e.g. 'dev-util/foo'
+        :param childrestriction: restriction applied to atoms on those keys
+        """
+        sf = object.__setattr__
+        sf(self, "keys", frozenset(keys))
+        sf(self, "restriction", childrestriction)
+        sf(self, "negate", negate)
+
+    def match(self, val):
+        keys = self.keys
+        match = self.restriction.match
+        for x in iflatten_instance(val, atom.atom):
+            if getattr(x, 'key', None) in keys and match(x):
+                return not self.negate
+        return self.negate
+
+    def __hash__(self):
+        return hash((self.keys, self.restriction, self.negate))
+
+    def __str__(self):
+        s = 'dependency on %s: %s' % (', '.join(sorted(self.keys)), self.restriction)
+        if self.negate:
+            return 'not ' + s
+        return s
+
+    def __repr__(self):
+        return '<%s keys=%r restriction=%r negate=%r @%#8x>' % (
+            self.__class__.__name__, sorted(self.keys), self.restriction,
+            self.negate, id(self))
+
+
 def _parse_nontransitive_use(sequence):
     default_off = [[], []]
     default_on = [[], []]
@@ -29,6 +29,7 @@ demandload(
     'fnmatch',
     'snakeoil:compatibility',
     'pkgcore:os_data',
+    'pkgcore.repository.util:get_raw_repos',
 )
 
 colon_parsed = frozenset([
@@ -146,6 +147,7 @@ class env_update(triggers.base):
     required_csets = ()
     priority = 5
     _hooks = ('post_unmerge', 'post_merge')
+    requires_image = False
 
     def trigger(self, engine):
         perform_env_update(engine.offset)
@@ -213,6 +215,9 @@ class ConfigProtectInstall(triggers.base):
     required_csets = ('install_existing', 'install')
     priority = 100
     _hooks = ('pre_merge',)
+    # checksums protected files prior to merging and reorders the renamed
+    # ones, breaking merging in archive order
+    requires_image = True
 
     def __init__(self, extra_protects=(), extra_disables=()):
         triggers.base.__init__(self)
@@ -292,6 +297,7 @@ class ConfigProtectInstall_restore(triggers.base):
     required_csets = ('install',)
     priority = 10
     _hooks = ('post_merge',)
+    requires_image = False
 
     pkgcore_config_type = None
 
@@ -313,6 +319,7 @@ class ConfigProtectUninstall(triggers.base):
 
     required_csets = ('uninstall_existing', 'uninstall')
     _hooks = ('pre_unmerge',)
+    requires_image = False
 
     pkgcore_config_type = None
 
@@ -341,6 +348,7 @@ class UninstallIgnore(triggers.base):
 
     required_csets = ('uninstall_existing', 'uninstall')
     _hooks = ('pre_unmerge',)
+    requires_image = False
 
     pkgcore_config_type = None
 
@@ -391,6 +399,7 @@ class FileCollision(triggers.base):
 
     _hooks = ('sanity_check',)
     _engine_types = triggers.INSTALLING_MODES
+    requires_image = False
 
     suppress_exceptions = False
 
@@ -454,14 +463,24 @@ class ProtectOwned(FileCollision):
         self.vdb = vdb
 
     def collision(self, colliding):
-        real_pkgs = (pkg for repo in self.vdb for pkg in repo if pkg.package_is_real)
         collisions = {}
-
-        # TODO: worth parallelizing this vdb scanning?
-        for pkg in real_pkgs:
-            pkg_file_collisions = pkg.contents.intersection(colliding)
-            if pkg_file_collisions:
-                collisions[pkg.cpvstr] = pkg_file_collisions
+        colliding_paths = None
+
+        for repo in get_raw_repos(list(self.vdb)):
+            if hasattr(repo, 'owners'):
+                # use the vdb's reverse index
+                if colliding_paths is None:
+                    colliding_paths = {x.location: x for x in colliding}
+                for path, owners in repo.owners(colliding_paths).iteritems():
+                    for cpvstr in owners:
+                        collisions.setdefault(cpvstr, set()).add(colliding_paths[path])
+                continue
+            for pkg in repo:
+                if not pkg.package_is_real:
+                    continue
+                pkg_file_collisions = pkg.contents.intersection(colliding)
+                if pkg_file_collisions:
+                    collisions[pkg.cpvstr] = pkg_file_collisions
 
         if collisions:
             pkg_collisions = [
@@ -480,6 +499,7 @@ class install_into_symdir_protect(triggers.base):
         const.INSTALL_MODE: ('install', 'install_existing'),
         const.REPLACE_MODE: ('install', 'install_existing', 'old_cset')
     }
+    requires_image = False
 
     _hooks = ('sanity_check',)
     _engine_types = triggers.INSTALLING_MODES
@@ -552,6 +572,7 @@ class SFPerms(triggers.base):
     required_csets = ('new_cset',)
     _hooks = ('pre_merge',)
     _engine_types = triggers.INSTALLING_MODES
+    requires_image = False
 
     def trigger(self, engine, cset):
         resets = []
@@ -597,6 +618,7 @@ def register_multilib_strict_trigger(domain_settings):
 class FixImageSymlinks(triggers.base):
     required_csets = ('new_cset',)
     _hooks = ('pre_merge',)
+    requires_image = False
 
     pkgcore_config_type = None
 
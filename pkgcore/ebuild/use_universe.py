@@ -0,0 +1,229 @@
+# License: GPL2/BSD
+
+"""
+integer bitmask backed USE flag sets
+
+Configuring packages builds a number of USE flag sets per package: forced
+and masked flags from the profile stack, and the effective IUSE which
+includes every implicit and USE_EXPAND flag the profile knows about.  As
+frozensets these cost both memory and rebuilds per package.  A domain
+instead interns the flags it sees into a :obj:`UseUniverse`, representing
+each set as an integer with one bit per flag; set operations between sets
+of the same universe become integer operations, and membership tests a
+single bit test.
+"""
+
+__all__ = ("UseUniverse", "UseFlagSet")
+
+from collections import Set
+from weakref import WeakValueDictionary
+
+
+class UseUniverse(object):
+    """Interned USE flags of a domain, mapping each flag to a bit."""
+
+    def __init__(self):
+        self._bits = {}
+        self._flags = []
+        # (neg, pos) chunk payloads mapped to their masks
+        self._chunks = {}
+        self._sets = WeakValueDictionary()
+
+    def __len__(self):
+        return len(self._flags)
+
+    def __contains__(self, flag):
+        return flag in self._bits
+
+    def mask(self, flags):
+        """Return the bitmask of an iterable of flags, interning new ones."""
+        if isinstance(flags, UseFlagSet) and flags.universe is self:
+            return flags.mask
+        bits = self._bits
+        mask = 0
+        for flag in flags:
+            bit = bits.get(flag)
+            if bit is None:
+                bit = bits[flag] = 1 << len(self._flags)
+                self._flags.append(flag)
+            mask |= bit
+        return mask
+
+    def known_mask(self, flags):
+        """Return the bitmask of an iterable of flags, ignoring unknown ones."""
+        if isinstance(flags, UseFlagSet) and flags.universe is self:
+            return flags.mask
+        bits = self._bits
+        mask = 0
+        for flag in flags:
+            mask |= bits.get(flag, 0)
+        return mask
+
+    def iter_flags(self, mask):
+        """Iterate over the flags set in a bitmask."""
+        flags = self._flags
+        while mask:
+            low = mask & -mask
+            yield flags[low.bit_length() - 1]
+            mask ^= low
+
+    def flagset(self, flags=()):
+        """Return the :obj:`UseFlagSet` of an iterable of flags."""
+        return self.from_mask(self.mask(flags))
+
+    def from_mask(self, mask):
+        """Return the :obj:`UseFlagSet` of a bitmask.
+
+        Equal sets are shared while in use.
+        """
+        obj = self._sets.get(mask)
+        if obj is None:
+            obj = self._sets[mask] = UseFlagSet(self, mask)
+        return obj
+
+    def render_chunks(self, chunks, mask=0):
+        """Incrementally apply chunked data to a bitmask.
+
+        :param chunks: iterable of :obj:`pkgcore.ebuild.misc.chunked_data`
+            instances, their negations applied prior to their additions
+        :return: :obj:`UseFlagSet` instance
+        """
+        cache = self._chunks
+        for chunk in chunks:
+            key = (chunk.neg, chunk.pos)
+            masks = cache.get(key)
+            if masks is None:
+                masks = cache[key] = (~self.mask(chunk.neg), self.mask(chunk.pos))
+            mask = (mask & masks[0]) | masks[1]
+        return self.from_mask(mask)
+
+
+class UseFlagSet(object):
+    """Immutable set of USE flags stored as a bitmask of a :obj:`UseUniverse`.
+
+    Compares equal to other sets holding the same flags.  Universes are
+    per domain, so these are pickled as plain frozensets.
+    """
+
+    __slots__ = ("universe", "mask", "_hash", "__weakref__")
+
+    def __init__(self, universe, mask=0):
+        object.__setattr__(self, 'universe', universe)
+        object.__setattr__(self, 'mask', mask)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("%s is immutable" % (self.__class__.__name__,))
+
+    __delattr__ = __setattr__
+
+    def _other_mask(self, other, known=True):
+        if isinstance(other, UseFlagSet) and other.universe is self.universe:
+            return other.mask
+        if known:
+            return self.universe.known_mask(other)
+        return self.universe.mask(other)
+
+    def __contains__(self, flag):
+        bit = self.universe._bits.get(flag)
+        return bit is not None and bool(self.mask & bit)
+
+    def __iter__(self):
+        return self.universe.iter_flags(self.mask)
+
+    def __len__(self):
+        return bin(self.mask).count('1')
+
+    def __nonzero__(self):
+        return bool(self.mask)
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            val = hash(frozenset(self))
+            object.__setattr__(self, '_hash', val)
+            return val
+
+    def __reduce__(self):
+        return frozenset, (tuple(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __eq__(self, other):
+        if isinstance(other, UseFlagSet) and other.universe is self.universe:
+            return self.mask == other.mask
+        if not isinstance(other, Set):
+            return NotImplemented
+        return len(self) == len(other) and self.issuperset(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def union(self, *others):
+        mask = self.mask
+        for other in others:
+            mask |= self._other_mask(other, known=False)
+        return self.universe.from_mask(mask)
+
+    def intersection(self, *others):
+        mask = self.mask
+        for other in others:
+            mask &= self._other_mask(other)
+        return self.universe.from_mask(mask)
+
+    def difference(self, *others):
+        mask = self.mask
+        for other in others:
+            mask &= ~self._other_mask(other)
+        return self.universe.from_mask(mask)
+
+    def symmetric_difference(self, other):
+        return self.universe.from_mask(
+            self.mask ^ self._other_mask(other, known=False))
+
+    def __rsub__(self, other):
+        if not isinstance(other, Set):
+            return NotImplemented
+        # flags of other unknown to the universe are kept
+        return frozenset(x for x in other if x not in self)
+
+    def isdisjoint(self, other):
+        return not self.mask & self._other_mask(other)
+
+    def issubset(self, other):
+        if isinstance(other, UseFlagSet) and other.universe is self.universe:
+            return not self.mask & ~other.mask
+        other = frozenset(other)
+        return all(x in other for x in self)
+
+    def issuperset(self, other):
+        if isinstance(other, UseFlagSet) and other.universe is self.universe:
+            return not other.mask & ~self.mask
+        return all(x in self for x in other)
+
+    def __lt__(self, other):
+        if not isinstance(other, Set):
+            return NotImplemented
+        return len(self) < len(other) and self.issubset(other)
+
+    def __gt__(self, other):
+        if not isinstance(other, Set):
+            return NotImplemented
+        return len(self) > len(other) and self.issuperset(other)
+
+    __or__ = __ror__ = union
+    __and__ = __rand__ = intersection
+    __xor__ = __rxor__ = symmetric_difference
+    __sub__ = difference
+    __le__ = issubset
+    __ge__ = issuperset
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, sorted(self))
+
+
+Set.register(UseFlagSet)
@@ -9,6 +9,7 @@ __all__ = ("MalformedCommand", "fetcher",)
 
 import os
 import sys
+import threading
 
 from snakeoil.osutils import ensure_dirs, pjoin
 from snakeoil.compatibility import raise_from
@@ -30,12 +31,13 @@ class fetcher(base.fetcher):
 
     pkgcore_config_type = ConfigHint(
         {'userpriv': 'bool', 'required_chksums': 'list',
-         'distdir': 'str', 'command': 'str', 'resume_command': 'str'},
+         'distdir': 'str', 'command': 'str', 'resume_command': 'str',
+         'per_mirror_jobs': 'int'},
         allow_unknowns=True)
 
     def __init__(self, distdir, command, resume_command=None,
                  required_chksums=None, userpriv=True, attempts=10,
-                 readonly=False, **extra_env):
+                 readonly=False, per_mirror_jobs=2, **extra_env):
         """
         :param distdir: directory to download files to
         :type distdir: string
@@ -49,6 +51,8 @@ class fetcher(base.fetcher):
         :param userpriv: depriv for fetching?
         :param attempts: max number of attempts before failing the fetch
         :param readonly: controls whether fetching is allowed
+        :param per_mirror_jobs: max number of concurrent fetches from a
+            single host when fetching in parallel
         """
         base.fetcher.__init__(self)
         self.distdir = distdir
@@ -86,6 +90,25 @@ class fetcher(base.fetcher):
         self.userpriv = userpriv
         self.readonly = readonly
         self.extra_env = extra_env
+        self.per_mirror_jobs = max(per_mirror_jobs, 1)
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._file_locks = {}
+
+    def _host_slot(self, uri):
+        """Return the semaphore limiting concurrent fetches from a uri's host."""
+        host = uri.split('://', 1)[-1].split('/', 1)[0]
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(
+                    self.per_mirror_jobs)
+            return slot
+
+    def _file_lock(self, filename):
+        """Return the lock serializing fetches of a distfile."""
+        with self._lock:
+            return self._file_locks.setdefault(filename, threading.Lock())
 
     def fetch(self, target):
         """
@@ -115,6 +138,11 @@ class fetcher(base.fetcher):
         fp = pjoin(self.distdir, target.filename)
         filename = os.path.basename(fp)
 
+        # packages fetched in parallel may share distfiles
+        with self._file_lock(filename):
+            return self._fetch(target, fp, filename)
+
+    def _fetch(self, target, fp, filename):
         uri = iter(target.uri)
         if self.userpriv and is_userpriv_capable():
             extra = {"uid": portage_uid, "gid": portage_gid}
@@ -150,7 +178,8 @@ class fetcher(base.fetcher):
                     # verify portion of the loop handles this. iow,
                     # don't trust their exit code. trust our chksums
                     # instead.
-                    spawn_bash(command % {"URI": u, "FILE": filename}, **extra)
+                    with self._host_slot(u):
+                        spawn_bash(command % {"URI": u, "FILE": filename}, **extra)
                 attempts -= 1
             assert last_exc is not None
             raise last_exc[0], last_exc[1], last_exc[2]
@@ -0,0 +1,99 @@
+# License: GPL2/BSD
+
+"""
+background scheduling of package fetches
+"""
+
+__all__ = ("FetchScheduler",)
+
+import sys
+import threading
+
+from snakeoil import compatibility
+
+
+class FetchScheduler(object):
+    """Fetch the files for multiple packages in parallel.
+
+    Fetch jobs are run in the order they were added by a pool of worker
+    threads while consumers wait on specific jobs, allowing the files for
+    later packages to be fetched while earlier ones are being built.
+    Per mirror concurrency is limited by the fetcher itself.
+    """
+
+    def __init__(self, jobs):
+        """
+        :param jobs: number of concurrent fetch jobs
+        """
+        self.jobs = max(jobs, 1)
+        self._jobs = []
+        self._results = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._shutdown = False
+
+    def add(self, key, functor, *args, **kwds):
+        """Queue a fetch job.
+
+        :param key: hashable key identifying the job
+        :param functor: callable doing the fetching, returning its status
+        """
+        with self._cond:
+            self._jobs.append((key, functor, args, kwds))
+            self._cond.notify()
+
+    def start(self):
+        """Start fetching in the background."""
+        for x in xrange(min(self.jobs, len(self._jobs))):
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                if self._shutdown or not self._jobs:
+                    return
+                key, functor, args, kwds = self._jobs.pop(0)
+            try:
+                result = (True, functor(*args, **kwds))
+            except compatibility.IGNORED_EXCEPTIONS:
+                raise
+            except Exception:
+                result = (False, sys.exc_info())
+            with self._cond:
+                self._results[key] = result
+                self._cond.notify_all()
+
+    def __contains__(self, key):
+        with self._cond:
+            return key in self._results or any(key == x[0] for x in self._jobs)
+
+    def wait(self, key):
+        """Wait for a fetch job to finish, returning its result.
+
+        Exceptions thrown by the job are reraised here.
+        """
+        with self._cond:
+            while key not in self._results:
+                if not self._threads or not any(t.is_alive() for t in self._threads):
+                    raise KeyError(key)
+                # timeout so signals aren't blocked
+                self._cond.wait(0.5)
+            success, result = self._results.pop(key)
+        if not success:
+            raise result[0], result[1], result[2]
+        return result
+
+    def shutdown(self, wait=True):
+        """Cancel queued fetch jobs.
+
+        :param wait: wait on the running jobs to finish
+        """
+        with self._cond:
+            self._shutdown = True
+            self._jobs = []
+        if wait:
+            for t in self._threads:
+                t.join()
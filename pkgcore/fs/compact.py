@@ -0,0 +1,745 @@
+# License: GPL2/BSD
+
+"""
+compact contents sets
+
+A :obj:`pkgcore.fs.contents.contentsSet` holds a full fs object per entry,
+each with its own attribute storage, checksum mapping and data source; for
+packages with hundreds of thousands of files the csets a merge engine holds
+at once add up to hundreds of MB.  :obj:`CompactContentsSet` instead stores
+entries in columns sorted by location- interned paths plus arrays of modes,
+ownership, mtimes, device/inode numbers, sizes and md5s- creating fs objects
+on access.  Set operations between compact sets walk the sorted paths and
+copy column slices without creating any fs objects.
+"""
+
+__all__ = ("CompactContentsSet",)
+
+from array import array
+from binascii import hexlify, unhexlify
+from bisect import bisect_left
+from operator import itemgetter
+import os
+from stat import S_IFMT, S_IFREG, S_IFDIR, S_IFLNK, S_IFIFO
+
+from snakeoil.chksum import get_handlers
+from snakeoil.data_source import local_source
+from snakeoil.osutils import normpath, pjoin
+
+from pkgcore.fs import fs
+from pkgcore.fs.contents import contentsSet
+
+# entry kinds, stored in the low bits of the flags column
+_REG, _DIR, _SYM, _FIFO, _DEV = range(5)
+# entries that don't fit the columns are kept as objects in the extra column
+_OBJ = 7
+_KIND_MASK = 7
+# file checksums are computed on demand using the default handlers
+_LAZY_CHKSUMS = 1 << 3
+_HAS_MD5 = 1 << 4
+# the mtime is an integer rather than a float
+_INT_MTIME = 1 << 5
+
+_classes = (fs.fsFile, fs.fsDir, fs.fsSymlink, fs.fsFifo, fs.fsDev)
+_kinds = {cls: kind for kind, cls in enumerate(_classes)}
+_kind_attrs = ('is_reg', 'is_dir', 'is_sym', 'is_fifo', 'is_dev')
+
+# integer columns; -1 marks unset attributes
+_int_attrs = ('mode', 'uid', 'gid', 'dev', 'inode')
+_SIZE = len(_int_attrs)
+_max_int = 2 ** (array('l').itemsize * 8 - 1) - 1
+
+_nan = float('nan')
+_no_md5 = '\0' * 16
+_chksum_keys = frozenset(['md5', 'size'])
+_default_chf_types = []
+_int_types = (int, long)
+_missing = object()
+_first = itemgetter(0)
+
+
+def _valid_int(value, limit=_max_int):
+    return value.__class__ in _int_types and 0 <= value <= limit
+
+
+def _is_default_lazy(chksums):
+    """Check if lazy checksums are unloaded and use the default handlers."""
+    if chksums._keys_func is not None or chksums._vals:
+        return False
+    if not _default_chf_types:
+        _default_chf_types.append(frozenset(get_handlers()))
+    return frozenset(chksums._keys) == _default_chf_types[0]
+
+
+def _encode(obj):
+    """Return the column values of an fs object, None if it has to be kept.
+
+    Unset attributes are stored as their defaults, reading the same.
+    """
+    kind = _kinds.get(obj.__class__)
+    if kind is None:
+        return None
+    flags = kind
+    if kind == _REG:
+        ints = [obj.mode, obj.uid, obj.gid, obj.dev, obj.inode, None]
+    else:
+        ints = [obj.mode, obj.uid, obj.gid, None, None, None]
+    for pos, value in enumerate(ints):
+        if value is None:
+            ints[pos] = -1
+        elif not _valid_int(value):
+            return None
+
+    mtime = obj.mtime
+    if mtime is None:
+        mtime = _nan
+    elif mtime.__class__ in _int_types and abs(mtime) <= 2 ** 53:
+        flags |= _INT_MTIME
+        mtime = float(mtime)
+    elif mtime.__class__ is not float:
+        return None
+
+    md5 = _no_md5
+    extra = None
+    if kind == _REG:
+        data = obj.data
+        if data.__class__ is not local_source or data.mutable or \
+                data.encoding is not None:
+            return None
+        if data.path != obj.location:
+            extra = data.path
+        chksums = obj.chksums
+        if chksums.__class__ is fs._LazyChksums:
+            if not _is_default_lazy(chksums):
+                return None
+            flags |= _LAZY_CHKSUMS
+        elif chksums.__class__ is dict and _chksum_keys.issuperset(chksums):
+            md5_val = chksums.get('md5', _missing)
+            if md5_val is not _missing:
+                if not _valid_int(md5_val, 2 ** 128 - 1):
+                    return None
+                flags |= _HAS_MD5
+                md5 = unhexlify('%032x' % md5_val)
+            size = chksums.get('size', _missing)
+            if size is not _missing:
+                if not _valid_int(size):
+                    return None
+                ints[_SIZE] = size
+        else:
+            return None
+    elif kind == _SYM:
+        extra = obj.target
+        if not isinstance(extra, basestring):
+            return None
+    elif kind == _DEV:
+        extra = (obj.major, obj.minor)
+    return flags, ints, mtime, md5, extra
+
+
+class _Columns(object):
+    """Column storage of fs objects sorted by location.
+
+    Instances aren't modified once built, so they're shared between sets.
+    """
+
+    __slots__ = ('paths', 'extra', 'flags', 'ints', 'mtime', 'md5')
+
+    def __init__(self):
+        self.paths = []
+        # symlink targets, data source paths of files, device numbers, or
+        # the objects that don't fit the columns
+        self.extra = []
+        self.flags = array('B')
+        self.ints = tuple(array('l') for _ in xrange(_SIZE + 1))
+        self.mtime = array('d')
+        self.md5 = bytearray()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def append(self, obj):
+        """Add an fs object, sorting after all current entries."""
+        path = obj.location
+        if path.__class__ is str:
+            path = intern(path)
+        self.paths.append(path)
+        values = _encode(obj)
+        if values is None:
+            self.flags.append(_OBJ)
+            for col in self.ints:
+                col.append(-1)
+            self.mtime.append(_nan)
+            self.md5.extend(_no_md5)
+            self.extra.append(obj)
+            return
+        flags, ints, mtime, md5, extra = values
+        self.flags.append(flags)
+        for col, value in zip(self.ints, ints):
+            col.append(value)
+        self.mtime.append(mtime)
+        self.md5.extend(md5)
+        self.extra.append(extra)
+
+    def append_stat(self, path, real_location, st):
+        """Add an entry from its stat result, sorting after all current entries.
+
+        Stores what :obj:`pkgcore.fs.livefs.gen_obj` would create using the
+        default checksum handlers, without creating it.
+
+        :return: False if the stat result doesn't fit the columns
+        """
+        mode = st.st_mode
+        fmt = S_IFMT(mode)
+        extra = None
+        if fmt == S_IFREG:
+            flags = _REG | _LAZY_CHKSUMS
+            ints = (mode & 07777, st.st_uid, st.st_gid, st.st_dev, st.st_ino)
+            if real_location != path:
+                extra = real_location
+        elif fmt == S_IFDIR:
+            flags = _DIR
+            ints = (mode & 07777, st.st_uid, st.st_gid)
+        elif fmt == S_IFLNK:
+            flags = _SYM
+            ints = (mode & 07777, st.st_uid, st.st_gid)
+            extra = os.readlink(real_location)
+        elif fmt == S_IFIFO:
+            flags = _FIFO
+            ints = (mode & 07777, st.st_uid, st.st_gid)
+        else:
+            flags = _DEV
+            ints = (mode, st.st_uid, st.st_gid)
+            extra = fs.get_major_minor(st)
+        for value in ints:
+            if not _valid_int(value):
+                return False
+        mtime = st.st_mtime
+        if mtime.__class__ is not float:
+            flags |= _INT_MTIME
+            mtime = float(mtime)
+
+        if path.__class__ is str:
+            path = intern(path)
+        self.paths.append(path)
+        self.flags.append(flags)
+        for col, value in zip(self.ints, ints):
+            col.append(value)
+        for col in self.ints[len(ints):]:
+            col.append(-1)
+        self.mtime.append(mtime)
+        self.md5.extend(_no_md5)
+        self.extra.append(extra)
+        return True
+
+    @classmethod
+    def from_stats(cls, entries):
+        """Build an instance from (location, real location, stat) tuples.
+
+        The columns are filled in bulk, which is several times faster than
+        appending entries one by one.
+
+        :param entries: tuples sorted by location
+        :return: None if any of the entries don't fit the columns
+        """
+        rows = []
+        append = rows.append
+        for path, real_location, st in entries:
+            mode = st.st_mode
+            fmt = mode & 0170000
+            if fmt == S_IFREG:
+                append((path, _REG | _LAZY_CHKSUMS, mode & 07777, st.st_uid, st.st_gid,
+                        st.st_dev, st.st_ino, st.st_mtime,
+                        None if real_location == path else real_location))
+            elif fmt == S_IFDIR:
+                append((path, _DIR, mode & 07777, st.st_uid, st.st_gid,
+                        -1, -1, st.st_mtime, None))
+            elif fmt == S_IFLNK:
+                append((path, _SYM, mode & 07777, st.st_uid, st.st_gid,
+                        -1, -1, st.st_mtime, os.readlink(real_location)))
+            elif fmt == S_IFIFO:
+                append((path, _FIFO, mode & 07777, st.st_uid, st.st_gid,
+                        -1, -1, st.st_mtime, None))
+            else:
+                append((path, _DEV, mode, st.st_uid, st.st_gid,
+                        -1, -1, st.st_mtime, fs.get_major_minor(st)))
+        new = cls()
+        if not rows:
+            return new
+        paths, flags, mode, uid, gid, dev, inode, mtime, extra = zip(*rows)
+        del rows
+        if not all(x.__class__ is float for x in mtime):
+            return None
+        try:
+            new.flags = array('B', flags)
+            new.ints = tuple(array('l', col) for col in (mode, uid, gid, dev, inode))
+        except OverflowError:
+            return None
+        new.ints += (array('l', [-1]) * len(paths),)
+        new.mtime = array('d', mtime)
+        new.md5 = bytearray(_no_md5 * len(paths))
+        new.paths = [intern(x) if x.__class__ is str else x for x in paths]
+        new.extra = list(extra)
+        return new
+
+    def extend(self, other, start, end):
+        """Add the entries of a range of another instance."""
+        if start >= end:
+            return
+        self.paths.extend(other.paths[start:end])
+        self.extra.extend(other.extra[start:end])
+        self.flags.extend(other.flags[start:end])
+        for col, other_col in zip(self.ints, other.ints):
+            col.extend(other_col[start:end])
+        self.mtime.extend(other.mtime[start:end])
+        self.md5.extend(other.md5[start * 16:end * 16])
+
+    def take(self, indices):
+        """Return a new instance holding the entries at ascending indices."""
+        new = _Columns()
+        start = end = None
+        for i in indices:
+            if i == end:
+                end += 1
+                continue
+            if start is not None:
+                new.extend(self, start, end)
+            start, end = i, i + 1
+        if start is not None:
+            new.extend(self, start, end)
+        return new
+
+    def index(self, path):
+        """Return the index of a path, None if it isn't stored."""
+        i = bisect_left(self.paths, path)
+        if i < len(self.paths) and self.paths[i] == path:
+            return i
+        return None
+
+    def child_range(self, path):
+        """Return the (start, end) index range of the entries below a path."""
+        prefix = path.rstrip(os.path.sep) + os.path.sep
+        start = bisect_left(self.paths, prefix)
+        # '0' directly follows the path separator
+        return start, bisect_left(self.paths, prefix[:-1] + '0', start)
+
+    def is_kind(self, i, kind):
+        flags = self.flags[i] & _KIND_MASK
+        if flags == _OBJ:
+            return getattr(self.extra[i], _kind_attrs[kind])
+        return flags == kind
+
+    def get(self, i):
+        """Return the fs object of an index."""
+        flags = self.flags[i]
+        kind = flags & _KIND_MASK
+        extra = self.extra[i]
+        if kind == _OBJ:
+            return extra
+        d = {}
+        for attr, col in zip(_int_attrs, self.ints):
+            if col[i] != -1:
+                d[attr] = col[i]
+        mtime = self.mtime[i]
+        if mtime == mtime:
+            d['mtime'] = long(mtime) if flags & _INT_MTIME else mtime
+        path = self.paths[i]
+        if kind == _REG:
+            if extra is not None:
+                d['data'] = local_source(extra)
+            if not flags & _LAZY_CHKSUMS:
+                chksums = d['chksums'] = {}
+                if flags & _HAS_MD5:
+                    chksums['md5'] = long(hexlify(self.md5[i * 16:i * 16 + 16]), 16)
+                if self.ints[_SIZE][i] != -1:
+                    chksums['size'] = self.ints[_SIZE][i]
+            return fs.fsFile(path, strict=False, **d)
+        elif kind == _SYM:
+            return fs.fsSymlink(path, extra, strict=False, **d)
+        elif kind == _DEV:
+            return fs.fsDev(path, major=extra[0], minor=extra[1], strict=False, **d)
+        return _classes[kind](path, strict=False, **d)
+
+    def relocate(self, old_offset, new_offset):
+        """Return a new instance with entries moved from one offset to another.
+
+        Mirrors :obj:`pkgcore.fs.contents.change_offset_rewriter`.
+        """
+        offset_len = len(old_offset.rstrip(os.path.sep))
+        new = _Columns()
+        new.flags, new.ints, new.mtime, new.md5 = \
+            self.flags, self.ints, self.mtime, self.md5
+        paths, extra = new.paths, new.extra
+        for i, path in enumerate(self.paths):
+            location = normpath(pjoin(
+                new_offset, path[offset_len:].lstrip(os.path.sep)))
+            if not location.startswith(os.path.sep):
+                location = os.path.abspath(location)
+            if location.__class__ is str:
+                location = intern(location)
+            paths.append(location)
+            obj = self.extra[i]
+            kind = self.flags[i] & _KIND_MASK
+            if kind == _OBJ:
+                obj = obj.change_attributes(location=location)
+            elif kind == _REG and obj is None:
+                # the data stays at the original location
+                obj = path
+            extra.append(obj)
+        if all(paths[i] < paths[i + 1] for i in xrange(len(paths) - 1)):
+            return new
+        # the rewrite reordered or collapsed entries; later ones win
+        order = sorted(xrange(len(paths)), key=paths.__getitem__)
+        order = [i for pos, i in enumerate(order)
+                 if pos + 1 == len(order) or paths[i] != paths[order[pos + 1]]]
+        return new.take(order)
+
+
+def _common(a, b):
+    """Yield (i, j) index pairs of the paths common to two sorted lists."""
+    i = j = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a and j < len_b:
+        x, y = a[i], b[j]
+        if x == y:
+            yield i, j
+            i += 1
+            j += 1
+        elif x < y:
+            i = bisect_left(a, y, i + 1)
+        else:
+            j = bisect_left(b, x, j + 1)
+
+
+def _complement(indices, length):
+    """Yield the indices below length missing from ascending indices."""
+    i = 0
+    for j in indices:
+        while i < j:
+            yield i
+            i += 1
+        i = j + 1
+    while i < length:
+        yield i
+        i += 1
+
+
+def _merge(a, b):
+    """Merge two column instances, entries of b replacing those of a."""
+    new = _Columns()
+    paths_a, paths_b = a.paths, b.paths
+    len_a, len_b = len(paths_a), len(paths_b)
+    i = j = 0
+    while i < len_a and j < len_b:
+        x, y = paths_a[i], paths_b[j]
+        if x < y:
+            end = bisect_left(paths_a, y, i)
+            new.extend(a, i, end)
+            i = end
+        else:
+            if x == y:
+                i += 1
+            end = bisect_left(paths_b, paths_a[i], j + 1) if i < len_a else len_b
+            new.extend(b, j, end)
+            j = end
+    new.extend(a, i, len_a)
+    new.extend(b, j, len_b)
+    return new
+
+
+class _ColumnStore(object):
+    """Mapping of locations to fs objects backed by :obj:`_Columns`.
+
+    Modifications are buffered, getting merged into the columns in bulk.
+    """
+
+    # number of buffered modifications forcing a merge
+    max_pending = 4096
+
+    def __init__(self):
+        self._cols = _Columns()
+        self._pending = {}
+
+    def columns(self):
+        """Return the columns, merging buffered modifications first."""
+        pending = self._pending
+        if pending:
+            self._pending = {}
+            cols = self._cols
+            paths = cols.paths
+            new = _Columns()
+            i = 0
+            for path in sorted(pending):
+                j = bisect_left(paths, path, i)
+                new.extend(cols, i, j)
+                i = j
+                if i < len(paths) and paths[i] == path:
+                    i += 1
+                obj = pending[path]
+                if obj is not None:
+                    new.append(obj)
+            new.extend(cols, i, len(paths))
+            self._cols = new
+        return self._cols
+
+    def set_columns(self, cols):
+        self._pending = {}
+        self._cols = cols
+
+    def __len__(self):
+        return len(self.columns())
+
+    def __contains__(self, path):
+        obj = self._pending.get(path, _missing)
+        if obj is not _missing:
+            return obj is not None
+        return self._cols.index(path) is not None
+
+    def __getitem__(self, path):
+        obj = self._pending.get(path, _missing)
+        if obj is not _missing:
+            if obj is None:
+                raise KeyError(path)
+            return obj
+        i = self._cols.index(path)
+        if i is None:
+            raise KeyError(path)
+        return self._cols.get(i)
+
+    def get(self, path, default=None):
+        try:
+            return self[path]
+        except KeyError:
+            return default
+
+    def __setitem__(self, path, obj):
+        self._pending[path] = obj
+        if len(self._pending) >= self.max_pending:
+            self.columns()
+
+    def __delitem__(self, path):
+        if path not in self:
+            raise KeyError(path)
+        self[path] = None
+
+    def pop(self, path, *default):
+        try:
+            obj = self[path]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[path]
+        return obj
+
+    def clear(self):
+        self.set_columns(_Columns())
+
+    def update(self, iterable):
+        if hasattr(iterable, 'iteritems'):
+            iterable = iterable.iteritems()
+        for path, obj in iterable:
+            self[path] = obj
+
+    def __iter__(self):
+        return iter(self.columns().paths)
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self.columns().paths)
+
+    def itervalues(self):
+        cols = self.columns()
+        return (cols.get(i) for i in xrange(len(cols)))
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        cols = self.columns()
+        return ((cols.paths[i], cols.get(i)) for i in xrange(len(cols)))
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __eq__(self, other):
+        if not hasattr(other, 'iteritems'):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        for path, obj in self.iteritems():
+            if path not in other or other[path] != obj:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+class CompactContentsSet(contentsSet):
+    """:obj:`pkgcore.fs.contents.contentsSet` storing entries in columns
+
+    Entries are iterated in location order, fs objects being created on
+    access.  Entries with attributes the columns can't hold, e.g. files
+    backed by archive data sources, are kept as objects.
+    """
+
+    __dict_kls__ = _ColumnStore
+
+    def _from_columns(self, cols, mutable=None):
+        obj = self.__class__(mutable=True)
+        obj._dict.set_columns(cols)
+        obj.mutable = self.mutable if mutable is None else mutable
+        return obj
+
+    @classmethod
+    def from_stats(cls, entries, fallback, mutable=True):
+        """Create an instance from (location, real location, stat) tuples.
+
+        :param entries: iterable of tuples, see
+            :obj:`pkgcore.fs.livefs.iter_scan_entries`
+        :param fallback: callable taking the same arguments as
+            :obj:`_Columns.append_stat`, returning the fs object for entries
+            that don't fit the columns
+        """
+        entries = sorted(entries, key=_first)
+        cols = _Columns.from_stats(entries)
+        if cols is None:
+            cols = _Columns()
+            for location, real_location, st in entries:
+                if not cols.append_stat(location, real_location, st):
+                    cols.append(fallback(location, real_location, st))
+        obj = cls(mutable=True)
+        obj._dict.set_columns(cols)
+        obj.mutable = mutable
+        return obj
+
+    def update(self, iterable):
+        self._dict.update((x.location, x) for x in iterable)
+
+    def _iter_kind(self, kind, invert):
+        cols = self._dict.columns()
+        attr = _kind_attrs[kind]
+        get, extra = cols.get, cols.extra
+        for i, flags in enumerate(cols.flags):
+            flags &= _KIND_MASK
+            if flags == _OBJ:
+                if getattr(extra[i], attr) != invert:
+                    yield extra[i]
+            elif (flags == kind) != invert:
+                yield get(i)
+
+    def _kind_iterator(kind, name):
+        def f(self, invert=False):
+            return self._iter_kind(kind, invert)
+        f.__name__ = name
+        f.__doc__ = getattr(contentsSet, name).__doc__
+        return f
+
+    iterfiles = _kind_iterator(_REG, 'iterfiles')
+    iterdirs = _kind_iterator(_DIR, 'iterdirs')
+    itersymlinks = _kind_iterator(_SYM, 'itersymlinks')
+    iterdevs = _kind_iterator(_DEV, 'iterdevs')
+    iterfifos = _kind_iterator(_FIFO, 'iterfifos')
+    del _kind_iterator
+
+    def difference(self, other):
+        cols = self._dict.columns()
+        if isinstance(other, CompactContentsSet):
+            common = (i for i, _ in _common(cols.paths, other._dict.columns().paths))
+            return self._from_columns(cols.take(_complement(common, len(cols))))
+        if not hasattr(other, '__contains__'):
+            other = set(self._convert_loc(other))
+        return self._from_columns(cols.take(
+            i for i, path in enumerate(cols.paths) if path not in other))
+
+    def difference_update(self, other):
+        if not self.mutable:
+            raise TypeError("%r isn't mutable" % self)
+        if not isinstance(other, CompactContentsSet):
+            return contentsSet.difference_update(self, other)
+        cols = self._dict.columns()
+        common = (i for i, _ in _common(cols.paths, other._dict.columns().paths))
+        self._dict.set_columns(cols.take(_complement(common, len(cols))))
+
+    def intersection(self, other):
+        if isinstance(other, CompactContentsSet):
+            # like contentsSet, entries are taken from other
+            other_cols = other._dict.columns()
+            common = (j for _, j in _common(self._dict.columns().paths, other_cols.paths))
+            return self._from_columns(other_cols.take(common))
+        return self.__class__((x for x in other if x in self), mutable=self.mutable)
+
+    def intersection_update(self, other):
+        if not self.mutable:
+            raise TypeError("%r isn't mutable" % self)
+        if not hasattr(other, '__contains__'):
+            other = set(self._convert_loc(other))
+        cols = self._dict.columns()
+        self._dict.set_columns(cols.take(
+            i for i, path in enumerate(cols.paths) if path in other))
+
+    def union(self, other):
+        if isinstance(other, CompactContentsSet):
+            return self._from_columns(
+                _merge(other._dict.columns(), self._dict.columns()), mutable=True)
+        c = self.__class__(other)
+        c.update(self)
+        return c
+
+    def clone(self, empty=False):
+        if empty:
+            return self.__class__(mutable=True)
+        return self._from_columns(self._dict.columns(), mutable=True)
+
+    def insert_offset(self, offset):
+        return self.change_offset('/', offset)
+
+    def change_offset(self, old_offset, new_offset):
+        return self._from_columns(
+            self._dict.columns().relocate(old_offset, new_offset), mutable=True)
+
+    def _child_range(self, start_point):
+        if isinstance(start_point, fs.fsBase):
+            if start_point.is_sym:
+                start_point = start_point.target
+            else:
+                start_point = start_point.location
+        cols = self._dict.columns()
+        return cols, cols.child_range(normpath(start_point))
+
+    def iter_child_nodes(self, start_point):
+        cols, (start, end) = self._child_range(start_point)
+        return (cols.get(i) for i in xrange(start, end))
+
+    def child_nodes(self, start_point):
+        cols, (start, end) = self._child_range(start_point)
+        return self._from_columns(cols.take(xrange(start, end)), mutable=True)
+
+    def _dir_conflicts(self, syms):
+        cols = self._dict.columns()
+        return sorted(syms[path] for i, path in enumerate(cols.paths)
+                      if path in syms and cols.is_kind(i, _DIR))
+
+    def map_directory_structure(self, other, add_conflicting_sym=True):
+        syms = {x.location: x for x in other.iterlinks()}
+        obj = self.clone()
+        store = obj._dict
+        conflicts = obj._dir_conflicts(syms)
+        while conflicts:
+            for conflict in conflicts:
+                cols = store.columns()
+                # punt the conflict first, since we don't want it getting rewritten
+                i = cols.index(conflict.location)
+                start, end = cols.child_range(conflict.location)
+                subset = cols.take(xrange(start, end)).relocate(
+                    conflict.location, conflict.resolved_target)
+                rest = cols.take(_complement(
+                    sorted([i] + range(start, end)), len(cols)))
+                store.set_columns(_merge(rest, subset))
+                if add_conflicting_sym:
+                    obj.add(other[conflict.resolved_target])
+            conflicts = obj._dir_conflicts(syms)
+        return obj
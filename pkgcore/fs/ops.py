@@ -11,7 +11,10 @@ Shouldn't be accessed directly for the most part, use
 import errno
 from functools import partial
 import os
+import time
 
+from snakeoil.data_source import local_source
+from snakeoil.demandload import demandload
 from snakeoil.osutils import ensure_dirs, pjoin, unlink_if_exists
 from snakeoil.process.spawn import spawn
 
@@ -19,11 +22,17 @@ from pkgcore.const import CP_BINARY
 from pkgcore.fs import contents, fs
 from pkgcore.fs.livefs import gen_obj
 from pkgcore.plugin import get_plugin
+from pkgcore.util import thread_pool
 
+demandload(
+    'ctypes',
+    'ctypes.util:find_library',
+    'fcntl',
+)
 
 __all__ = [
     "merge_contents", "unmerge_contents", "default_ensure_perms",
-    "default_copyfile", "default_mkdir"]
+    "default_copyfile", "default_mkdir", "default_transfer_data"]
 
 
 def default_ensure_perms(d1, d2=None):
@@ -115,18 +124,144 @@ class CannotOverwrite(FailedCopy):
             self.obj, self.existing)
 
 
+# ioctl cloning the extents of a file into another, see ioctl_ficlone(2)
+_FICLONE = 0x40049409
+
+# errnos signaling a transfer mode isn't usable between two filesystems
+_unsupported_errnos = frozenset([
+    errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS])
+
+# (mode, source st_dev, target st_dev) combinations known to fail
+_unsupported_transfers = set()
+
+_libc = []
+
+
+class _ShortCopy(EnvironmentError):
+    """A kernel side copy ended early, e.g. due to the source shrinking.
+
+    Unlike unsupported modes, this only affects the file being copied.
+    """
+
+
+def _libc_func(name, *argtypes):
+    if not _libc:
+        try:
+            _libc.append(ctypes.CDLL(find_library('c'), use_errno=True))
+        except (OSError, TypeError):
+            _libc.append(None)
+    func = getattr(_libc[0], name, None)
+    if func is None:
+        raise OSError(errno.ENOSYS, "%s() is unavailable" % (name,))
+    func.restype = ctypes.c_ssize_t
+    func.argtypes = argtypes
+    return func
+
+
+def _kernel_copy(func, size):
+    # offsets are the file positions, advanced by the kernel
+    while size > 0:
+        ret = func(min(size, 1 << 30))
+        if ret < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        elif ret == 0:
+            break
+        size -= ret
+    if size > 0:
+        # don't leave a truncated file, fall back to another mode instead
+        raise _ShortCopy(errno.EIO, "short copy, %i bytes left" % (size,))
+
+
+def _reflink(src_fd, dst_fd, size):
+    fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    func = _libc_func(
+        'copy_file_range', ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+        ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint)
+    _kernel_copy(lambda n: func(src_fd, None, dst_fd, None, n, 0), size)
+
+
+def _sendfile(src_fd, dst_fd, size):
+    func = _libc_func(
+        'sendfile', ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t)
+    _kernel_copy(lambda n: func(dst_fd, src_fd, None, n), size)
+
+
+# transfer modes for local files, in order of preference
+_transfer_modes = (
+    ('reflink', _reflink),
+    ('copy_file_range', _copy_file_range),
+    ('sendfile', _sendfile),
+)
+
+
+def default_transfer_data(data, path):
+    """
+    write the content of a data source to a path
+
+    On disk files are cloned if the filesystem supports it, else copied
+    within the kernel via copy_file_range(2) or sendfile(2); modes failing
+    between two filesystems aren't retried for them.  Everything else is
+    copied through userspace buffers.
+
+    :param data: :obj:`snakeoil.data_source.base` instance
+    :param path: location to write to, any existing file is truncated
+    :return: name of the transfer mode used; one of 'reflink',
+        'copy_file_range', 'sendfile', or 'buffered'
+    """
+    if isinstance(data, local_source) and data.path is not None:
+        src_fd = os.open(data.path, os.O_RDONLY)
+        try:
+            st = os.fstat(src_fd)
+            dst_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+            try:
+                dst_dev = os.fstat(dst_fd).st_dev
+                for mode, func in _transfer_modes:
+                    key = (mode, st.st_dev, dst_dev)
+                    if key in _unsupported_transfers:
+                        continue
+                    try:
+                        func(src_fd, dst_fd, st.st_size)
+                        return mode
+                    except _ShortCopy:
+                        pass
+                    except EnvironmentError as e:
+                        if e.errno not in _unsupported_errnos:
+                            raise
+                        _unsupported_transfers.add(key)
+                    # drop anything partially copied
+                    os.lseek(src_fd, 0, os.SEEK_SET)
+                    os.lseek(dst_fd, 0, os.SEEK_SET)
+                    os.ftruncate(dst_fd, 0)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+    else:
+        # transfer_to_path overwrites in place
+        open(path, 'wb').close()
+    data.transfer_to_path(path)
+    return 'buffered'
+
+
 def default_copyfile(obj, mkdirs=False):
     """
     copy a :class:`pkgcore.fs.fs.fsBase` to its stated location.
 
     :param obj: :class:`pkgcore.fs.fs.fsBase` instance, exempting :class:`fsDir`
-    :return: true if success, else an exception is thrown
+    :return: for regular files the transfer mode used, see
+        :obj:`default_transfer_data`; else True.  An exception is thrown
+        on failure
     :raise EnvironmentError: permission errors
 
     """
 
     existent = False
     ensure_perms = get_plugin("fs_ops.ensure_perms")
+    ret = True
     if not fs.isfs_obj(obj):
         raise TypeError("obj must be fsBase derivative: %r" % obj)
     elif fs.isdir(obj):
@@ -154,7 +289,7 @@ def default_copyfile(obj, mkdirs=False):
         fp = existent_fp = obj.location + "#new"
 
     if fs.isreg(obj):
-        obj.data.transfer_to_path(fp)
+        ret = get_plugin("fs_ops.transfer_data")(obj.data, fp)
     elif fs.issym(obj):
         os.symlink(obj.target, fp)
     elif fs.isfifo(obj):
@@ -163,15 +298,15 @@ def default_copyfile(obj, mkdirs=False):
         dev = os.makedev(obj.major, obj.minor)
         os.mknod(fp, obj.mode, dev)
     else:
-        ret = spawn([CP_BINARY, "-Rp", obj.location, fp])
-        if ret != 0:
-            raise FailedCopy(obj, "got %i from %s -Rp" % ret)
+        status = spawn([CP_BINARY, "-Rp", obj.location, fp])
+        if status != 0:
+            raise FailedCopy(obj, "got %i from %s -Rp" % status)
 
     ensure_perms(obj.change_attributes(location=fp))
 
     if existent:
         os.rename(existent_fp, obj.location)
-    return True
+    return ret
 
 def do_link(src, trg):
     try:
@@ -207,7 +342,18 @@ def do_link(src, trg):
     return True
 
 
-def merge_contents(cset, offset=None, callback=None):
+def _copy_worker(queue, copyfile, copied, errors):
+    # always drain the queue, even after failures
+    for x in queue:
+        if not errors:
+            try:
+                mode = copyfile(x, mkdirs=True)
+                copied.append((mode, os.lstat(x.location).st_size))
+            except Exception as e:
+                errors.append(e)
+
+
+def merge_contents(cset, offset=None, callback=None, parallelism=1, stats=None):
 
     """
     merge a :class:`pkgcore.fs.contents.contentsSet` instance to the livefs
@@ -217,6 +363,13 @@ def merge_contents(cset, offset=None, callback=None):
         Think of it as target dir.
     :param callback: callable to report each entry being merged; given a single arg,
         the fs object being merged.
+    :param parallelism: number of threads copying regular files with on disk
+        data; directories are still merged first, entries are reported in
+        order, and hardlinks are merged after the files they link to
+    :param stats: if not None, a dict updated with the number of regular
+        files copied, their total size in bytes, the seconds spent merging
+        non-directory entries, and under 'modes' a dict counting the files
+        copied per transfer mode
     :raise EnvironmentError: Thrown for permission failures.
     """
 
@@ -269,54 +422,135 @@ def merge_contents(cset, offset=None, callback=None):
             ensure_perms(x)
     del d
 
-    # might look odd, but what this does is minimize the try/except cost
-    # to one time, assuming everything behaves, rather then per item.
-    i = iterate(cset.iterdirs(invert=True))
-    merged_inodes = {}
-    while True:
-        try:
-            for x in i:
-                callback(x)
-
-                if x.is_reg:
-                    key = (x.dev, x.inode)
-                    # This logic could be made smarter- instead of
-                    # blindly trying candidates, we could inspect the st_dev
-                    # of the final location.  This however can be broken by
-                    # overlayfs's potentially.  Brute force is in use either
-                    # way.
-                    candidates = merged_inodes.setdefault(key, [])
-                    if any(target._can_be_hardlinked(x) and do_link(target, x)
-                            for target in candidates):
+    start = time.time()
+    parallel = parallelism > 1
+    # (transfer mode, size) per copied regular file
+    copied = []
+    errors = []
+    # hardlinks merged once the files they link to are copied
+    deferred = []
+
+    def iter_entries():
+        """Merge non-directory entries, yielding regular files to copy."""
+        merged_inodes = {}
+        # might look odd, but what this does is minimize the try/except cost
+        # to one time, assuming everything behaves, rather then per item.
+        i = iterate(cset.iterdirs(invert=True))
+        while True:
+            try:
+                for x in i:
+                    if errors:
+                        return
+                    callback(x)
+
+                    if x.is_reg:
+                        key = (x.dev, x.inode)
+                        # This logic could be made smarter- instead of
+                        # blindly trying candidates, we could inspect the st_dev
+                        # of the final location.  This however can be broken by
+                        # overlayfs's potentially.  Brute force is in use either
+                        # way.
+                        candidates = merged_inodes.setdefault(key, [])
+                        if candidates and parallel:
+                            deferred.append((x, candidates))
+                            continue
+                        if any(target._can_be_hardlinked(x) and do_link(target, x)
+                                for target in candidates):
+                            continue
+                        candidates.append(x)
+                        if isinstance(x.data, local_source):
+                            yield x
+                            continue
+                        # other sources, e.g. binpkg archives, are read in order
+                        mode = copyfile(x, mkdirs=True)
+                        copied.append((mode, os.lstat(x.location).st_size))
                         continue
-                    candidates.append(x)
 
-                copyfile(x, mkdirs=True)
+                    copyfile(x, mkdirs=True)
 
-            break
-        except CannotOverwrite as cf:
-            if not fs.issym(x):
-                raise
-
-            # by this time, all directories should've been merged.
-            # thus we can check the target
-            try:
-                if not fs.isdir(gen_obj(pjoin(x.location, x.target))):
+                break
+            except CannotOverwrite as cf:
+                if not fs.issym(x):
                     raise
-            except OSError:
-                raise cf
+
+                # by this time, all directories should've been merged.
+                # thus we can check the target
+                try:
+                    if not fs.isdir(gen_obj(pjoin(x.location, x.target))):
+                        raise
+                except OSError:
+                    raise cf
+
+    if parallel:
+        thread_pool.map_async(
+            iter_entries(), _copy_worker, copyfile, copied, errors,
+            threads=parallelism)
+        if errors:
+            raise errors[0]
+        for x, candidates in deferred:
+            if any(target._can_be_hardlinked(x) and do_link(target, x)
+                    for target in candidates):
+                continue
+            candidates.append(x)
+            mode = copyfile(x, mkdirs=True)
+            copied.append((mode, os.lstat(x.location).st_size))
+    else:
+        for x in iter_entries():
+            mode = copyfile(x, mkdirs=True)
+            copied.append((mode, os.lstat(x.location).st_size))
+
+    if stats is not None:
+        stats['files'] = stats.get('files', 0) + len(copied)
+        stats['bytes'] = stats.get('bytes', 0) + sum(x[1] for x in copied)
+        stats['seconds'] = stats.get('seconds', 0) + time.time() - start
+        modes = stats.setdefault('modes', {})
+        for mode, _ in copied:
+            modes[mode] = modes.get(mode, 0) + 1
     return True
 
 
-def unmerge_contents(cset, offset=None, callback=None):
+def _unlink_worker(queue, errors):
+    # always drain the queue, even after failures
+    for x in queue:
+        if not errors:
+            try:
+                unlink_if_exists(x.location)
+            except Exception as e:
+                errors.append(e)
+
+
+def _mark_busy(busy, path):
+    """Mark a directory and its parents as staying in place."""
+    while path not in busy:
+        busy.add(path)
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+
+
+def unmerge_contents(cset, offset=None, callback=None, parallelism=1,
+                     keep_dirs=(), stats=None):
 
     """
     unmerge a :obj:`pkgcore.fs.contents.contentsSet` instance to the livefs
 
+    Non-directory entries are removed first, then directories are pruned
+    deepest first.  Directories that can't become empty- those in keep_dirs,
+    their parents, and the parents of directories that failed removal- are
+    skipped without attempting removal.
+
     :param cset: :obj:`pkgcore.fs.contents.contentsSet` instance
     :param offset: if not None, offset to prefix all locations with.
         Think of it as target dir.
     :param callback: callable to report each entry being unmerged
+    :param parallelism: number of threads removing non-directory entries;
+        entries are still reported in order
+    :param keep_dirs: container of directory locations, offset included,
+        that stay in use, e.g. due to being owned by other packages
+    :param stats: if not None, a dict updated with the number of
+        non-directory entries unmerged, the number of directories removed,
+        and the seconds spent doing so
     :return: True, or an exception is thrown on failure
         (OSError, although see default_copyfile for specifics).
     :raise EnvironmentError: see :func:`default_copyfile` and :func:`default_mkdir`
@@ -329,26 +563,60 @@ def unmerge_contents(cset, offset=None, callback=None):
     if offset is not None:
         iterate = partial(contents.offset_rewriter, offset.rstrip(os.path.sep))
 
-    for x in iterate(cset.iterdirs(invert=True)):
-        callback(x)
-        unlink_if_exists(x.location)
+    start = time.time()
+    errors = []
+    # number of non-directory entries unmerged
+    unmerged = [0]
 
-    # this is a fair sight faster then using sorted/reversed
+    def iter_entries():
+        for x in iterate(cset.iterdirs(invert=True)):
+            if errors:
+                return
+            callback(x)
+            unmerged[0] += 1
+            yield x
+
+    if parallelism > 1:
+        thread_pool.map_async(
+            iter_entries(), _unlink_worker, errors, threads=parallelism)
+        if errors:
+            raise errors[0]
+    else:
+        for x in iter_entries():
+            unlink_if_exists(x.location)
+
+    busy = set()
+    for path in keep_dirs:
+        _mark_busy(busy, path)
+
+    # this is a fair sight faster then using sorted/reversed; children are
+    # always ordered prior to their parents
     l = list(iterate(cset.iterdirs()))
     l.sort(reverse=True)
+    pruned = 0
     for x in l:
+        if x.location in busy:
+            continue
         try:
             os.rmdir(x.location)
         except OSError as e:
             if not e.errno in (errno.ENOTEMPTY, errno.ENOENT, errno.ENOTDIR,
                                errno.EBUSY, errno.EEXIST):
                 raise
+            if e.errno != errno.ENOENT:
+                _mark_busy(busy, x.location)
         else:
+            pruned += 1
             callback(x)
+
+    if stats is not None:
+        stats['files'] = stats.get('files', 0) + unmerged[0]
+        stats['dirs'] = stats.get('dirs', 0) + pruned
+        stats['seconds'] = stats.get('seconds', 0) + time.time() - start
     return True
 
 # Plugin system priorities
 for func in [default_copyfile, default_ensure_perms, default_mkdir,
-             merge_contents, unmerge_contents]:
+             default_transfer_data, merge_contents, unmerge_contents]:
     func.priority = 1
 del func
@@ -16,7 +16,7 @@ __all__ = ("alias_cset", "map_new_cset_livefs", "MergeEngine")
 from functools import partial
 import operator
 
-from pkgcore.fs import contents, livefs
+from pkgcore.fs import compact, contents, livefs
 from pkgcore.merge import errors
 from pkgcore.merge.const import REPLACE_MODE, INSTALL_MODE, UNINSTALL_MODE
 from pkgcore.operations import observer as observer_mod
@@ -87,6 +87,10 @@ class MergeEngine(object):
 
     allow_reuse = True
 
+    # csets of at least this many entries are stored compactly, see
+    # :obj:`pkgcore.fs.compact.CompactContentsSet`
+    compact_cset_threshold = 10000
+
 
     def __init__(self, mode, tempdir, hooks, csets, preserves, observer,
                  offset=None, disable_plugins=False, parallelism=None):
@@ -361,10 +365,29 @@ class MergeEngine(object):
         """generate a cset with offset applied"""
         return cset_generator(engine, csets).insert_offset(engine.offset)
 
+    @staticmethod
+    def _use_compact_cset(engine, cset):
+        """Check if a copy of a cset should be stored compactly."""
+        threshold = getattr(
+            engine, 'compact_cset_threshold', MergeEngine.compact_cset_threshold)
+        return len(cset) >= threshold
+
     @staticmethod
     def get_pkg_contents(engine, csets, pkg):
         """generate the cset of what files shall be merged to the livefs"""
-        return pkg.contents.clone()
+        cset = pkg.contents
+        if isinstance(cset, compact.CompactContentsSet):
+            # shares the columns, no fs objs are created
+            return cset.clone()
+        # ordered csets (binpkg contents in archive order) and files read
+        # from something other than the livefs are merged in their given
+        # order, which the sorted compact form loses
+        if MergeEngine._use_compact_cset(engine, cset) and \
+                not isinstance(cset, contents.OrderedContentsSet) and \
+                all(isinstance(x.data, data_source.local_source)
+                    for x in cset.iterfiles()):
+            return compact.CompactContentsSet(cset)
+        return cset.clone()
 
     @staticmethod
     def get_remove_cset(engine, csets):
@@ -379,7 +402,11 @@ class MergeEngine(object):
     @staticmethod
     def _get_livefs_intersect_cset(engine, csets, cset_name, realpath=False):
         """generates the livefs intersection against a cset"""
-        return contents.contentsSet(livefs.intersect(csets[cset_name], realpath=realpath))
+        cset = csets[cset_name]
+        kls = contents.contentsSet
+        if MergeEngine._use_compact_cset(engine, cset):
+            kls = compact.CompactContentsSet
+        return kls(livefs.intersect(cset, realpath=realpath))
 
     @staticmethod
     def get_install_livefs_intersect(engine, csets):
@@ -66,6 +66,9 @@ class base(object):
     :ivar priority: range of 0 to 100, order of execution for triggers per hook
     :ivar _engine_types: if None, trigger works for all engine modes, else it's
         limited to that mode, and must be a sequence
+    :ivar requires_image: whether the trigger needs the files it's passed to
+        exist on disk prior to merging, e.g. to run external tools on them;
+        if no trigger does, binpkgs are merged straight from their archive
     """
 
     required_csets = None
@@ -73,6 +76,7 @@ class base(object):
     _hooks = None
     _engine_types = None
     priority = 50
+    requires_image = True
 
     suppress_exceptions = True
 
@@ -297,6 +301,7 @@ class ldconfig(base):
     priority = 10
     _engine_types = None
     _hooks = ('pre_merge', 'post_merge', 'pre_unmerge', 'post_unmerge')
+    requires_image = False
 
     default_ld_path = ['usr/lib', 'usr/lib64', 'usr/lib32', 'lib', 'lib64', 'lib32']
 
@@ -357,6 +362,7 @@ class ldconfig(base):
 class InfoRegen(base):
 
     required_csets = ()
+    requires_image = False
 
     # could implement this to look at csets, and do incremental removal and
     # addition; doesn't seem worth while though for the additional complexity
@@ -443,12 +449,23 @@ class merge(base):
     required_csets = ('install',)
     _engine_types = INSTALLING_MODES
     _hooks = ('merge',)
+    requires_image = False
 
     suppress_exceptions = False
 
     def trigger(self, engine, merging_cset):
         op = get_plugin('fs_ops.merge_contents')
-        return op(merging_cset, callback=engine.observer.installing_fs_obj)
+        stats = {}
+        ret = op(merging_cset, callback=engine.observer.installing_fs_obj,
+                 parallelism=engine.parallelism, stats=stats)
+        if stats.get('seconds'):
+            engine.observer.debug(
+                "merged %i files, %i bytes in %.2fs (%.2f MiB/s), transfers: %s",
+                stats['files'], stats['bytes'], stats['seconds'],
+                stats['bytes'] / stats['seconds'] / 2**20,
+                ', '.join('%s=%i' % x for x in sorted(stats['modes'].iteritems()))
+                or 'none')
+        return ret
 
 
 class unmerge(base):
@@ -456,12 +473,45 @@ class unmerge(base):
     required_csets = ('uninstall',)
     _engine_types = UNINSTALLING_MODES
     _hooks = ('unmerge',)
+    requires_image = False
 
     suppress_exceptions = False
 
+    @staticmethod
+    def _owned_dirs(engine, cset):
+        """Return the directories of a cset other installed packages own.
+
+        Relies on the reverse index of the vdb the package is removed from,
+        returning an empty set if it has none or it isn't built yet; building
+        it means parsing every installed package's CONTENTS, which isn't worth
+        it for a single unmerge.
+        """
+        pkg = getattr(engine, 'old', None)
+        owners = getattr(getattr(pkg, 'repo', None), 'owners', None)
+        if owners is None:
+            return frozenset()
+        # vdb paths lack the offset
+        offset = engine.offset.rstrip(os.path.sep)
+        dirs = {x.location[len(offset):] or '/': x.location
+                for x in cset.iterdirs()}
+        owned = owners(dirs, indexed_only=True)
+        if owned is None:
+            return frozenset()
+        return frozenset(
+            dirs[path] for path, cpvs in owned.iteritems()
+            if any(cpv != pkg.cpvstr for cpv in cpvs))
+
     def trigger(self, engine, unmerging_cset):
         op = get_plugin('fs_ops.unmerge_contents')
-        return op(unmerging_cset, callback=engine.observer.removing_fs_obj)
+        stats = {}
+        ret = op(unmerging_cset, callback=engine.observer.removing_fs_obj,
+                 parallelism=engine.parallelism,
+                 keep_dirs=self._owned_dirs(engine, unmerging_cset), stats=stats)
+        if stats.get('seconds'):
+            engine.observer.debug(
+                "unmerged %i files, removed %i directories in %.2fs",
+                stats['files'], stats['dirs'], stats['seconds'])
+        return ret
 
 
 class BaseSystemUnmergeProtection(base):
@@ -470,6 +520,7 @@ class BaseSystemUnmergeProtection(base):
     priority = -100
     _engine_types = UNINSTALLING_MODES
     _hooks = ('unmerge',)
+    requires_image = False
 
     suppress_exceptions = False
 
@@ -497,6 +548,7 @@ class fix_uid_perms(base):
     required_csets = ('new_cset',)
     _hooks = ('pre_merge',)
     _engine_types = INSTALLING_MODES
+    requires_image = False
 
     def __init__(self, uid=os_data.portage_uid,
                  replacement=os_data.root_uid):
@@ -516,6 +568,7 @@ class fix_gid_perms(base):
     required_csets = ('new_cset',)
     _hooks = ('pre_merge',)
     _engine_types = INSTALLING_MODES
+    requires_image = False
 
     def __init__(self, gid=os_data.portage_gid,
                  replacement=os_data.root_gid):
@@ -536,6 +589,7 @@ class fix_set_bits(base):
     required_csets = ('new_cset',)
     _hooks = ('pre_merge',)
     _engine_types = INSTALLING_MODES
+    requires_image = False
 
     def trigger(self, engine, cset):
         reporter = engine.observer
@@ -564,6 +618,7 @@ class detect_world_writable(base):
     required_csets = ('new_cset',)
     _hooks = ('pre_merge',)
     _engine_types = INSTALLING_MODES
+    requires_image = False
 
     def __init__(self, fix_perms=False):
         base.__init__(self)
@@ -588,6 +643,7 @@ class PruneFiles(base):
     required_csets = ('new_cset',)
     _hooks = ('pre_merge',)
     _engine_types = INSTALLING_MODES
+    requires_image = False
 
     pkgcore_config_type = None
 
@@ -612,6 +668,7 @@ class CommonDirectoryModes(base):
     required_csets = ('new_cset',)
     _hooks = ('pre_merge',)
     _engine_types = INSTALLING_MODES
+    requires_image = False
 
     directories = [pjoin('/usr', x) for x in ('.', 'lib', 'lib64', 'lib32',
         'bin', 'sbin', 'local')]
@@ -671,6 +728,7 @@ class SavePkg(base):
     priority = 90
     _hooks = ('sanity_check',)
     _engine_types = INSTALLING_MODES
+    requires_image = False
 
     _copy_source = 'new'
 
@@ -31,14 +31,15 @@ class fetch_base(object):
         self.pkg = pkg
         self.fetchables = fetchables
         self.fetcher = fetcher
+        self.failed = []
 
-    def fetch_all(self, observer):
+    def fetch_all(self, observer, defer_failures=False):
         for fetchable in self.fetchables:
-            if not self.fetch_one(fetchable, observer):
+            if not self.fetch_one(fetchable, observer, defer_failures):
                 return False
         return True
 
-    def fetch_one(self, fetchable, observer):
+    def fetch_one(self, fetchable, observer, defer_failures=False):
         if fetchable.filename in self._basenames:
             return True
         # fetching files without uri won't fly
@@ -48,7 +49,10 @@ class fetch_base(object):
         except Exception:
             fp = None
         if fp is None:
-            self.failed_fetch(fetchable, observer)
+            if defer_failures:
+                self.failed.append(fetchable)
+            else:
+                self.failed_fetch(fetchable, observer)
             return False
         self.verified_files[fp] = fetchable
         self._basenames.add(fetchable.filename)
@@ -66,6 +70,11 @@ class fetch_base(object):
             build_ops.cleanup(force=True)
         observer.error("failed fetching %s", fetchable.filename)
 
+    def report_failures(self, observer):
+        """Handle the failures of fetches run with defer_failures."""
+        while self.failed:
+            self.failed_fetch(self.failed.pop(0), observer)
+
 
 class operations(_operations_mod.base):
 
@@ -106,6 +115,8 @@ class operations(_operations_mod.base):
     def _cmd_check_support_fetch(self):
         return self._find_fetcher() is not None
 
+    _cmd_check_support_report_fetch_failures = _cmd_check_support_fetch
+
     def _generate_fetchables(self, mirroring=False):
         pkg = self.pkg
         if not mirroring:
@@ -128,16 +139,28 @@ class operations(_operations_mod.base):
             self._find_fetcher())
 
     @_operations_mod.is_standalone
-    def _cmd_api_fetch(self, fetchables=None, observer=None):
-        # TODO: add parallel fetch support
+    def _cmd_api_fetch(self, fetchables=None, observer=None, defer_failures=False):
+        """Fetch the files of the package.
+
+        :param defer_failures: if True, failures are only recorded until
+            :obj:`report_fetch_failures` is run; handling them may run
+            pkg_nofetch, requiring an ebuild processor, so fetches run from
+            other threads have to defer them to the main thread
+        """
         if fetchables is not None:
             if not isinstance(fetchables, (tuple, list)):
                 fetchables = [fetchables]
             ret = []
             for fetchable in fetchables:
-                ret.append(self._fetch_op.fetch_one(fetchable, self._get_observer(observer)))
+                ret.append(self._fetch_op.fetch_one(
+                    fetchable, self._get_observer(observer), defer_failures))
             return all(ret)
-        return self._fetch_op.fetch_all(self._get_observer(observer))
+        return self._fetch_op.fetch_all(self._get_observer(observer), defer_failures)
+
+    @_operations_mod.is_standalone
+    def _cmd_api_report_fetch_failures(self, observer=None):
+        """Handle fetch failures deferred by fetch(defer_failures=True)."""
+        return self._fetch_op.report_failures(self._get_observer(observer))
 
     @_operations_mod.is_standalone
     def _cmd_api_mirror(self, observer=None):
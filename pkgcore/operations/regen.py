@@ -5,6 +5,7 @@ from snakeoil import compatibility
 from snakeoil.demandload import demandload
 
 demandload(
+    'pkgcore.util:process_pool',
     'pkgcore.util.thread_pool:map_async',
 )
 
@@ -21,8 +22,68 @@ def regen_iter(iterable, regen_func, observer, is_thread=False):
             observer.error("caught exception %s while processing %s", e, x)
 
 
-def regen_repository(repo, observer, threads=1, pkg_attr='keywords', **options):
+def regen_process_iter(iterable, helper):
+    """Worker side of process based regen, yielding (cpv, data, error) tuples.
+
+    Only packages requiring regeneration or erroring out are passed back.
+    """
+    helper.start_worker()
+    try:
+        for cpv in iterable:
+            try:
+                data = helper.generate(cpv)
+            except compatibility.IGNORED_EXCEPTIONS as e:
+                if isinstance(e, KeyboardInterrupt):
+                    return
+                raise
+            except Exception as e:
+                yield cpv, None, str(e)
+                continue
+            if data is not None:
+                yield cpv, data, None
+    finally:
+        helper.finish_worker()
+
+
+def regen_repository_processes(repo, observer, processes, pkgs=None, **options):
+    """Regenerate a repository's metadata using forked worker processes.
+
+    Workers source the ebuilds while the parent receives the raw metadata and
+    handles all cache updates.
+
+    :param pkgs: packages to regenerate, defaults to the entire repo
+    """
+    helper = repo._regen_operation_process_helper(**options)
+    if pkgs is None:
+        pkgs = repo
+    cpvs = [(pkg.category, pkg.package, pkg.fullver) for pkg in pkgs]
+    results = process_pool.map_async(
+        cpvs, regen_process_iter, helper, processes=processes)
+    for cpv, data, error in results:
+        if error is None:
+            try:
+                helper.store(cpv, data)
+            except compatibility.IGNORED_EXCEPTIONS:
+                raise
+            except Exception as e:
+                error = e
+        if error is not None:
+            observer.error(
+                "caught exception %s while processing %s", error, '%s/%s-%s' % cpv)
+
+
+def regen_repository(repo, observer, threads=1, pkg_attr='keywords',
+                     processes=0, **options):
     helpers = []
+    pkgs = repo
+
+    if not options.get('force') and hasattr(repo, 'validate_metadata'):
+        # check all cache entries in bulk, only the stale ones need regen
+        pkgs = repo.validate_metadata()[1]
+
+    if processes and hasattr(repo, '_regen_operation_process_helper'):
+        return regen_repository_processes(
+            repo, observer, processes, pkgs=pkgs, **options)
 
     def _get_repo_helper():
         if not hasattr(repo, '_regen_operation_helper'):
@@ -33,11 +94,11 @@ def regen_repository(repo, observer, threads=1, pkg_attr='keywords', **options):
         return helper
 
     if threads == 1:
-        regen_iter(iter(repo), _get_repo_helper(), observer)
+        regen_iter(iter(pkgs), _get_repo_helper(), observer)
     else:
         def get_args():
             return (_get_repo_helper(), observer, True)
-        map_async(repo, regen_iter, per_thread_args=get_args)
+        map_async(pkgs, regen_iter, per_thread_args=get_args)
 
     for helper in helpers:
         f = getattr(helper, 'finish', None)
@@ -234,9 +234,10 @@ class operations(sync_operations):
                 del cache[p]
 
     @_operations_mod.is_standalone
-    def _cmd_api_regen_cache(self, observer=None, threads=1, **options):
+    def _cmd_api_regen_cache(self, observer=None, threads=1, processes=0, **options):
         if getattr(self, '_regen_disable_threads', False):
             threads = 1
+            processes = 0
         cache = getattr(self.repo, 'cache', None)
         if not cache and not options.get('force', False):
             return
@@ -246,7 +247,8 @@ class operations(sync_operations):
                 cache.set_sync_rate(1000000)
             ret = regen.regen_repository(
                 self.repo,
-                self._get_observer(observer), threads=threads, **options)
+                self._get_observer(observer), threads=threads,
+                processes=processes, **options)
             self._cmd_implementation_clean_cache()
             return ret
         finally:
@@ -7,6 +7,7 @@ pkgcore_plugins = {
     'fs_ops.copyfile': [ops.default_copyfile],
     'fs_ops.ensure_perms': [ops.default_ensure_perms],
     'fs_ops.mkdir': [ops.default_mkdir],
+    'fs_ops.transfer_data': [ops.default_transfer_data],
     'fs_ops.merge_contents': [ops.merge_contents],
     'fs_ops.unmerge_contents': [ops.unmerge_contents],
 }
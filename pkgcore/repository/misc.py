@@ -3,6 +3,8 @@
 
 __all__ = ("nodeps_repo", "caching_repo")
 
+from collections import OrderedDict
+
 from snakeoil.iterables import caching_iter, iter_sort
 from snakeoil.klass import GetAttrProxy
 
@@ -60,30 +62,55 @@ class caching_repo(object):
     hold instance in memory to avoid redoing work.
 
     Cost of this of course is that involved objects are forced to stay
-    in memory till the cache is cleared.  General use, not usually what
-    you want- if you're making a lot of random queries that are duplicates
-    (resolver does this for example), caching helps.
+    in memory till they're evicted or the cache is cleared.  General use,
+    not usually what you want- if you're making a lot of random queries
+    that are duplicates (resolver does this for example), caching helps.
+
+    Queries without matches are tracked separately as negative entries;
+    they hold no package instances and aren't subject to the size limit.
     """
 
     operations_kls = operations_proxy
 
-    def __init__(self, db, strategy):
+    def __init__(self, db, strategy, max_entries=None):
         """
         :param db: an instance supporting the repository protocol to cache
           queries from.
         :param strategy: forced sorting strategy for results.  If you don't
           need sorting, pass in iter.
+        :param max_entries: if not None, the number of query results to
+          hold; the least recently used ones are evicted first
         """
         self.__db__ = db
         self.__strategy__ = strategy
-        self.__cache__ = {}
+        self.__cache__ = OrderedDict()
+        self.__max_entries__ = max_entries
+        self.__negative__ = set()
+        self.__stats__ = dict.fromkeys(
+            ('hits', 'misses', 'negative_hits', 'evictions'), 0)
 
     def match(self, restrict):
-        v = self.__cache__.get(restrict)
-        if v is None:
-            v = self.__cache__[restrict] = \
-                caching_iter(
-                    self.__db__.itermatch(restrict, sorter=self.__strategy__))
+        cache = self.__cache__
+        stats = self.__stats__
+        v = cache.pop(restrict, None)
+        if v is not None:
+            stats['hits'] += 1
+        elif restrict in self.__negative__:
+            stats['negative_hits'] += 1
+            return ()
+        else:
+            stats['misses'] += 1
+            v = caching_iter(
+                self.__db__.itermatch(restrict, sorter=self.__strategy__))
+            if not v:
+                self.__negative__.add(restrict)
+                return v
+            if self.__max_entries__ is not None and \
+                    len(cache) >= self.__max_entries__:
+                cache.popitem(last=False)
+                stats['evictions'] += 1
+        # (re)inserted as the most recently used
+        cache[restrict] = v
         return v
 
     def itermatch(self, restrict):
@@ -91,8 +118,26 @@ class caching_repo(object):
 
     __getattr__ = GetAttrProxy("__db__")
 
-    def clear(self):
+    def clear(self, negative=True):
+        """Drop cached results.
+
+        :param negative: drop negative entries as well
+        """
         self.__cache__.clear()
+        if negative:
+            self.__negative__.clear()
+
+    def cache_stats(self):
+        """Return a dict of cache statistics."""
+        d = dict(self.__stats__)
+        d['entries'] = len(self.__cache__)
+        d['negative_entries'] = len(self.__negative__)
+        return d
+
+    @property
+    def negative_entries(self):
+        """Set of restrictions known to have no matches."""
+        return self.__negative__
 
 
 class multiplex_sorting_repo(object):
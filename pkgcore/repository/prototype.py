@@ -18,6 +18,7 @@ from snakeoil.sequences import iflatten_instance
 from pkgcore.ebuild.atom import atom
 from pkgcore.operations import repo
 from pkgcore.restrictions import values, boolean, restriction, packages
+from pkgcore.restrictions.compiler import compile_match
 from pkgcore.restrictions.util import collect_package_restrictions
 
 
@@ -260,7 +261,12 @@ class tree(object):
             candidates = self._identify_candidates(restrict, sorter)
 
         if force is None:
-            match = restrict.match
+            if isinstance(restrict, atom):
+                match = restrict.match
+            else:
+                # potentially matching against large parts of the repo;
+                # avoid interpreting the restriction tree per package.
+                match = compile_match(restrict)
         elif force:
             match = restrict.force_True
         else:
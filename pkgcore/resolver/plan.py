@@ -4,12 +4,20 @@
 __all__ = ("resolver_frame", "resolver_stack", "merge_plan")
 
 from collections import deque
+import errno
 from functools import partial
 import operator
-from itertools import chain, islice, ifilterfalse as filterfalse
+from itertools import chain, islice, izip, ifilterfalse as filterfalse
+import os
 import sys
 
-from snakeoil.compatibility import cmp, sort_cmp
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from snakeoil.compatibility import IGNORED_EXCEPTIONS, cmp, sort_cmp
+from snakeoil.demandload import demandload
 from snakeoil.iterables import caching_iter
 
 # XXX: hack; see insert_blockers
@@ -17,8 +25,15 @@ from pkgcore.ebuild import atom as _atom
 from pkgcore.repository import misc, multiplex, visibility
 from pkgcore.resolver import state
 from pkgcore.resolver.choice_point import choice_point
+from pkgcore.resolver.profiler import resolver_profiler
 from pkgcore.restrictions import packages, values, restriction
 
+demandload(
+    'snakeoil.fileutils:AtomicWriteFile',
+    'snakeoil.osutils:ensure_dirs',
+    'pkgcore.log:logger',
+)
+
 limiters = set(["cycle"])
 
 
@@ -227,11 +242,15 @@ class merge_plan(object):
     vdb_restrict = packages.PackageRestriction("repo.livefs",
         values.EqualityMatch(True))
 
+    # format version of the persisted query cache
+    _query_cache_version = 1
+
     def __init__(self, dbs, per_repo_strategy,
                  global_strategy=None,
                  depset_reorder_strategy=None,
                  process_built_depends=False,
-                 drop_cycles=False, debug=False, debug_handle=None):
+                 drop_cycles=False, debug=False, debug_handle=None,
+                 cache_size=None, profile=False):
 
         if debug_handle is None:
             debug_handle = sys.stdout
@@ -252,7 +271,9 @@ class merge_plan(object):
         self.depset_reorder = depset_reorder_strategy
         self.per_repo_strategy = per_repo_strategy
         self.total_ordering_strategy = global_strategy
-        self.all_raw_dbs = [misc.caching_repo(x, self.per_repo_strategy) for x in dbs]
+        self.all_raw_dbs = [
+            misc.caching_repo(x, self.per_repo_strategy, max_entries=cache_size)
+            for x in dbs]
         self.all_dbs = global_strategy(self.all_raw_dbs)
         self.default_dbs = self.all_dbs
 
@@ -263,6 +284,7 @@ class merge_plan(object):
                 for x in self.all_raw_dbs if x.livefs])
 
         self.insoluble = set()
+        self.conflicts = state.learned_conflicts()
         self.vdb_preloaded = False
         self._ensure_livefs_is_loaded = \
             self._ensure_livefs_is_loaded_nonpreloaded
@@ -275,6 +297,11 @@ class merge_plan(object):
                 self._rec_add_atom)
             self._debugging_depth = 0
             self._debugging_drop_cycles = False
+        if profile:
+            self.profiler = resolver_profiler()
+            self.profiler.attach(self)
+        else:
+            self.profiler = None
 
     @property
     def forced_restrictions(self):
@@ -443,6 +470,14 @@ class merge_plan(object):
 
             self.notify_trying_choice(stack, atom, choices)
 
+            conflicts = self.conflicts.check(
+                self.state, atom, choices.current_pkg)
+            if conflicts is not None:
+                self.notify_choice_failed(stack, atom, choices,
+                    "learned conflict: %s", ", ".join(map(str, conflicts)))
+                choices.force_next_pkg()
+                continue
+
             if not choices.current_pkg.built or self.process_built_depends:
                 new_additions, failures = self.process_dependencies_and_blocks(
                     stack, choices, 'depends', atom, depth)
@@ -468,6 +503,7 @@ class merge_plan(object):
                 # failure.
                 self.notify_choice_failed(stack, atom, choices,
                     "failed inserting: %s", l)
+                self.conflicts.add(atom, choices.current_pkg, l)
                 self.state.backtrack(stack.current_frame.start_point)
                 choices.force_next_pkg()
                 continue
@@ -796,6 +832,78 @@ class merge_plan(object):
         for repo in self.all_raw_dbs:
             repo.clear()
 
+    def cache_stats(self):
+        """Return the query cache statistics summed across all dbs."""
+        stats = {}
+        for repo in self.all_raw_dbs:
+            for k, v in repo.cache_stats().iteritems():
+                stats[k] = stats.get(k, 0) + v
+        return stats
+
+    def load_query_cache(self, path, fingerprint):
+        """Seed the dbs' negative query caches from a previous run.
+
+        :param path: location of the cache file
+        :param fingerprint: opaque token identifying the state of the
+            dbs; the cache is ignored if it was saved with a different one
+        :return: number of negative entries loaded
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("failed reading resolver cache %r: %s", path, e)
+            return 0
+        except IGNORED_EXCEPTIONS:
+            raise
+        except Exception as e:
+            logger.warning("ignoring corrupt resolver cache %r: %s", path, e)
+            return 0
+        if not isinstance(data, dict) or \
+                data.get('version') != self._query_cache_version or \
+                data.get('fingerprint') != fingerprint or \
+                len(data.get('negative', ())) != len(self.all_raw_dbs):
+            return 0
+        count = 0
+        for repo, atoms in izip(self.all_raw_dbs, data['negative']):
+            for x in atoms:
+                try:
+                    repo.negative_entries.add(_atom.atom(x))
+                except _atom.MalformedAtom:
+                    continue
+                count += 1
+        return count
+
+    def save_query_cache(self, path, fingerprint):
+        """Store the dbs' negative query caches for later runs.
+
+        Only atom lookups are stored; other restrictions and positive results
+        aren't persistable.
+
+        :param path: location of the cache file
+        :param fingerprint: see :obj:`load_query_cache`
+        """
+        data = {
+            'version': self._query_cache_version,
+            'fingerprint': fingerprint,
+            'negative': [
+                sorted(str(x) for x in repo.negative_entries
+                       if isinstance(x, _atom.atom))
+                for repo in self.all_raw_dbs],
+        }
+        handler = None
+        try:
+            if not ensure_dirs(os.path.dirname(path), mode=0755):
+                raise EnvironmentError(
+                    errno.EACCES, "failed creating directory", os.path.dirname(path))
+            handler = AtomicWriteFile(path, binary=True)
+            pickle.dump(data, handler, pickle.HIGHEST_PROTOCOL)
+            handler.close()
+        finally:
+            if handler is not None:
+                handler.discard()
+
     # selection strategies for atom matches
 
     def default_depset_reorder_strategy(self, depset, mode):
@@ -0,0 +1,148 @@
+# License: GPL2/BSD
+
+"""
+resolver instrumentation
+
+Collects call counts and timings of the main resolver steps, backtracking
+statistics, per repo query counts, and the time spent resolving each atom
+in the context of the atoms that pulled it in.  The latter is exportable
+in the collapsed stack format used by flamegraph tools, making it easy to
+spot the dependency chains that cause resolution blowups.
+"""
+
+__all__ = ("resolver_profiler",)
+
+from collections import defaultdict
+import json
+from time import time
+
+
+class resolver_profiler(object):
+    """Instrumentation data of a :obj:`pkgcore.resolver.plan.merge_plan` run.
+
+    :ivar calls: mapping of instrumented method names to [count, seconds]
+    :ivar backtracks: number of backtracks reverting plan changes
+    :ivar reverted: total number of plan changes reverted
+    """
+
+    # merge_plan methods that are timed
+    timed_methods = ('_viable', 'insert_choice', 'check_for_cycles')
+
+    def __init__(self):
+        self.calls = defaultdict(lambda: [0, 0.0])
+        self.backtracks = 0
+        self.reverted = 0
+        # atom -> [count, failures, total seconds]
+        self._atoms = defaultdict(lambda: [0, 0, 0.0])
+        # stack of atom strings -> self time in seconds
+        self._stacks = defaultdict(float)
+        self._current = []
+        self._repos = []
+        self._conflicts = None
+
+    def attach(self, resolver):
+        """Instrument a resolver instance, wrapping its methods."""
+        for name in self.timed_methods:
+            setattr(resolver, name, self._timed(name, getattr(resolver, name)))
+        resolver._rec_add_atom = self._rec_add_atom(resolver._rec_add_atom)
+        resolver.state.backtrack = self._backtrack(resolver.state)
+        self._repos = resolver.all_raw_dbs
+        self._conflicts = getattr(resolver, 'conflicts', None)
+
+    def _timed(self, name, func):
+        stats = self.calls[name]
+
+        def f(*args, **kwds):
+            start = time()
+            try:
+                return func(*args, **kwds)
+            finally:
+                stats[0] += 1
+                stats[1] += time() - start
+        return f
+
+    def _rec_add_atom(self, func):
+        stats = self.calls['_rec_add_atom']
+        current = self._current
+
+        def f(atom, *args, **kwds):
+            # [atom string, time spent in nested calls]
+            frame = [str(atom), 0.0]
+            current.append(frame)
+            start = time()
+            ret = None
+            try:
+                ret = func(atom, *args, **kwds)
+                return ret
+            finally:
+                elapsed = time() - start
+                stack = tuple(x[0] for x in current)
+                current.pop()
+                if current:
+                    current[-1][1] += elapsed
+                self._stacks[stack] += elapsed - frame[1]
+                atom_stats = self._atoms[frame[0]]
+                atom_stats[0] += 1
+                if ret:
+                    atom_stats[1] += 1
+                atom_stats[2] += elapsed
+                stats[0] += 1
+                stats[1] += elapsed
+        return f
+
+    def _backtrack(self, state):
+        func = state.backtrack
+
+        def f(state_pos):
+            reverted = len(state.plan) - state_pos
+            if reverted > 0:
+                self.backtracks += 1
+                self.reverted += reverted
+            return func(state_pos)
+        return f
+
+    def repo_stats(self):
+        """Return a list of (repo id, query cache stats dict) tuples.
+
+        Cache misses are the queries passed through to the repo itself.
+        """
+        return [(getattr(repo, 'repo_id', str(repo)), repo.cache_stats())
+                for repo in self._repos]
+
+    def atom_stats(self):
+        """Return (atom, count, failures, seconds) tuples, slowest first."""
+        return sorted(
+            ((k,) + tuple(v) for k, v in self._atoms.iteritems()),
+            key=lambda x: x[3], reverse=True)
+
+    def to_dict(self):
+        """Return the collected data as a JSON serializable dict."""
+        d = {
+            'calls': {k: {'count': v[0], 'time': v[1]}
+                      for k, v in self.calls.iteritems()},
+            'backtracks': {'count': self.backtracks, 'reverted': self.reverted},
+            'repos': [dict(stats, repo=repo_id)
+                      for repo_id, stats in self.repo_stats()],
+            'atoms': [{'atom': atom, 'count': count, 'failures': failures,
+                       'time': seconds}
+                      for atom, count, failures, seconds in self.atom_stats()],
+        }
+        if self._conflicts is not None:
+            d['conflicts'] = {
+                'learned': len(self._conflicts), 'pruned': self._conflicts.pruned}
+        return d
+
+    def write_json(self, handle):
+        """Write the collected data to a file object as JSON."""
+        json.dump(self.to_dict(), handle, indent=2, sort_keys=True)
+        handle.write('\n')
+
+    def write_flamegraph(self, handle):
+        """Write atom resolution stacks to a file object in collapsed format.
+
+        Each line holds the ';' separated chain of atoms leading to an atom
+        followed by the time spent resolving it, excluding nested atoms, in
+        microseconds.
+        """
+        for stack, seconds in sorted(self._stacks.iteritems()):
+            handle.write('%s %i\n' % (';'.join(stack), seconds * 1e6))
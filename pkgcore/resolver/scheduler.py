@@ -0,0 +1,181 @@
+# License: GPL2/BSD
+
+"""
+parallel execution of resolver plans
+"""
+
+__all__ = ("build_barriers", "JobScheduler")
+
+import os
+import sys
+import threading
+
+from snakeoil import compatibility
+
+
+def _op_depends(op, attr):
+    """Return the cnf solutions of an op's dependencies of the given type."""
+    choices = op.choices
+    if choices is not None:
+        try:
+            return getattr(choices, attr)
+        except IndexError:
+            pass
+    return getattr(op.pkg, attr).cnf_solutions()
+
+
+def _matching_ops(ops, limit, solutions):
+    """Return the indexes of ops prior to limit satisfying any of the atoms."""
+    atoms = [a for choices in solutions for a in choices if not a.blocks]
+    if not atoms:
+        return ()
+    return tuple(idx for idx in xrange(limit)
+                 if ops[idx].desc != 'remove' and
+                 any(a.match(ops[idx].pkg) for a in atoms))
+
+
+def build_barriers(ops):
+    """Determine how far each op of a plan depends on the ops prior to it.
+
+    Packages being merged are built against their build deps along with the
+    runtime deps of those, as chosen by the resolver; since merging is done
+    in plan order, an op can be built once the last plan op it transitively
+    requires for that has been merged.
+
+    :param ops: sequence of resolver ops in merge order
+    :return: list with the index of the last op that has to be merged prior
+        to building each op, -1 if it can be built immediately
+    """
+    barriers = []
+    for idx, op in enumerate(ops):
+        if op.desc == 'remove':
+            barriers.append(-1)
+            continue
+        try:
+            required = set(_matching_ops(ops, idx, _op_depends(op, 'depends')))
+            pending = list(required)
+            while pending:
+                dep = ops[pending.pop()]
+                for x in _matching_ops(ops, idx, _op_depends(dep, 'rdepends')):
+                    if x not in required:
+                        required.add(x)
+                        pending.append(x)
+        except compatibility.IGNORED_EXCEPTIONS:
+            raise
+        except Exception:
+            # unknown deps; be conservative and wait on everything prior.
+            barriers.append(idx - 1)
+            continue
+        barriers.append(max(required) if required else -1)
+    return barriers
+
+
+class JobScheduler(object):
+    """Run the build and merge steps of a plan, building jobs in parallel.
+
+    Builds are started in plan order as soon as their barriers allow while
+    merging is serialized in plan order within the calling thread.
+    """
+
+    def __init__(self, jobs, load_average=None):
+        """
+        :param jobs: maximum number of concurrently running builds
+        :param load_average: don't start new builds while other builds are
+            running and the system load average is at least this, None to
+            disable the limit
+        """
+        self.jobs = max(jobs, 1)
+        self.load_average = load_average
+        self._cond = threading.Condition()
+
+    def _overloaded(self):
+        if self.load_average is None:
+            return False
+        try:
+            return os.getloadavg()[0] >= self.load_average
+        except OSError:
+            # unavailable on this platform
+            return False
+
+    def _worker(self, idx, build, results, running):
+        try:
+            result = (True, build(idx))
+        except compatibility.IGNORED_EXCEPTIONS:
+            result = (False, sys.exc_info())
+            raise
+        except Exception:
+            result = (False, sys.exc_info())
+        finally:
+            with self._cond:
+                results[idx] = result
+                running.remove(idx)
+                self._cond.notify_all()
+
+    def run(self, count, barriers, build, merge, discard=None):
+        """Build and merge a sequence of jobs.
+
+        :param count: number of jobs
+        :param barriers: for each job, the index of the last job that has to
+            be merged before it can be built, see :obj:`build_barriers`
+        :param build: callable taking a job index, run in worker threads; its
+            return value is passed to merge
+        :param merge: callable taking a job index and its build result;
+            returning False aborts the run
+        :param discard: callable taking a job index and its build result,
+            invoked for builds that finished but weren't merged due to the
+            run being aborted
+        :return: True if all jobs were merged, False if aborted
+        """
+        cond = self._cond
+        results = {}
+        running = set()
+        threads = []
+        unstarted = list(xrange(count))
+        merged = 0
+        interrupted = False
+        try:
+            while merged < count:
+                with cond:
+                    for idx in unstarted[:]:
+                        if len(running) >= self.jobs:
+                            break
+                        if barriers[idx] >= merged:
+                            continue
+                        if running and self._overloaded():
+                            break
+                        unstarted.remove(idx)
+                        running.add(idx)
+                        t = threading.Thread(
+                            target=self._worker, args=(idx, build, results, running))
+                        t.daemon = True
+                        t.start()
+                        threads.append(t)
+                    if merged not in results:
+                        # timeout so signals aren't blocked and the load
+                        # average gets rechecked
+                        cond.wait(0.5)
+                        continue
+                    success, result = results.pop(merged)
+                if not success:
+                    raise result[0], result[1], result[2]
+                if merge(merged, result) is False:
+                    return False
+                merged += 1
+            return True
+        except compatibility.IGNORED_EXCEPTIONS:
+            # don't wait on running builds; the workers are daemon threads
+            # and the build processes get the interrupt as well
+            interrupted = True
+            raise
+        finally:
+            if not interrupted:
+                for t in threads:
+                    # timeout so waiting can be interrupted
+                    while t.is_alive():
+                        t.join(0.5)
+            if discard is not None:
+                with cond:
+                    finished = sorted(results.iteritems())
+                for idx, (success, result) in finished:
+                    if success:
+                        discard(idx, result)
@@ -2,7 +2,7 @@
 # License: GPL2/BSD
 
 __all__ = (
-    "plan_state", "base_op_state", "add_op", "add_hardref_op",
+    "plan_state", "learned_conflicts", "base_op_state", "add_op", "add_hardref_op",
     "add_backref_op", "remove_op", "replace_op", "blocker_base_op",
     "incref_forward_block_op", "decref_forward_block_op",
 )
@@ -84,6 +84,58 @@ class plan_state(object):
         return len(self.plan)
 
 
+class learned_conflicts(object):
+    """Record of package choices that failed insertion due to conflicts.
+
+    When inserting a package fails, the slotted packages and blockers it
+    conflicted with are recorded for the (atom, package) combination.  Once
+    backtracking leads to the same combination again, and all of those
+    conflicts are still present in the plan, the choice is known to fail
+    again and can be skipped without processing its dependencies first.
+
+    Like the resolver's insoluble set, this ignores the corner case of
+    dependency cycles satisfying the atom while processing the package's
+    dependencies.
+
+    :ivar pruned: number of choices skipped due to learned conflicts
+    """
+
+    def __init__(self):
+        self._conflicts = {}
+        self.pruned = 0
+
+    def __len__(self):
+        return sum(len(x) for x in self._conflicts.itervalues())
+
+    def add(self, atom, pkg, conflicts):
+        """Record conflicts preventing insertion of a package for an atom.
+
+        :param conflicts: sequence of conflicting packages and blockers
+        """
+        conflicts = tuple(conflicts)
+        # conflicts are looked up in the plan by key; unkeyed blockers
+        # can't be checked for
+        if conflicts and all(getattr(x, 'key', None) is not None for x in conflicts):
+            l = self._conflicts.setdefault((atom, pkg), [])
+            if conflicts not in l:
+                l.append(conflicts)
+
+    def check(self, plan, atom, pkg):
+        """Look for learned conflicts of a package that are still present.
+
+        :param plan: :obj:`plan_state` instance
+        :return: the conflicts preventing insertion, None if there are none
+        """
+        for conflicts in self._conflicts.get((atom, pkg), ()):
+            if all(x in plan.state for x in conflicts):
+                self.pruned += 1
+                return conflicts
+        return None
+
+    def clear(self):
+        self._conflicts.clear()
+
+
 class ops_sequence(object):
 
     def __init__(self, sequence, is_livefs=True):
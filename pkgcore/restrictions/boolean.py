@@ -8,12 +8,13 @@ collections of restrictions in AND, NAND, OR, NOR, XOR, XNOR style
 operations.
 """
 
-__all__ = ("AndRestriction", "OrRestriction")
+__all__ = ("AndRestriction", "OrRestriction", "optimize", "restriction_cost")
 
 from itertools import islice
 
 from snakeoil.klass import generic_equality, cached_hash
 
+from pkgcore.log import logger
 from pkgcore.restrictions import restriction
 
 
@@ -586,3 +587,72 @@ class AtMostOneOfRestriction(base):
         if self.negate:
             return "not ?? ( %s )" % " ".join(str(x) for x in self.restrictions)
         return "?? ( %s )" % " ".join(str(x) for x in self.restrictions)
+
+
+# estimated relative cost of pulling a package attribute for matching
+attr_costs = {}
+# available without loading package metadata
+attr_costs.update(dict.fromkeys((
+    "category", "package", "key", "version", "revision", "fullver",
+    "cpvstr", "unversioned_atom", "versioned_atom", "repo.repo_id"), 1))
+# requires parsing the package's metadata.xml
+attr_costs.update(dict.fromkeys((
+    "maintainers", "herds", "local_use", "longdescription", "upstreams",
+    "metadata_xml"), 50))
+# requires reading installed package data or the ebuild environment
+attr_costs.update(dict.fromkeys(("environment", "contents"), 100))
+
+# metadata cache attributes and anything unknown
+default_attr_cost = 10
+
+
+def _attr_cost(attr):
+    cost = attr_costs.get(attr)
+    if cost is None:
+        cost = attr_costs.get(attr.split('.', 1)[0], default_attr_cost)
+    return cost
+
+
+def restriction_cost(restrict):
+    """Estimate the relative cost of matching a restriction.
+
+    Boolean restrictions cost the sum of their children, restrictions on
+    package attributes are costed according to the most expensive attribute
+    they pull; see :obj:`attr_costs`.
+    """
+    if isinstance(restrict, restriction.AlwaysBool):
+        return 0
+    if isinstance(restrict, base):
+        return sum(restriction_cost(x) for x in restrict.restrictions)
+    attrs = getattr(restrict, 'attrs', None)
+    if attrs is None:
+        attr = getattr(restrict, 'attr', None)
+        if attr is None:
+            return default_attr_cost
+        attrs = (attr,)
+    return max(_attr_cost(x) for x in attrs)
+
+
+def optimize(restrict):
+    """Reorder a restriction tree so cheap restrictions are tested first.
+
+    The children of AND and OR nodes are stably sorted by
+    :obj:`restriction_cost`, allowing matching to short-circuit before
+    expensive attributes are pulled.  Other node types (atoms for example)
+    are left as is since their ordering may be significant.
+
+    :return: the reordered restriction, or the original if nothing changed
+    """
+    if restrict.__class__ not in (AndRestriction, OrRestriction):
+        return restrict
+    restrictions = [optimize(x) for x in restrict.restrictions]
+    costs = [restriction_cost(x) for x in restrictions]
+    order = sorted(xrange(len(restrictions)), key=costs.__getitem__)
+    restrictions = tuple(restrictions[x] for x in order)
+    if all(x is y for x, y in zip(restrictions, restrict.restrictions)):
+        return restrict
+    logger.debug(
+        "reordered %s restrictions by cost: %s",
+        restrict.__class__.__name__,
+        ', '.join('%s (%i)' % (x, costs[i]) for i, x in zip(order, restrictions)))
+    return restrict.change_restrictions(*restrictions)
@@ -0,0 +1,133 @@
+# License: GPL2/BSD
+
+"""
+compile package restrictions into fused match functions
+
+Matching a restriction tree interprets it per package: every node costs a
+method call, boolean nodes loop over their children, and package
+restrictions go through generic attribute pulling.  For bulk matching the
+tree is instead flattened once into nested closures, with the children of
+boolean nodes reordered so that cheap attributes such as category, package
+and version are tested prior to ones requiring package metadata.
+"""
+
+__all__ = ("compile_match", "cost")
+
+from operator import attrgetter, itemgetter
+
+from snakeoil.compatibility import IGNORED_EXCEPTIONS
+
+from pkgcore.restrictions import boolean, packages, restriction, values
+
+# shared with the boolean restriction optimizer
+cost = boolean.restriction_cost
+
+
+def _func(obj, attr):
+    f = getattr(obj, attr)
+    return getattr(f, '__func__', f)
+
+_and_match = _func(boolean.AndRestriction, 'match')
+_or_match = _func(boolean.OrRestriction, 'match')
+_pkg_match = _func(packages.PackageRestriction, 'match')
+
+
+def _flatten(restrict, match_func):
+    """Inline non-negated children of the same boolean type."""
+    for x in restrict.restrictions:
+        if (isinstance(x, boolean.base) and not x.negate and
+                _func(x.__class__, 'match') is match_func):
+            for y in _flatten(x, match_func):
+                yield y
+        else:
+            yield x
+
+
+def _compile_boolean(restrict, match_func):
+    compiled = sorted(
+        (_compile(x) for x in _flatten(restrict, match_func)), key=itemgetter(1))
+    funcs = tuple(x[0] for x in compiled)
+    total = sum(x[1] for x in compiled)
+    negate = restrict.negate
+
+    if match_func is _and_match:
+        if len(funcs) == 1 and not negate:
+            return funcs[0], total
+
+        def match(pkg):
+            for f in funcs:
+                if not f(pkg):
+                    return negate
+            return not negate
+    else:
+        if len(funcs) == 1 and not negate:
+            return funcs[0], total
+
+        def match(pkg):
+            for f in funcs:
+                if f(pkg):
+                    return not negate
+            return negate
+    return match, total
+
+
+def _compile_package(restrict):
+    getter = attrgetter(restrict.attr)
+    fallback = restrict.match
+    negate = restrict.negate
+    child = restrict.restriction
+
+    if isinstance(child, values.StrExactMatch) and child.case_sensitive:
+        exact = child.exact
+        negate = negate != child.negate
+
+        def match(pkg):
+            try:
+                val = getter(pkg)
+            except IGNORED_EXCEPTIONS:
+                raise
+            except Exception:
+                # let the restriction deal with logging and ignoring
+                return fallback(pkg)
+            return (exact == str(val)) != negate
+    else:
+        child_match = child.match
+
+        def match(pkg):
+            try:
+                val = getter(pkg)
+            except IGNORED_EXCEPTIONS:
+                raise
+            except Exception:
+                return fallback(pkg)
+            return child_match(val) != negate
+    return match
+
+
+def _compile(restrict):
+    """Return a (match function, cost) tuple for a restriction."""
+    if isinstance(restrict, restriction.AlwaysBool):
+        val = restrict.negate
+        return (lambda pkg: val), 0
+
+    match_func = _func(restrict.__class__, 'match')
+    if isinstance(restrict, boolean.base) and match_func in (_and_match, _or_match):
+        return _compile_boolean(restrict, match_func)
+    elif (match_func is _pkg_match and
+            isinstance(restrict, packages.PackageRestriction) and
+            not isinstance(restrict, packages.PackageRestrictionMulti)):
+        return _compile_package(restrict), cost(restrict)
+    return restrict.match, cost(restrict)
+
+
+def compile_match(restrict):
+    """Compile a package restriction into a match function.
+
+    The function returns the same results as the restriction's match method,
+    but with the restriction tree flattened and reordered to test cheap
+    package attributes first.
+
+    :param restrict: package restriction to compile
+    :return: callable taking a package, returning a boolean
+    """
+    return _compile(restrict)[0]
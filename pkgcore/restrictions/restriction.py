@@ -77,6 +77,15 @@ class AlwaysBool(base):
         return '<%s always %r @%#8x>' % (
             self.__class__.__name__, self.negate, id(self))
 
+    def __reduce__(self):
+        return (_always_bool, (self.type, self.negate))
+
+
+def _always_bool(node_type, negate):
+    # unpickle through instance caching using the same arguments as the
+    # module level instances, keeping AlwaysTrue/AlwaysFalse unique
+    return AlwaysBool(node_type=node_type, negate=negate)
+
 
 class Negate(base):
     """wrap and negate a restriction instance"""
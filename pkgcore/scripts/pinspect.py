@@ -148,6 +148,24 @@ class histo_data(arghparse.ArgparseCommand):
     def get_data(self, repo, options):
         raise NotImplementedError()
 
+    @staticmethod
+    def get_indexed_data(repo, attr):
+        """Pull counts of an attribute's values from a repo's metadata index.
+
+        :return: (data, total) tuple, or None if the repo lacks an up to date
+            index
+        """
+        if getattr(repo, 'raw_repo', None) is not None:
+            # configured repos may evaluate metadata differently
+            return None
+        index = getattr(repo, 'metadata_index', None)
+        if index is None:
+            return None
+        data = index.counts(attr)
+        if data is None:
+            return None
+        return data, len(index)
+
     def transform_data_to_detail(self, data):
         return data
 
@@ -206,6 +224,9 @@ class eapi_usage_kls(histo_data):
     summary_format = ("eapi: %(key)r %(val)s pkgs found, %(percent)s of all repositories")
 
     def get_data(self, repo, options):
+        indexed = self.get_indexed_data(repo, 'eapi')
+        if indexed is not None:
+            return indexed
         eapis = {}
         pos = 0
         for pos, pkg in enumerate(repo):
@@ -225,6 +246,9 @@ class license_usage_kls(histo_data):
     summary_format = "license: %(key)r %(val)s pkgs found, %(percent)s of all repositories"
 
     def get_data(self, repo, options):
+        indexed = self.get_indexed_data(repo, 'license')
+        if indexed is not None:
+            return indexed
         data = {}
         pos = 0
         for pos, pkg in enumerate(repo):
@@ -245,6 +269,9 @@ class eclass_usage_kls(histo_data):
     summary_format = "eclass: %(key)r %(val)s pkgs found, %(percent)s of all repositories"
 
     def get_data(self, repo, options):
+        indexed = self.get_indexed_data(repo, 'inherited')
+        if indexed is not None:
+            return indexed
         pos, data = 0, defaultdict(lambda:0)
         for pos, pkg in enumerate(repo):
             for eclass in getattr(pkg, 'inherited', ()):
@@ -238,6 +238,24 @@ def update_pkg_desc_index(repo, out, err):
     return ret
 
 
+def update_metadata_index(repo, out, err):
+    """Update a repo's inverted metadata index (metadata/pkg-metadata-index.json)"""
+    index = getattr(repo, 'metadata_index', None)
+    if index is None:
+        out.write("repository %s doesn't support metadata indexes" % (repo,))
+        return 0
+    ret = 0
+    try:
+        _updated, failures = index.update()
+    except EnvironmentError as e:
+        err.write("Unable to update metadata index '%s': %s" % (index.path, e.strerror))
+        return os.EX_IOERR
+    for cpv, e in failures:
+        err.write("caught exception '%s' while processing '%s'" % (e, cpv))
+        ret = os.EX_DATAERR
+    return ret
+
+
 # TODO: limit to ebuild repos only
 regen = subparsers.add_parser(
     "regen", parents=shared_options,
@@ -263,6 +281,16 @@ regen_opts.add_argument(
         Number of threads to use for regeneration, defaults to using all
         available processors.
     """)
+regen_opts.add_argument(
+    "--processes", type=int, default=0,
+    help="number of worker processes to use instead of threads",
+    docs="""
+        Number of forked worker processes to use for regeneration. Each
+        worker runs its own ebuild processor while the main process handles
+        all cache updates, avoiding the interpreter lock contention that
+        limits thread scaling. Disabled by default, in which case threads
+        are used.
+    """)
 regen_opts.add_argument(
     "--force", action='store_true', default=False,
     help="force regeneration to occur regardless of staleness checks or repo settings")
@@ -275,10 +303,56 @@ regen_opts.add_argument(
 regen_opts.add_argument(
     "--pkg-desc-index", action='store_true', default=False,
     help="update package description cache (metadata/pkg_desc_index)")
+regen_opts.add_argument(
+    "--metadata-index", action='store_true', default=False,
+    help="update inverted metadata index (metadata/pkg-metadata-index.json)",
+    docs="""
+        Update the repo's inverted index of package EAPIs, USE flags,
+        licenses, maintainers, inherited eclasses, and reverse dependencies.
+        Only packages that changed since the last update are reloaded. If
+        present, the index is used by pquery and pinspect to avoid loading
+        the metadata of every package in the repo.
+    """)
+regen_opts.add_argument(
+    "--ebd-pool-size", type=int, metavar='COUNT',
+    help="max number of idle ebuild processors kept for reuse",
+    docs="""
+        Maximum number of idle ebuild processors kept around for reuse,
+        0 meaning unbounded. Overrides the PKGCORE_EBD_POOL_SIZE setting.
+    """)
+regen_opts.add_argument(
+    "--ebd-max-uses", type=int, metavar='COUNT',
+    help="number of requests after which ebuild processors are recycled",
+    docs="""
+        Number of requests an ebuild processor serves before it's shut down
+        and replaced, 0 meaning never. Overrides the PKGCORE_EBD_MAX_USES
+        setting.
+    """)
+regen_opts.add_argument(
+    "--ebd-min-warm", type=int, metavar='COUNT',
+    help="number of idle ebuild processors kept warm",
+    docs="""
+        Number of idle ebuild processors spawned ahead of time in the
+        background, 0 disabling prespawning. Overrides the
+        PKGCORE_EBD_MIN_WARM setting.
+    """)
+@regen.bind_final_check
+def _regen_validate(parser, namespace):
+    for attr in ('ebd_pool_size', 'ebd_max_uses', 'ebd_min_warm'):
+        val = getattr(namespace, attr)
+        if val is not None and val < 0:
+            parser.error(
+                "--%s must be a non-negative integer: %r" %
+                (attr.replace('_', '-'), val))
+
+
 @regen.bind_main_func
 def regen_main(options, out, err):
     """Regenerate a repository cache."""
     ret = []
+    processor.configure_processor_pool(
+        max_idle=options.ebd_pool_size, max_uses=options.ebd_max_uses,
+        min_warm=options.ebd_min_warm)
 
     for repo in iter_stable_unique(options.repos):
         if not repo.operations.supports("regen_cache"):
@@ -290,7 +364,7 @@ def regen_main(options, out, err):
 
         start_time = time.time()
         repo.operations.regen_cache(
-            threads=options.threads,
+            threads=options.threads, processes=options.processes,
             observer=observer.formatter_output(out), force=options.force,
             eclass_caching=(not options.disable_eclass_caching))
         end_time = time.time()
@@ -313,6 +387,8 @@ def regen_main(options, out, err):
             ret.append(update_use_local_desc(repo, out, err))
         if options.pkg_desc_index:
             ret.append(update_pkg_desc_index(repo, out, err))
+        if options.metadata_index:
+            ret.append(update_metadata_index(repo, out, err))
 
     return int(any(ret))
 
@@ -30,7 +30,15 @@ from pkgcore.restrictions import packages
 from pkgcore.restrictions.boolean import OrRestriction
 from pkgcore.util import commandline, parserestrict
 
-demandload('textwrap:dedent')
+demandload(
+    'hashlib:md5',
+    'os',
+    'textwrap:dedent',
+    'snakeoil.osutils:listdir_dirs,pjoin',
+    'pkgcore.fetch.scheduler:FetchScheduler',
+    'pkgcore.log:logger',
+    'pkgcore.resolver.scheduler:build_barriers,JobScheduler',
+)
 
 
 argparser = commandline.ArgumentParser(
@@ -98,6 +106,38 @@ resolution_options.add_argument(
         Only perform fetching of all targets from SRC_URI based on the current
         USE configuration.
     """)
+resolution_options.add_argument(
+    '--fetch-jobs', type=int, default=1, metavar='JOBS',
+    help="number of packages to fetch files for in parallel",
+    docs="""
+        Fetch the files for up to the given number of packages of the resolved
+        plan in parallel, in the background. Building a package starts as soon
+        as its own files are fetched and verified while the remaining files
+        continue to be fetched. The number of concurrent fetches from a single
+        mirror is limited by the fetcher's per_mirror_jobs setting.
+
+        Defaults to 1, fetching files serially right before building each
+        package.
+    """)
+resolution_options.add_argument(
+    '-j', '--jobs', type=int, default=1, metavar='JOBS',
+    help="number of packages to build in parallel",
+    docs="""
+        Build up to the given number of packages in parallel. Packages are
+        built as soon as the packages they're built against, as chosen by the
+        resolver, have been merged; merging to the livefs is still done one
+        package at a time, in the order of the resolved plan.
+
+        Defaults to 1, building and merging packages serially.
+    """)
+resolution_options.add_argument(
+    '-l', '--load-average', type=float, metavar='LOAD',
+    help="don't start new builds while the load average is too high",
+    docs="""
+        When building packages in parallel, don't start new builds while
+        others are running and the system load average is at least the given
+        value.
+    """)
 resolution_options.add_argument(
     '-1', '--oneshot', action='store_true',
     help="do not record changes in the world file",
@@ -218,6 +258,50 @@ resolution_options.add_argument(
         to conflict with already installed dependencies that aren't involved in
         the graph of the requested operation.
     """)
+resolution_options.add_argument(
+    '--resolver-cache-size', type=int, metavar='SIZE',
+    help="limit the number of repo queries cached by the resolver",
+    docs="""
+        Limit the number of repo query results held in memory by the resolver
+        per repo, evicting the least recently used ones first. By default,
+        all results are held until resolution finishes.
+
+        Queries without matches are tracked separately and aren't limited.
+    """)
+resolution_options.add_argument(
+    '--resolver-cache', action='store_true',
+    help="persist failed resolver queries between runs",
+    docs="""
+        Store the dependencies the resolver found no matches for and reuse
+        them in later runs, skipping those repo queries. The stored data is
+        discarded whenever the repos, the installed packages, the profile,
+        or the configuration change.
+
+        The cache is kept in the cache directory of the installed packages
+        database.
+    """)
+resolution_options.add_argument(
+    '--resolver-profile', metavar='FILE',
+    help="write resolver instrumentation data to a file",
+    docs="""
+        Instrument the resolver, writing call counts and timings of its main
+        steps, backtracking statistics, per repo query counts, and the time
+        spent resolving each atom to the given file once resolution is done.
+
+        See --resolver-profile-format for the supported output formats.
+    """)
+resolution_options.add_argument(
+    '--resolver-profile-format', default='json',
+    choices=('json', 'flamegraph'),
+    help="output format of resolver instrumentation data",
+    docs="""
+        Output format used for --resolver-profile, defaults to json.
+
+        The flamegraph format holds the chains of atoms leading to each
+        resolved atom along with the time spent resolving it in the
+        collapsed stack format supported by flamegraph.pl and similar
+        tools.
+    """)
 
 output_options = argparser.add_argument_group("output related options")
 output_options.add_argument(
@@ -407,6 +491,89 @@ def update_worldset(world_set, pkg, remove=False):
     world_set.flush()
 
 
+def _build_op(op, domain, options, out, build_obs, cleanup,
+              fetch_ops, fetch_scheduler):
+    """Fetch and build the package for a merge op.
+
+    Functions releasing the resources used for the package are appended
+    to cleanup.
+
+    :return: the package to merge, True if only fetching, or None on failure
+    """
+    cleanup.append(op.pkg.release_cached_data)
+
+    if not options.fetchonly and options.debug:
+        out.write("Forcing a clean of workdir")
+
+    queued = fetch_ops.pop(op.pkg, None)
+    out.write("\n%i files required-" % len(op.pkg.fetchables))
+    if queued is not None:
+        pkg_ops, keys = queued
+        fetched = all([fetch_scheduler.wait(key) for key in keys])
+        # pkg_nofetch can only be run from the main thread
+        pkg_ops.run_if_supported("report_fetch_failures")
+    else:
+        pkg_ops = domain.pkg_operations(op.pkg, observer=build_obs)
+        fetched = pkg_ops.run_if_supported("fetch", or_return=True)
+    if not fetched:
+        out.error("fetching failed for %s" % (op.pkg.cpvstr,))
+        return None
+    if options.fetchonly:
+        return True
+
+    buildop = pkg_ops.run_if_supported("build", or_return=None)
+    pkg = op.pkg
+    if buildop is not None:
+        out.write("building %s" % (op.pkg.cpvstr,))
+        result = False
+        try:
+            result = buildop.finalize()
+        except format.errors as e:
+            out.error("caught exception building %s: %s" % (op.pkg.cpvstr, e))
+        else:
+            if result is False:
+                out.error("failed building %s" % (op.pkg.cpvstr,))
+        if result is False:
+            return None
+        pkg = result
+        cleanup.append(pkg.release_cached_data)
+        pkg_ops = domain.pkg_operations(pkg, observer=build_obs)
+        cleanup.append(buildop.cleanup)
+
+    cleanup.append(partial(pkg_ops.run_if_supported, "cleanup"))
+    return pkg_ops.run_if_supported("localize", or_return=pkg)
+
+
+def _merge_op(op, pkg, domain, out, repo_obs, cleanup):
+    """Apply a merge op to the livefs.
+
+    :param pkg: the package to merge as returned by :obj:`_build_op`,
+        unused for removals
+    :return: True on success, False otherwise
+    """
+    out.write()
+    if op.desc == "replace":
+        if op.old_pkg == pkg:
+            out.write(">>> Reinstalling %s" % (pkg.cpvstr))
+        else:
+            out.write(">>> Replacing %s with %s" % (
+                op.old_pkg.cpvstr, pkg.cpvstr))
+        i = domain.replace_pkg(op.old_pkg, pkg, repo_obs)
+        cleanup.append(op.old_pkg.release_cached_data)
+    elif op.desc == "remove":
+        out.write(">>> Removing %s" % op.pkg.cpvstr)
+        i = domain.uninstall_pkg(op.pkg, repo_obs)
+    else:
+        out.write(">>> Installing %s" % (pkg.cpvstr,))
+        i = domain.install_pkg(pkg, repo_obs)
+    try:
+        i.finish()
+    except merge_errors.BlockModification as e:
+        out.error("Failed to merge %s: %s" % (op.pkg, e))
+        return False
+    return True
+
+
 @argparser.bind_final_check
 def _validate(parser, namespace):
     # nothing to validate if listing pkgsets
@@ -533,6 +700,80 @@ def display_pkgsets(out, options):
             out.write(name)
 
 
+def _resolver_cache_path(vdbs):
+    """Return the location of the persistent resolver cache, if any."""
+    for repo in get_raw_repos(vdbs):
+        cache_location = getattr(repo, 'cache_location', None)
+        if cache_location is not None:
+            return pjoin(cache_location, 'resolver-cache')
+    return None
+
+
+def _resolver_cache_fingerprint(domain, repos):
+    """Return a token changing whenever resolver query results may change.
+
+    Covers the domain's effective settings (including environment
+    overrides such as USE), the configuration directory, the profile
+    stack, and the repos.  Synced repos are covered by their
+    metadata/timestamp.chk file, other repos by the mtimes of their
+    category and package directories; ebuilds modified in place without
+    any of those changing aren't noticed.
+    """
+    chksum = md5()
+
+    def update(path, depth=0):
+        path = path.rstrip(os.sep)
+        for root, dirs, files in os.walk(path):
+            level = root[len(path):].count(os.sep)
+            if level >= depth:
+                dirs[:] = []
+            for name in sorted(dirs + files):
+                update_mtime(pjoin(root, name))
+
+    def update_mtime(path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except EnvironmentError:
+            mtime = None
+        chksum.update('%s\0%r\0' % (path, mtime))
+
+    def listdir(path):
+        try:
+            return sorted(listdir_dirs(path))
+        except EnvironmentError:
+            return ()
+
+    for key, value in sorted(domain.settings.iteritems()):
+        if isinstance(value, (set, frozenset)):
+            value = tuple(sorted(value))
+        elif isinstance(value, list):
+            value = tuple(value)
+        if isinstance(value, basestring) or (
+                isinstance(value, tuple) and
+                all(isinstance(x, basestring) for x in value)):
+            chksum.update('%s=%r\0' % (key, value))
+
+    for repo in get_raw_repos(repos):
+        location = getattr(repo, 'location', None)
+        chksum.update('%s\0%s\0' % (repo.__class__.__name__, location))
+        if location is None:
+            continue
+        timestamp = pjoin(location, 'metadata', 'timestamp.chk')
+        if os.path.exists(timestamp):
+            update_mtime(timestamp)
+            continue
+        update_mtime(location)
+        for category in listdir(location):
+            category = pjoin(location, category)
+            update_mtime(category)
+            for package in listdir(category):
+                update_mtime(pjoin(category, package))
+    update(domain.config_dir, 8)
+    for node in getattr(domain.profile, 'stack', ()):
+        update(node.path)
+    return chksum.hexdigest()
+
+
 @argparser.bind_main_func
 def main(options, out, err):
     if options.list_sets:
@@ -635,6 +876,10 @@ def main(options, out, err):
         extra_kwargs['resolver_cls'] = resolver.empty_tree_merge_plan
     if options.debug:
         extra_kwargs['debug'] = True
+    if options.resolver_cache_size is not None:
+        extra_kwargs['cache_size'] = options.resolver_cache_size
+    if options.resolver_profile is not None:
+        extra_kwargs['profile'] = True
 
     # XXX: This should recurse on deep
     if options.newuse:
@@ -663,6 +908,21 @@ def main(options, out, err):
         drop_cycles=options.ignore_cycles, force_replace=options.replace,
         process_built_depends=options.with_bdeps, **extra_kwargs)
 
+    if options.resolver_cache:
+        cache_path = _resolver_cache_path(installed_repos.repos)
+        if cache_path is None:
+            out.warn('no cache location for installed packages, '
+                     'disabling the resolver cache')
+        else:
+            cache_fingerprint = _resolver_cache_fingerprint(
+                domain, source_repos.repos + installed_repos.repos)
+            count = resolver_inst.load_query_cache(cache_path, cache_fingerprint)
+            if options.debug:
+                out.write(out.bold, ' * ', out.reset,
+                          'loaded %i cached failed queries' % count)
+    else:
+        cache_path = None
+
     if options.preload_vdb_state:
         out.write(out.bold, ' * ', out.reset, 'Preloading vdb... ')
         vdb_time = time()
@@ -694,6 +954,35 @@ def main(options, out, err):
 
     if options.debug:
         out.write(out.bold, " * ", out.reset, "resolution took %.2f seconds" % resolve_time)
+        stats = resolver_inst.cache_stats()
+        out.write(out.bold, " * ", out.reset,
+                  "query cache: %(hits)i hits, %(negative_hits)i negative hits, "
+                  "%(misses)i misses, %(evictions)i evictions" % stats)
+        out.write(out.bold, " * ", out.reset,
+                  "%i choices pruned by %i learned conflicts" % (
+                      resolver_inst.conflicts.pruned, len(resolver_inst.conflicts)))
+
+    if options.resolver_profile is not None:
+        profiler = resolver_inst.profiler
+        try:
+            with open(options.resolver_profile, 'w') as f:
+                if options.resolver_profile_format == 'flamegraph':
+                    profiler.write_flamegraph(f)
+                else:
+                    profiler.write_json(f)
+        except EnvironmentError as e:
+            out.error("failed writing resolver profile %r: %s" % (
+                options.resolver_profile, e.strerror))
+        if options.debug:
+            out.write(out.bold, " * ", out.reset,
+                      "%i backtracks, %i plan changes reverted" % (
+                          profiler.backtracks, profiler.reverted))
+
+    if cache_path is not None:
+        try:
+            resolver_inst.save_query_cache(cache_path, cache_fingerprint)
+        except EnvironmentError as e:
+            logger.debug("failed writing resolver cache %r: %s", cache_path, e)
 
     if failures:
         out.write()
@@ -801,6 +1090,86 @@ def main(options, out, err):
 
     change_count = len(changes)
 
+    # queue up fetching for the entire plan, consumed as ops are processed
+    fetch_ops = {}
+    fetch_scheduler = None
+    if options.fetch_jobs > 1:
+        fetch_scheduler = FetchScheduler(options.fetch_jobs)
+        for op in changes:
+            if op.desc != "remove" and op.pkg not in fetch_ops:
+                pkg_ops = domain.pkg_operations(op.pkg, observer=build_obs)
+                # one job per file so a package's files are fetched in
+                # parallel, subject to the fetcher's per mirror limit
+                keys = []
+                if pkg_ops.supports("fetch"):
+                    for fetchable in op.pkg.fetchables:
+                        key = (op.pkg, len(keys))
+                        keys.append(key)
+                        fetch_scheduler.add(
+                            key, pkg_ops.fetch, fetchables=fetchable,
+                            defer_failures=True)
+                fetch_ops[op.pkg] = (pkg_ops, keys)
+        fetch_scheduler.start()
+
+    def update_world(op):
+        if world_set is None:
+            return
+        if op.desc == "remove":
+            out.write('>>> Removing %s from world file' % op.pkg.cpvstr)
+            removal_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
+            update_worldset(world_set, removal_pkg, remove=True)
+        elif not options.oneshot and any(x.match(op.pkg) for x in atoms):
+            if not options.upgrade:
+                out.write('>>> Adding %s to world file' % op.pkg.cpvstr)
+                add_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
+                update_worldset(world_set, add_pkg)
+
+    if options.jobs > 1 and not options.fetchonly:
+        # builds run in worker threads while merging to the livefs is
+        # serialized in plan order within this thread.
+        def build(idx):
+            op = changes[idx]
+            op_cleanup = []
+            if op.desc == "remove":
+                return None, op_cleanup
+            out.write("\nBuilding %i of %i: %s::%s" % (
+                idx + 1, change_count, op.pkg.cpvstr, op.pkg.repo))
+            return _build_op(
+                op, domain, options, out, build_obs, op_cleanup,
+                fetch_ops, fetch_scheduler), op_cleanup
+
+        def merge(idx, result):
+            pkg, op_cleanup = result
+            op = changes[idx]
+            try:
+                out.write("\nMerging %i of %i: %s::%s" % (
+                    idx + 1, change_count, op.pkg.cpvstr, op.pkg.repo))
+                out.title("%i/%i: %s" % (idx + 1, change_count, op.pkg.cpvstr))
+                if op.desc != "remove" and pkg is None:
+                    return options.ignore_failures
+                if not _merge_op(op, pkg, domain, out, repo_obs, op_cleanup):
+                    return options.ignore_failures
+                update_world(op)
+            finally:
+                for func in op_cleanup:
+                    func()
+            return True
+
+        def discard(idx, result):
+            for func in result[1]:
+                func()
+
+        scheduler = JobScheduler(options.jobs, options.load_average)
+        try:
+            if not scheduler.run(len(changes), build_barriers(changes),
+                                 build, merge, discard=discard):
+                return 1
+        finally:
+            if fetch_scheduler is not None:
+                fetch_scheduler.shutdown()
+        out.write("finished")
+        return 0
+
     # left in place for ease of debugging.
     cleanup = []
     try:
@@ -812,72 +1181,19 @@ def main(options, out, err):
 
             out.write("\nProcessing %i of %i: %s::%s" % (count + 1, change_count, op.pkg.cpvstr, op.pkg.repo))
             out.title("%i/%i: %s" % (count + 1, change_count, op.pkg.cpvstr))
+            pkg = None
             if op.desc != "remove":
-                cleanup = [op.pkg.release_cached_data]
-
-                if not options.fetchonly and options.debug:
-                    out.write("Forcing a clean of workdir")
-
-                pkg_ops = domain.pkg_operations(op.pkg, observer=build_obs)
-                out.write("\n%i files required-" % len(op.pkg.fetchables))
-                if not pkg_ops.run_if_supported("fetch", or_return=True):
-                    out.error("fetching failed for %s" % (op.pkg.cpvstr,))
+                pkg = _build_op(
+                    op, domain, options, out, build_obs, cleanup,
+                    fetch_ops, fetch_scheduler)
+                if pkg is None:
                     if not options.ignore_failures:
                         return 1
                     continue
                 if options.fetchonly:
                     continue
 
-                buildop = pkg_ops.run_if_supported("build", or_return=None)
-                pkg = op.pkg
-                if buildop is not None:
-                    out.write("building %s" % (op.pkg.cpvstr,))
-                    result = False
-                    try:
-                        result = buildop.finalize()
-                    except format.errors as e:
-                        out.error("caught exception building %s: %s" % (op.pkg.cpvstr, e))
-                    else:
-                        if result is False:
-                            out.error("failed building %s" % (op.pkg.cpvstr,))
-                    if result is False:
-                        if not options.ignore_failures:
-                            return 1
-                        continue
-                    pkg = result
-                    cleanup.append(pkg.release_cached_data)
-                    pkg_ops = domain.pkg_operations(pkg, observer=build_obs)
-                    cleanup.append(buildop.cleanup)
-
-                cleanup.append(partial(pkg_ops.run_if_supported, "cleanup"))
-                pkg = pkg_ops.run_if_supported("localize", or_return=pkg)
-                # wipe this to ensure we don't inadvertantly use it further down;
-                # we aren't resetting it after localizing, so could have the wrong
-                # set of ops.
-                del pkg_ops
-
-                out.write()
-                if op.desc == "replace":
-                    if op.old_pkg == pkg:
-                        out.write(">>> Reinstalling %s" % (pkg.cpvstr))
-                    else:
-                        out.write(">>> Replacing %s with %s" % (
-                            op.old_pkg.cpvstr, pkg.cpvstr))
-                    i = domain.replace_pkg(op.old_pkg, pkg, repo_obs)
-                    cleanup.append(op.old_pkg.release_cached_data)
-                else:
-                    out.write(">>> Installing %s" % (pkg.cpvstr,))
-                    i = domain.install_pkg(pkg, repo_obs)
-
-                # force this explicitly- can hold onto a helluva lot more
-                # then we would like.
-            else:
-                out.write(">>> Removing %s" % op.pkg.cpvstr)
-                i = domain.uninstall_pkg(op.pkg, repo_obs)
-            try:
-                ret = i.finish()
-            except merge_errors.BlockModification as e:
-                out.error("Failed to merge %s: %s" % (op.pkg, e))
+            if not _merge_op(op, pkg, domain, out, repo_obs, cleanup):
                 if not options.ignore_failures:
                     return 1
                 continue
@@ -887,17 +1203,7 @@ def main(options, out, err):
             # for safety sake, we let the next pass trigger a release also-
             # mainly to protect against any code following triggering reloads
             # basically, be protective
-
-            if world_set is not None:
-                if op.desc == "remove":
-                    out.write('>>> Removing %s from world file' % op.pkg.cpvstr)
-                    removal_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
-                    update_worldset(world_set, removal_pkg, remove=True)
-                elif not options.oneshot and any(x.match(op.pkg) for x in atoms):
-                    if not options.upgrade:
-                        out.write('>>> Adding %s to world file' % op.pkg.cpvstr)
-                        add_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
-                        update_worldset(world_set, add_pkg)
+            update_world(op)
 
 
 #    again... left in place for ease of debugging.
@@ -906,7 +1212,9 @@ def main(options, out, err):
 #    else:
 #        import pdb;pdb.set_trace()
     finally:
-        pass
+        if fetch_scheduler is not None:
+            # drop pending fetches on failure, letting running ones finish
+            fetch_scheduler.shutdown()
 
     # the final run from the loop above doesn't invoke cleanups;
     # we could ignore it, but better to run it to ensure nothing is
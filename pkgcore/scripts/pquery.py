@@ -24,6 +24,7 @@ from snakeoil.demandload import demandload
 from snakeoil.formatters import decorate_forced_wrapping
 
 from pkgcore.ebuild import conditionals, atom
+from pkgcore.ebuild.restricts import DependencyMatch
 from pkgcore.repository.util import get_raw_repos, get_virtual_repos
 from pkgcore.restrictions import packages, values, boolean
 from pkgcore.util import commandline, parserestrict, packages as pkgutils
@@ -673,9 +674,8 @@ def parse_revdep(value):
         targetatom = atom.atom(value)
     except atom.MalformedAtom as e:
         raise argparser.error(e)
-    val_restrict = values.FlatteningRestriction(
-        atom.atom,
-        values.AnyMatch(values.FunctionRestriction(targetatom.intersects)))
+    val_restrict = DependencyMatch(
+        (targetatom.key,), values.FunctionRestriction(targetatom.intersects))
     return packages.OrRestriction(*list(
         packages.PackageRestriction(dep, val_restrict)
         for dep in ('depends', 'rdepends', 'post_rdepends')))
@@ -695,9 +695,9 @@ def revdep_pkgs_finalize(sequence, namespace):
         for repo in namespace.repos:
             l.extend(repo.itermatch(atom_inst))
     # have our pkgs; now build the restrict.
-    any_restrict = values.AnyMatch(
+    r = DependencyMatch(
+        set(pkg.key for pkg in l),
         values.FunctionRestriction(partial(_revdep_pkgs_match, tuple(l))))
-    r = values.FlatteningRestriction(atom.atom, any_restrict)
     return list(packages.PackageRestriction(dep, r)
                 for dep in ('depends', 'rdepends', 'post_rdepends'))
 
@@ -968,20 +968,100 @@ def _validate_args(parser, namespace):
     namespace.attr = list(iter_stable_unique(attrs))
 
 
+def _prime_metadata(repo, options):
+    """Bulk validate the metadata of repos fully matched by a query.
+
+    :return: the primed packages, which must be kept alive while querying
+    """
+    if options.raw and not (options.attr or options.one_attr or
+                            options.force_one_attr):
+        # metadata isn't needed
+        return []
+    restricts = getattr(options.query, 'restrictions', (options.query,))
+    if any(r is not packages.AlwaysTrue for r in restricts):
+        return []
+    pkgs = []
+    for raw_repo in get_raw_repos(repo):
+        validate = getattr(raw_repo, 'validate_metadata', None)
+        if validate is not None:
+            pkgs.extend(validate()[0])
+    return pkgs
+
+
+def _owners_restrict(repo, options):
+    """Narrow down --owns queries to the owning packages using vdb indexes.
+
+    :return: restriction matching the owning packages, or None if the repo
+        doesn't support ownership lookups
+    """
+    if not options._owns:
+        return None
+    raw_repos = get_raw_repos(repo)
+    if not all(hasattr(x, 'owners') for x in raw_repos):
+        return None
+    cpvs = None
+    for restrict in options._owns:
+        paths = [x.location for x in restrict.restriction.vals]
+        owners = set()
+        for raw_repo in raw_repos:
+            for path_owners in raw_repo.owners(paths).itervalues():
+                owners.update(path_owners)
+        cpvs = owners if cpvs is None else cpvs.intersection(owners)
+    if not cpvs:
+        return packages.AlwaysFalse
+    return packages.OrRestriction(*[atom.atom('=%s' % x) for x in sorted(cpvs)])
+
+
+def _index_restrict(repo, restrict):
+    """Narrow down a query to candidate packages using metadata indexes.
+
+    :return: restriction matching the candidate packages, or None if the repo
+        lacks indexes or they can't be used for the query
+    """
+    cpvs = set()
+    for raw_repo in get_raw_repos(repo):
+        index = getattr(raw_repo, 'metadata_index', None)
+        if index is None:
+            return None
+        candidates = index.candidates(restrict)
+        if candidates is None:
+            return None
+        cpvs.update(candidates)
+    return packages.PackageRestriction(
+        'cpvstr', values.FunctionRestriction(frozenset(cpvs).__contains__))
+
+
 @argparser.bind_main_func
 def main(options, out, err):
     """Run a query."""
+    if options.query is None:
+        restrict = None
+    else:
+        # test cheap attributes before ones requiring metadata parsing
+        restrict = boolean.optimize(options.query)
+
     if options.debug:
         for repo in options.repos:
             out.write('repo: %r' % (repo,))
         out.write('restrict: %r' % (options.query,))
+        if restrict is not options.query:
+            out.write('optimized restrict: %s' % (restrict,))
         out.write()
 
-    if options.query is None:
+    if restrict is None:
         return 0
     for repo in options.repos:
+        # held so primed packages stay in the package factory caches
+        primed = _prime_metadata(repo, options)
+        query = restrict
+        candidates = _index_restrict(repo, restrict)
+        if candidates is not None:
+            query = packages.AndRestriction(candidates, query)
+        owners = _owners_restrict(repo, options)
+        if owners is not None:
+            query = packages.AndRestriction(owners, query)
         try:
-            for pkgs in pkgutils.groupby_pkg(repo.itermatch(options.query, sorter=sorted)):
+            for pkgs in pkgutils.groupby_pkg(repo.itermatch(query, sorter=sorted)):
                 pkgs = list(pkgs)
                 if options.noversion:
                     print_packages_noversion(options, out, err, pkgs)
@@ -130,6 +130,8 @@ class FixLibtoolArchivesTrigger(triggers.base):
     required_csets = ('install',)
     _engine_types = triggers.INSTALLING_MODES
     _hooks = ('pre_merge',)
+    # reads .la files prior to merging, out of archive order
+    requires_image = True
 
     def trigger(self, engine, cset):
         updates = []
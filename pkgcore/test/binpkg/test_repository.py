@@ -0,0 +1,141 @@
+# License: GPL2/BSD
+
+import os
+import shutil
+import tarfile
+
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test import TestCase
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.binpkg import repository
+from pkgcore.ebuild import triggers as ebuild_triggers
+from pkgcore.fs import livefs, tar
+from pkgcore.fs.ops import merge_contents
+from pkgcore.merge import const, engine, triggers
+from pkgcore.operations import observer
+from pkgcore.system import libtool
+from pkgcore.test.merge.util import fake_engine, fake_trigger
+
+
+class fake_op(object):
+
+    def __init__(self, D, features=()):
+        self.env = {'D': D}
+        self.features = features
+
+    def setup_workdir(self):
+        pass
+
+
+class fake_pkg(object):
+    mandatory_phases = ()
+
+
+class TestForceUnpacking(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        image = pjoin(self.dir, 'image')
+        for path, data in (('usr/bin/foo', 'foo'), ('usr/share/doc/bar', 'bar')):
+            path = pjoin(image, path)
+            ensure_dirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(data)
+        self.tarball = pjoin(self.dir, 'pkg.tbz2')
+        tar.write_set(livefs.scan(image, offset=image), self.tarball)
+        self.root = pjoin(self.dir, 'root')
+        ensure_dirs(self.root)
+        self.D = pjoin(self.dir, 'D')
+
+    def run_trigger(self, hooks={}, features=()):
+        cset = tar.generate_contents(self.tarball).insert_offset(self.root)
+        replaced = {}
+        engine_hooks = {'sanity_check': [], 'pre_merge': [], 'merge': [triggers.merge()]}
+        for hook, trigger in hooks.iteritems():
+            engine_hooks[hook].append(trigger)
+        engine = fake_engine(
+            mode=const.INSTALL_MODE, offset=self.root, new=fake_pkg(),
+            hooks=engine_hooks, replace_cset=lambda self, name, val: replaced.__setitem__(name, val))
+        repository.force_unpacking(fake_op(self.D, features)).trigger(engine, cset)
+        return engine, cset, replaced
+
+    def assertData(self, cset, base):
+        self.assertEqual(
+            sorted((x.data.path, x.data.text_fileobj().read()) for x in cset.iterfiles()),
+            [(pjoin(base, 'usr/bin/foo'), 'foo'), (pjoin(base, 'usr/share/doc/bar'), 'bar')])
+
+    def test_streaming(self):
+        engine, cset, replaced = self.run_trigger()
+        # nothing is extracted, the data is read from the archive on merging
+        self.assertFalse(os.path.exists(pjoin(self.D, 'usr')))
+        self.assertFalse(replaced)
+        self.assertEqual(
+            [(hook, x.__class__, csets) for hook, x, csets in engine._triggers],
+            [('merge', repository.merged_data_rewrite, ('install',))])
+        merge_contents(cset)
+        engine._triggers[0][1].trigger(engine, cset)
+        self.assertData(cset, self.root)
+
+    def test_unpacking(self):
+        for kwds in ({'hooks': {'pre_merge': fake_trigger(_hooks=('pre_merge',))}},
+                     {'features': ('selinux',)}):
+            engine, cset, replaced = self.run_trigger(**kwds)
+            self.assertFalse(engine._triggers)
+            self.assertEqual(replaced.keys(), ['new_cset'])
+            self.assertData(cset, self.D)
+
+    def test_large_pkg_order(self):
+        # large packages still merge straight from the archive in its order
+        image = pjoin(self.dir, 'image')
+        paths = ['usr/lib/%03i' % x for x in reversed(range(100))]
+        for path in paths:
+            ensure_dirs(os.path.dirname(pjoin(image, path)))
+            with open(pjoin(image, path), 'w') as f:
+                f.write(path)
+        tar.write_set(livefs.scan(image, offset=image), self.tarball)
+        with tarfile.open(self.tarball) as t:
+            order = [os.path.normpath('/' + x.name) for x in t if x.isfile()]
+
+        class pkg(fake_pkg):
+            contents = tar.generate_contents(self.tarball)
+        cset = engine.MergeEngine.get_pkg_contents(
+            fake_engine(compact_cset_threshold=1), None, pkg())
+        self.assertEqual([x.location for x in cset.iterfiles()], order)
+        cset = cset.insert_offset(self.root)
+        merge_contents(cset)
+        for path in paths:
+            with open(pjoin(self.root, path)) as f:
+                self.assertEqual(f.read(), path)
+
+    def test_merge_engine(self):
+        # stream through a real engine with the default triggers
+        class pkg(fake_pkg):
+            contents = tar.generate_contents(self.tarball)
+
+        def merge(*extra_triggers):
+            eng = engine.MergeEngine.install(
+                pjoin(self.dir, 'tmp'), pkg(), offset=self.root,
+                observer=observer.repo_observer(observer.null_output()))
+            repository.force_unpacking(fake_op(self.D)).register(eng)
+            for trigger in extra_triggers:
+                trigger.register(eng)
+            for hook in ('sanity_check', 'pre_merge', 'merge', 'post_merge'):
+                getattr(eng, hook)()
+            for path, data in (('usr/bin/foo', 'foo'), ('usr/share/doc/bar', 'bar')):
+                with open(pjoin(self.root, path)) as f:
+                    self.assertEqual(f.read(), data)
+            return eng
+
+        eng = merge()
+        self.assertFalse(os.path.exists(pjoin(self.D, 'usr')))
+        self.assertData(eng.csets['install'], self.root)
+
+        # triggers reading file data prior to merging force extraction
+        for trigger in (libtool.FixLibtoolArchivesTrigger(),
+                        ebuild_triggers.ConfigProtectInstall()):
+            shutil.rmtree(self.root)
+            ensure_dirs(self.root)
+            merge(trigger)
+            self.assertTrue(os.path.exists(pjoin(self.D, 'usr/bin/foo')))
+            shutil.rmtree(self.D)
@@ -0,0 +1,162 @@
+# License: GPL2/BSD
+
+import os
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from snakeoil.chksum import LazilyHashedPath
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.cache import errors, flat_hash, packed
+from pkgcore.test.cache import util
+
+
+_chf_obj = LazilyHashedPath('/nonexistent/path', md5=0x5a5a)
+
+
+class db(packed.database):
+
+    def __setitem__(self, cpv, data):
+        data['_chf_'] = _chf_obj
+        return packed.database.__setitem__(self, cpv, data)
+
+    def __getitem__(self, cpv):
+        d = dict(packed.database.__getitem__(self, cpv).iteritems())
+        d.pop('_%s_' % self.chf_type, None)
+        return d
+
+
+class TestPacked(util.GenericCacheMixin, TempDirMixin):
+
+    cache_keys = ("DEPEND", "RDEPEND", "EAPI", "HOMEPAGE", "KEYWORDS",
+                  "LICENSE", "PDEPEND", "RESTRICT", "SLOT", "SRC_URI",
+                  "_eclasses_", "_md5_")
+
+    test_data = (
+        ("sys-libs/libtrash-2.4", (
+            ('DEPEND', 'virtual/libc dev-lang/perl'),
+            ('KEYWORDS', '~amd64 ~ppc ~x86'),
+            ('SLOT', '0'),
+            ('_eclasses_', {
+                'eutils': LazilyHashedPath('/nonexistent/eutils', md5=0x1234),
+                'multilib': LazilyHashedPath('/nonexistent/multilib', md5=0xabcd),
+            }),
+        )),
+    )
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        # don't leave exit handlers writing into removed temp dirs
+        self.patcher = mock.patch.object(packed.atexit, 'register')
+        self.atexit_register = self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        TempDirMixin.tearDown(self)
+
+    def get_db(self, readonly=False):
+        return db(self.dir, auxdbkeys=self.cache_keys, readonly=readonly)
+
+    def populate(self, db, cpvs):
+        for cpv in cpvs:
+            db[cpv] = {'SLOT': cpv.rsplit('-', 1)[-1], 'EAPI': '6'}
+        db.commit()
+
+    def test_roundtrip(self):
+        cpvs = ['dev-util/foo-%i' % x for x in range(50)]
+        cpvs += ['app-misc/bar-1', 'sys-apps/portage-2.3']
+        database = self.get_db()
+        self.populate(database, cpvs)
+        self.assertTrue(os.path.exists(pjoin(self.dir, 'metadata', 'md5-cache.pack')))
+
+        database = self.get_db(True)
+        self.assertEqual(sorted(database.iterkeys()), sorted(cpvs))
+        for cpv in cpvs:
+            self.assertIn(cpv, database)
+            self.assertEqual(
+                database[cpv], {'SLOT': cpv.rsplit('-', 1)[-1], 'EAPI': '6'})
+        self.assertNotIn('dev-util/foo-50', database)
+        self.assertNotIn('a', database)
+        self.assertNotIn('zzz/zzz-1', database)
+        self.assertRaises(KeyError, database.__getitem__, 'dev-util/foo-50')
+
+    def test_eclasses(self):
+        database = self.get_db()
+        key, data = self.test_data[0]
+        database[key] = dict(data)
+        database.commit()
+        d = self.get_db(True)[key]
+        self.assertEqual(
+            sorted(d['_eclasses_']),
+            [('eutils', (('md5', 0x1234),)), ('multilib', (('md5', 0xabcd),))])
+
+    def test_pending_updates(self):
+        database = self.get_db()
+        self.populate(database, ['dev-util/foo-1', 'dev-util/foo-2'])
+        database['dev-util/foo-3'] = {'SLOT': '3'}
+        del database['dev-util/foo-1']
+        self.assertRaises(KeyError, database.__delitem__, 'dev-util/foo-1')
+        self.assertEqual(
+            sorted(database.iterkeys()), ['dev-util/foo-2', 'dev-util/foo-3'])
+        self.assertNotIn('dev-util/foo-1', database)
+        self.assertEqual(database['dev-util/foo-3'], {'SLOT': '3'})
+
+        # nothing written until commit
+        self.assertEqual(
+            sorted(self.get_db(True).iterkeys()),
+            ['dev-util/foo-1', 'dev-util/foo-2'])
+        database.commit()
+        self.assertEqual(
+            sorted(self.get_db(True).iterkeys()),
+            ['dev-util/foo-2', 'dev-util/foo-3'])
+
+    def test_exit_flush(self):
+        database = self.get_db()
+        database['dev-util/foo-1'] = {'SLOT': '1'}
+        database['dev-util/foo-2'] = {'SLOT': '2'}
+        self.assertFalse(os.path.exists(database.path))
+        # registered once, on the first queued update
+        self.assertEqual(self.atexit_register.call_count, 1)
+        flush = self.atexit_register.call_args[0][0]
+        flush()
+        self.assertEqual(
+            sorted(self.get_db(True).iterkeys()), ['dev-util/foo-1', 'dev-util/foo-2'])
+        # write failures at exit are only logged
+        database['dev-util/foo-3'] = {'SLOT': '3'}
+        database.readonly = True
+        with mock.patch.object(packed, 'logger') as logger:
+            flush()
+            self.assertTrue(logger.warning.called)
+
+    def test_missing(self):
+        database = self.get_db(True)
+        self.assertEqual(list(database.iterkeys()), [])
+        self.assertNotIn('dev-util/foo-1', database)
+
+    def test_corrupt(self):
+        os.mkdir(pjoin(self.dir, 'metadata'))
+        with open(pjoin(self.dir, 'metadata', 'md5-cache.pack'), 'w') as f:
+            f.write('garbage' * 10)
+        database = self.get_db(True)
+        self.assertRaises(
+            errors.GeneralCacheCorruption, database.__contains__, 'dev-util/foo-1')
+
+    def test_rebuild(self):
+        md5_cache = flat_hash.md5_cache(self.dir, auxdbkeys=self.cache_keys)
+        for cpv in ('dev-util/foo-1', 'dev-util/bar-2', 'app-misc/baz-3'):
+            md5_cache[cpv] = {'SLOT': '0', 'EAPI': '5', '_chf_': _chf_obj}
+        database = self.get_db()
+        self.populate(database, ['dev-util/stale-1'])
+        database.rebuild()
+        self.assertEqual(
+            sorted(database.iterkeys()),
+            ['app-misc/baz-3', 'dev-util/bar-2', 'dev-util/foo-1'])
+        raw = packed.database.__getitem__(self.get_db(True), 'dev-util/bar-2')
+        self.assertEqual(raw['_md5_'], 0x5a5a)
+        self.assertEqual(raw['SLOT'], '0')
+
+        self.assertRaises(errors.ReadOnly, self.get_db(True).rebuild)
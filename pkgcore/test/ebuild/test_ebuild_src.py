@@ -9,7 +9,7 @@ from snakeoil.osutils import pjoin
 from snakeoil.test import TestCase
 from snakeoil.test.mixins import tempdir_decorator
 
-from pkgcore import fetch
+from pkgcore import cache, fetch
 from pkgcore.ebuild import ebuild_src, digest, repo_objs
 from pkgcore.ebuild.eapi import get_eapi
 from pkgcore.package import errors
@@ -445,6 +445,55 @@ class test_package_factory(TestCase):
         self.assertEqual(cache2[pkg.cpvstr],
             {'_eclasses_':{'eclass1':(None, 100)}, 'marker':2, '_mtime_':200})
 
+    @tempdir_decorator
+    def test_validate_metadata(self):
+        ec = FakeEclassCache('/nonexistent/path')
+        rebuilds = []
+
+        def _rebuild_cache_entry(eclasses, entry_eclasses):
+            rebuilds.append(entry_eclasses)
+            return FakeEclassCache._rebuild_cache_entry(ec, eclasses, entry_eclasses)
+        ec._rebuild_cache_entry = _rebuild_cache_entry
+
+        class fake_cache(dict):
+            readonly = False
+            chf_type = 'mtime'
+            _chf_key = '_mtime_'
+            validate_entry = cache.base.validate_entry.im_func
+
+        pkgs = []
+        for ver in range(5):
+            path = pjoin(self.dir, 'diffball-%i.ebuild' % ver)
+            open(path, 'w').close()
+            os.utime(path, (100, 100))
+            pkgs.append(malleable_obj(
+                cpvstr='dev-util/diffball-%i' % ver, path=path))
+        os.utime(pkgs[2].path, (200, 200))
+
+        eclasses = (('eclass1', (('mtime', 100),)),)
+        c = fake_cache(
+            (pkg.cpvstr, {'_mtime_': 100, '_eclasses_': eclasses, 'marker': 1})
+            for pkg in pkgs[:4])
+        c[pkgs[3].cpvstr]['_eclasses_'] = (('eclass2', (('mtime', 1),)),)
+        pf = self.mkinst(cache=(c,), eclasses=ec)
+
+        stale = pf.validate_metadata(pkgs, threads=2)
+        # modified ebuild, outdated eclass, and no cache entry
+        self.assertEqual(stale, [pkgs[2], pkgs[3], pkgs[4]])
+        # stale entries are purged from writable caches
+        self.assertEqual(sorted(c), [pkgs[0].cpvstr, pkgs[1].cpvstr])
+        # each unique eclass set is checked once
+        self.assertLen(rebuilds, 2)
+        for pkg in pkgs[:2]:
+            self.assertEqual(pkg.data['marker'], 1)
+            self.assertEqual(list(pkg.data['_eclasses_']), ['eclass1'])
+        for pkg in stale:
+            self.assertFalse(hasattr(pkg, 'data'))
+
+        # primed packages are skipped
+        self.assertEqual(pf.validate_metadata(pkgs[:2]), [])
+        self.assertLen(rebuilds, 2)
+
     def test_required_use(self):
         pass
 
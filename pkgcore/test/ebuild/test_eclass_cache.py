@@ -74,6 +74,20 @@ class TestEclassCache(TempDirMixin, TestBase):
         self.assertEqual(None, self.ec.get_eclass("foon"))
         self.assertEqual(None, self.ec.get_eclass("foon-eclass"))
 
+    def test_rebuild_cache_entry_memoized(self):
+        data = [('eclass1', [('mtime', 100)])]
+        got = self.ec.rebuild_cache_entry(data)
+        self.assertEqual(list(got), ['eclass1'])
+        self.assertIdentical(got, self.ec.rebuild_cache_entry(data))
+
+        path = pjoin(self.ec_locs['eclass1'], 'eclass1.eclass')
+        os.utime(path, (200, 200))
+        # results are reused until the eclasses are reloaded
+        self.assertIdentical(got, self.ec.rebuild_cache_entry(data))
+        self.ec.reload()
+        self.assertEqual(None, self.ec.rebuild_cache_entry(data))
+        self.assertTrue(self.ec.rebuild_cache_entry([('eclass1', [('mtime', 200)])]))
+
 
 class TestStackedCaches(TestEclassCache):
 
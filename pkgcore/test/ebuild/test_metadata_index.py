@@ -0,0 +1,219 @@
+# License: GPL2/BSD
+
+import json
+import os
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from snakeoil.fileutils import touch
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.ebuild import eclass_cache, metadata_index, repository, restricts
+from pkgcore.ebuild.atom import atom
+from pkgcore.restrictions import packages, values
+from pkgcore.scripts import pquery
+
+
+class TestMetadataIndex(TempDirMixin):
+
+    metadata = {
+        'cat/a-1': {
+            'eapi': ('5',), 'iuse_stripped': ('foo', 'bar'), 'license': ('GPL-2',),
+            'maintainers': (('a@gentoo.org', 'A', None),), 'inherited': ('eutils',),
+            'depends': ('dev-util/foo',), 'rdepends': (), 'post_rdepends': ()},
+        'cat/a-2': {
+            'eapi': ('6',), 'iuse_stripped': ('foo',), 'license': ('BSD',),
+            'maintainers': (('a@gentoo.org', 'A', None),), 'inherited': (),
+            'depends': (), 'rdepends': ('dev-util/foo',), 'post_rdepends': ()},
+        'cat/b-1': {
+            'eapi': ('6',), 'iuse_stripped': (), 'license': ('GPL-2', 'BSD'),
+            'maintainers': (), 'inherited': ('eutils',),
+            'depends': ('cat/a',), 'rdepends': ('cat/a',), 'post_rdepends': ()},
+    }
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.metadata = dict(self.metadata)
+        ensure_dirs(pjoin(self.dir, 'profiles'))
+        ensure_dirs(pjoin(self.dir, 'eclass'))
+        touch(pjoin(self.dir, 'eclass', 'eutils.eclass'))
+        for cpv in self.metadata:
+            self.add_ebuild(cpv)
+        self.pulled = []
+        fields = {}
+        for attr in metadata_index._fields:
+            fields[attr] = lambda pkg, attr=attr: self.pull(pkg, attr)
+        self.patcher = mock.patch.dict(metadata_index._fields, fields)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        TempDirMixin.tearDown(self)
+
+    def pull(self, pkg, attr):
+        self.pulled.append(pkg.cpvstr)
+        return self.metadata[pkg.cpvstr][attr]
+
+    def add_ebuild(self, cpv, mtime=1000):
+        cat, rest = cpv.split('/')
+        pkg = rest.rsplit('-', 1)[0]
+        path = pjoin(self.dir, cat, pkg, '%s.ebuild' % rest)
+        ensure_dirs(os.path.dirname(path))
+        touch(path)
+        # avoid racy mtimes that are never trusted
+        os.utime(path, (mtime, mtime))
+        os.utime(pjoin(self.dir, 'eclass', 'eutils.eclass'), (1000, 1000))
+
+    def mk_tree(self):
+        eclasses = eclass_cache.cache(pjoin(self.dir, 'eclass'))
+        return repository._UnconfiguredTree(self.dir, eclass_cache=eclasses)
+
+    def candidates(self, restrict):
+        return self.mk_tree().metadata_index.candidates(restrict)
+
+    def test_update(self):
+        index = self.mk_tree().metadata_index
+        self.assertFalse(index.exists)
+        self.assertEqual(index.candidates(packages.AlwaysTrue), None)
+        self.assertEqual(index.update(), (3, []))
+        self.assertTrue(os.path.exists(pjoin(
+            self.dir, 'metadata', repository._UnconfiguredTree.metadata_index_filename)))
+
+        # unchanged packages aren't reloaded
+        self.pulled = []
+        index = self.mk_tree().metadata_index
+        self.assertTrue(index.exists)
+        self.assertEqual(index.stale(), frozenset())
+        self.assertEqual(index.update(), (0, []))
+        self.assertEqual(self.pulled, [])
+
+        # modified and added ebuilds are
+        self.add_ebuild('cat/b-1', mtime=2000)
+        self.metadata['cat/c-1'] = self.metadata['cat/b-1']
+        self.add_ebuild('cat/c-1')
+        index = self.mk_tree().metadata_index
+        self.assertEqual(index.stale(), frozenset(['cat/b-1', 'cat/c-1']))
+        self.assertEqual(index.update(), (2, []))
+        self.assertEqual(sorted(set(self.pulled)), ['cat/b-1', 'cat/c-1'])
+        self.assertEqual(len(index), 4)
+
+        # as are packages whose eclasses changed
+        os.utime(pjoin(self.dir, 'eclass', 'eutils.eclass'), (2000, 2000))
+        index = self.mk_tree().metadata_index
+        self.assertEqual(
+            index.stale(), frozenset(['cat/a-1', 'cat/b-1', 'cat/c-1']))
+
+    def test_format(self):
+        # the index is data only, it's loaded from untrusted repos
+        self.mk_tree().metadata_index.update()
+        path = pjoin(
+            self.dir, 'metadata', repository._UnconfiguredTree.metadata_index_filename)
+        with open(path) as f:
+            data = json.load(f)
+        self.assertEqual(sorted(data['entries']), sorted(self.metadata))
+        index = self.mk_tree().metadata_index
+        self.assertEqual(index.counts('eapi'), {'5': 1, '6': 2})
+        self.assertEqual(index.stale(), frozenset())
+
+        # corrupt indexes are ignored
+        with open(path, 'w') as f:
+            f.write('{"version": 3, "entries": {"cat/a-1": 1}}')
+        self.assertFalse(self.mk_tree().metadata_index.exists)
+
+    def test_timestamp(self):
+        timestamp = pjoin(self.dir, 'metadata', 'timestamp.chk')
+        ensure_dirs(os.path.dirname(timestamp))
+        touch(timestamp)
+        os.utime(timestamp, (1000, 1000))
+        self.metadata['cat/a-2'] = {}
+        self.mk_tree().metadata_index.update()
+
+        # synced repos with an unchanged timestamp aren't walked
+        self.add_ebuild('cat/b-1', mtime=2000)
+        index = self.mk_tree().metadata_index
+        with mock.patch.object(metadata_index, '_stat_mtime', return_value=1000) as stat:
+            self.assertEqual(index.stale(), frozenset(['cat/a-2']))
+            self.assertEqual(stat.call_count, 1)
+
+        # but are once it changes
+        os.utime(timestamp, (2000, 2000))
+        self.assertEqual(
+            self.mk_tree().metadata_index.stale(), frozenset(['cat/a-2', 'cat/b-1']))
+
+    def test_update_failures(self):
+        self.metadata['cat/a-2'] = {}
+        updated, failures = self.mk_tree().metadata_index.update()
+        self.assertEqual(updated, 2)
+        self.assertEqual([x[0] for x in failures], ['cat/a-2'])
+        # failed packages are always candidates
+        self.assertEqual(
+            self.candidates(packages.PackageRestriction(
+                'eapi', values.StrExactMatch('5'))),
+            frozenset(['cat/a-1', 'cat/a-2']))
+
+    def test_candidates(self):
+        self.mk_tree().metadata_index.update()
+        use = packages.PackageRestriction(
+            'iuse_stripped', values.ContainmentMatch2(frozenset(['bar', 'foo'])))
+        self.assertEqual(self.candidates(use), frozenset(['cat/a-1', 'cat/a-2']))
+        self.assertEqual(
+            self.candidates(packages.PackageRestriction(
+                'iuse_stripped', values.ContainmentMatch2(
+                    frozenset(['bar', 'foo']), match_all=True))),
+            frozenset(['cat/a-1']))
+        eapi = packages.PackageRestriction('eapi', values.StrExactMatch('6'))
+        self.assertEqual(self.candidates(eapi), frozenset(['cat/a-2', 'cat/b-1']))
+        maintainer = packages.PackageRestriction(
+            'maintainers', values.AnyMatch(values.UnicodeConversion(
+                values.StrRegex('a@', case_sensitive=False))))
+        self.assertEqual(
+            self.candidates(maintainer), frozenset(['cat/a-1', 'cat/a-2']))
+
+        # reverse dependencies
+        revdep = packages.OrRestriction(*[
+            packages.PackageRestriction(attr, restricts.DependencyMatch(
+                ['dev-util/foo'], values.AlwaysTrue))
+            for attr in ('depends', 'rdepends', 'post_rdepends')])
+        self.assertEqual(self.candidates(revdep), frozenset(['cat/a-1', 'cat/a-2']))
+        self.assertEqual(
+            self.candidates(revdep.restrictions[0]), frozenset(['cat/a-1']))
+        self.assertEqual(
+            self.candidates(pquery.parse_revdep('dev-util/foo')),
+            frozenset(['cat/a-1', 'cat/a-2']))
+
+        # boolean combinations
+        self.assertEqual(
+            self.candidates(packages.AndRestriction(use, eapi, atom('cat/a'))),
+            frozenset(['cat/a-2']))
+        self.assertEqual(
+            self.candidates(packages.OrRestriction(eapi, maintainer)),
+            frozenset(self.metadata))
+
+        # unsupported restrictions can't be narrowed down
+        for restrict in (
+                atom('cat/a'),
+                packages.OrRestriction(eapi, atom('cat/a')),
+                packages.AndRestriction(use, negate=True),
+                packages.PackageRestriction(
+                    'eapi', values.StrExactMatch('6'), negate=True),
+                packages.PackageRestriction(
+                    'description', values.StrExactMatch('foo')),
+                packages.PackageRestriction(
+                    'depends', values.ContainmentMatch2(frozenset(['cat/a']))),
+                ):
+            self.assertEqual(self.candidates(restrict), None, msg=restrict)
+
+    def test_counts(self):
+        index = self.mk_tree().metadata_index
+        self.assertEqual(index.counts('eapi'), None)
+        index.update()
+        self.assertEqual(index.counts('eapi'), {'5': 1, '6': 2})
+        self.assertEqual(index.counts('license'), {'GPL-2': 2, 'BSD': 2})
+        self.assertEqual(index.counts('inherited'), {'eutils': 2})
+        # out of date indexes can't be used
+        self.add_ebuild('cat/b-1', mtime=2000)
+        self.assertEqual(self.mk_tree().metadata_index.counts('eapi'), None)
@@ -0,0 +1,232 @@
+# License: GPL2/BSD
+
+import sys
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from snakeoil.test import TestCase
+
+from pkgcore.ebuild import processor
+
+
+class fake_processor(object):
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def _run_depend_like_phase(self, command, pkg, eclass_cache, commands):
+        for key, val in self.metadata.iteritems():
+            commands['key'](self, '%s=%s' % (key, val))
+
+
+class TestProcessorPool(TestCase):
+
+    def setUp(self):
+        # snakeoil's TestCase doesn't run cleanups, so patchers are stopped
+        # in tearDown
+        self.patchers = [
+            mock.patch.dict(processor._pool_preload),
+            mock.patch.dict(processor._pool_refilling, clear=True),
+            mock.patch.object(processor, '_hot_eclasses', processor.Counter()),
+            mock.patch.object(processor, 'active_ebp_list', []),
+            mock.patch.object(processor, 'inactive_ebp_list', []),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+
+    def test_hot_eclasses(self):
+        cache = object()
+        processor._pool_preload['eclass_cache'] = cache
+        get_keys = processor.EbuildProcessor.get_keys.im_func
+        for inherited in ('eutils multilib', 'eutils', ''):
+            self.assertEqual(
+                get_keys(fake_processor({'INHERITED': inherited}), None, cache),
+                {'INHERITED': inherited})
+        processor.note_inherited_eclasses(cache, ('flag-o-matic', 'eutils'))
+        self.assertEqual(
+            processor._hot_eclasses.most_common(2), [('eutils', 3), ('multilib', 1)])
+
+        # only the pool's eclass cache is tracked
+        processor.note_inherited_eclasses(object(), ('foo',))
+        self.assertNotIn('foo', processor._hot_eclasses)
+
+    def test_foreground_fill(self):
+        # foreground fills leave the background fill registration alone
+        key = (False, False)
+        processor._pool_refilling[key] = thread = object()
+        with mock.patch.object(processor, '_count_idle', return_value=1):
+            processor.warm_processor_pool(1, *key)
+            self.assertIdentical(processor._pool_refilling.get(key), thread)
+            # unlike the background fill itself
+            processor._fill_pool(False, False, 1, background=True)
+            self.assertNotIn(key, processor._pool_refilling)
+
+
+    def _release(self, ebp, **settings):
+        processor.active_ebp_list.append(ebp)
+        with mock.patch.dict(processor._pool_settings, settings):
+            self.assertTrue(processor.release_ebuild_processor(ebp))
+
+    @mock.patch.object(processor, '_start_pool_fill')
+    def test_release(self, start_pool_fill):
+        def mk_ebp(uses):
+            return mock.Mock(locked=False, uses=uses, **{
+                'userprived.return_value': False,
+                'sandboxed.return_value': True})
+
+        # unknown processors aren't released
+        self.assertFalse(processor.release_ebuild_processor(mk_ebp(0)))
+
+        # processors are reused until they hit max_uses
+        ebp = mk_ebp(9)
+        self._release(ebp, max_idle=0, max_uses=10, min_warm=0)
+        self.assertEqual(processor.inactive_ebp_list, [ebp])
+        self.assertFalse(ebp.shutdown_processor.called)
+
+        # at which point they're recycled, refilling the pool if it's kept warm
+        processor.inactive_ebp_list[:] = []
+        ebp = mk_ebp(10)
+        self._release(ebp, max_idle=0, max_uses=10, min_warm=0)
+        self.assertEqual(processor.inactive_ebp_list, [])
+        ebp.shutdown_processor.assert_called_once_with()
+        self.assertFalse(start_pool_fill.called)
+        ebp = mk_ebp(10)
+        self._release(ebp, max_idle=0, max_uses=10, min_warm=2)
+        ebp.shutdown_processor.assert_called_once_with()
+        start_pool_fill.assert_called_once_with(False, True, 2)
+
+        # max_uses=0 never recycles
+        ebp = mk_ebp(1000)
+        self._release(ebp, max_idle=0, max_uses=0, min_warm=0)
+        self.assertEqual(processor.inactive_ebp_list, [ebp])
+
+        # idle processors beyond max_idle are shut down
+        processor.inactive_ebp_list[:] = [mk_ebp(0), mk_ebp(0)]
+        ebp = mk_ebp(0)
+        self._release(ebp, max_idle=3, max_uses=0, min_warm=0)
+        self.assertFalse(ebp.shutdown_processor.called)
+        self.assertEqual(len(processor.inactive_ebp_list), 3)
+        ebp = mk_ebp(0)
+        self._release(ebp, max_idle=3, max_uses=0, min_warm=0)
+        ebp.shutdown_processor.assert_called_once_with()
+        self.assertNotIn(ebp, processor.inactive_ebp_list)
+        self.assertEqual(len(processor.inactive_ebp_list), 3)
+
+        # while max_idle=0 keeps them all
+        ebp = mk_ebp(0)
+        self._release(ebp, max_idle=0, max_uses=0, min_warm=0)
+        self.assertEqual(len(processor.inactive_ebp_list), 4)
+
+    def test_configure(self):
+        with mock.patch.dict(processor._pool_settings):
+            processor.configure_processor_pool(max_uses=5, min_warm=0)
+            self.assertEqual(processor._pool_settings['max_uses'], 5)
+            self.assertEqual(processor._pool_settings['min_warm'], 0)
+            max_idle = processor._pool_settings['max_idle']
+            processor.configure_processor_pool()
+            self.assertEqual(processor._pool_settings['max_idle'], max_idle)
+            self.assertRaises(
+                ValueError, processor.configure_processor_pool, max_idle=-1)
+
+
+class fake_eclass(object):
+
+    def __init__(self, path):
+        self.path = path
+
+
+class fake_eclass_cache(object):
+
+    def __init__(self, **eclasses):
+        self.eclasses = dict(
+            (name, fake_eclass(path)) for name, path in eclasses.iteritems())
+
+
+class TestPreloadedEclasses(TestCase):
+
+    verify = staticmethod(
+        processor.EbuildProcessor._verify_preloaded_eclasses.im_func)
+
+    def mk_ebp(self, preload_source=None, clears=True, **preloaded):
+        ebp = mock.Mock(_preload_source=preload_source)
+        ebp._preloaded_eclasses = preloaded
+
+        def clear():
+            ebp._preloaded_eclasses.clear()
+            return clears
+        ebp.clear_preloaded_eclasses.side_effect = clear
+        return ebp
+
+    def test_matching(self):
+        cache = fake_eclass_cache(eutils='/repo/eclass/eutils.eclass')
+        ebp = self.mk_ebp(eutils='/repo/eclass/eutils.eclass')
+        self.assertTrue(self.verify(ebp, cache))
+        self.assertFalse(ebp.clear_preloaded_eclasses.called)
+        self.assertEqual(
+            ebp._preloaded_eclasses, {'eutils': '/repo/eclass/eutils.eclass'})
+        self.assertIdentical(ebp._preload_source, cache)
+
+    def test_mismatch(self):
+        # an overlay's eclass shadowing the preloaded one
+        cache = fake_eclass_cache(eutils='/overlay/eclass/eutils.eclass')
+        ebp = self.mk_ebp(eutils='/repo/eclass/eutils.eclass')
+        self.assertTrue(self.verify(ebp, cache))
+        ebp.clear_preloaded_eclasses.assert_called_once_with()
+        self.assertEqual(ebp._preloaded_eclasses, {})
+        self.assertIdentical(ebp._preload_source, cache)
+
+        # eclasses missing from the cache
+        ebp = self.mk_ebp(multilib='/repo/eclass/multilib.eclass')
+        self.assertTrue(self.verify(ebp, cache))
+        ebp.clear_preloaded_eclasses.assert_called_once_with()
+
+    def test_known_source(self):
+        # already verified against this cache, so it isn't rechecked
+        cache = fake_eclass_cache(eutils='/overlay/eclass/eutils.eclass')
+        ebp = self.mk_ebp(cache, eutils='/repo/eclass/eutils.eclass')
+        self.assertTrue(self.verify(ebp, cache))
+        self.assertFalse(ebp.clear_preloaded_eclasses.called)
+
+    def test_clear_failure(self):
+        cache = fake_eclass_cache()
+        ebp = self.mk_ebp(clears=False, eutils='/repo/eclass/eutils.eclass')
+        self.assertFalse(self.verify(ebp, cache))
+        self.assertIdentical(ebp._preload_source, None)
+
+
+class TestProcessorThreads(TestCase):
+
+    def test_worker_thread(self):
+        # processors are used from the build threads of pmerge --jobs;
+        # reusing one checks its health with a timeout, which can't rely on
+        # signals off the main thread
+        results = []
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(2):
+                    ebp = processor.request_ebuild_processor()
+                    try:
+                        results.append(ebp.is_alive)
+                        # nothing is sent, so this times out
+                        results.append(ebp.expect('nothing', timeout=0.1))
+                    finally:
+                        processor.release_ebuild_processor(ebp)
+            except Exception:
+                errors.append(sys.exc_info())
+
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        self.assertEqual(results, [True, False, True, False])
@@ -1269,3 +1269,61 @@ class TestOnDiskProfile(profile_mixin, TestCase):
         self.assertNotEqual(p, None)
         self.assertEqual(normpath(p.basepath), normpath(base))
         self.assertEqual(normpath(p.profile), normpath(pjoin(base, '1')))
+
+    def test_cache(self):
+        self.mk_profiles(
+            {"package.mask": "dev-util/foo", "make.defaults": 'USE="a b"\n'},
+            {"package.mask": "-dev-util/foo\ndev-util/bar",
+             "package.provided": "dev-util/diffball-0.7.1",
+             "use.force": "b", "make.defaults": 'USE="-a c"\n'},
+        )
+        cache_dir = pjoin(self.dir, 'cache')
+        # avoid racy mtimes that are never trusted
+        for root, dirs, files in os.walk(self.dir):
+            for x in files:
+                os.utime(pjoin(root, x), (1000, 1000))
+
+        def get_profile():
+            return self.get_profile("1", cache_location=cache_dir)
+
+        uncached = self.get_profile("1")
+        p = get_profile()
+        self.assertEqual(p.masks, uncached.masks)
+        self.assertTrue(os.path.exists(p.cache_path))
+
+        attrs = ('masks', 'default_env', 'forced_use', 'system', 'use')
+        p = get_profile()
+        for attr in attrs:
+            self.assertEqual(getattr(p, attr), getattr(uncached, attr), attr)
+        self.assertEqual(p._incremental_masks(), uncached._incremental_masks())
+        self.assertEqual([x.cpvstr for x in p.provides_repo],
+                         ["dev-util/diffball-0.7.1"])
+        # cached values are used instead of parsing profile nodes; the
+        # instance cached root node is shared with the other profiles
+        self.assertFalse([x for x in p.stack[1:] if hasattr(x, '_masks')])
+
+        # modified profiles invalidate the cache
+        path = pjoin(self.dir, "1", "package.mask")
+        with open(path, "a") as f:
+            f.write("\ndev-util/foo")
+        os.utime(path, (2000, 2000))
+        self.assertEqual(
+            sorted(get_profile().masks),
+            sorted(atom("dev-util/" + x) for x in ["bar", "foo"]))
+
+        # as do corrupted caches
+        p = get_profile()
+        with open(p.cache_path, 'r+b') as f:
+            f.seek(-8, os.SEEK_END)
+            f.write('\0' * 8)
+        with mock.patch('pkgcore.ebuild.profiles.logger') as logger:
+            self.assertEqual(len(get_profile().masks), 2)
+            self.assertTrue(logger.warning.called)
+
+        # unwritable cache locations don't cause everything to be built
+        os.unlink(p.cache_path)
+        with mock.patch('pkgcore.ebuild.profiles.os.access', return_value=False):
+            p = get_profile()
+            self.assertEqual(len(p.masks), 2)
+        self.assertFalse(os.path.exists(p.cache_path))
+        self.assertFalse(hasattr(p, '_system'))
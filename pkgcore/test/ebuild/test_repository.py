@@ -2,6 +2,7 @@
 # Copyright: 2007 Marien Zwart <marienz@gentoo.org>
 # License: BSD/GPL2
 
+import json
 import os
 import textwrap
 
@@ -189,6 +190,49 @@ class UnconfiguredTreeTest(TempDirMixin):
                     repo.itermatch(atom('cat/pkg'))), ['cat/pkg-3'])
                 os.unlink(fp)
 
+    def test_index(self):
+        ensure_dirs(pjoin(self.dir, 'cat', 'pkg'))
+        ensure_dirs(pjoin(self.dir, 'cat', 'pkg2'))
+        touch(pjoin(self.dir, 'cat', 'pkg', 'pkg-3.ebuild'))
+        for path in ('', 'cat', 'cat/pkg', 'cat/pkg2'):
+            # avoid racy mtimes that are never trusted
+            os.utime(pjoin(self.dir, path), (1000, 1000))
+
+        def tree_contents(repo):
+            return dict(repo.categories), dict(repo.packages), dict(repo.versions)
+
+        repo = self.mk_tree(self.dir, indexed=True)
+        contents = tree_contents(repo)
+        self.assertEqual(
+            contents, tree_contents(self.mk_tree(self.dir)))
+        index_path = pjoin(self.dir, 'metadata', repo.index_filename)
+        self.assertFalse(os.path.exists(index_path))
+        repo._index.flush()
+        self.assertTrue(os.path.exists(index_path))
+        # stored in the repo, so it's data only
+        with open(index_path) as f:
+            self.assertEqual(json.load(f)['location'], self.dir)
+        # creating the metadata dir modified the repo dir
+        os.utime(self.dir, (1000, 1000))
+        repo = self.mk_tree(self.dir, indexed=True)
+        self.assertEqual(tree_contents(repo), contents)
+        repo._index.flush()
+
+        # unmodified dirs aren't read
+        with mock.patch('pkgcore.ebuild.repository.listdir_files') as listdir_files, \
+                mock.patch('pkgcore.ebuild.repository.listdir_dirs') as listdir_dirs:
+            repo = self.mk_tree(self.dir, indexed=True)
+            self.assertEqual(tree_contents(repo), contents)
+            self.assertFalse(listdir_files.called)
+            self.assertFalse(listdir_dirs.called)
+
+        # modified dirs are
+        touch(pjoin(self.dir, 'cat', 'pkg2', 'pkg2-1.ebuild'))
+        os.utime(pjoin(self.dir, 'cat', 'pkg2'), (2000, 2000))
+        repo = self.mk_tree(self.dir, indexed=True)
+        self.assertEqual(repo.versions[('cat', 'pkg2')], ('1',))
+        self.assertEqual(repo.versions[('cat', 'pkg')], ('3',))
+
     def test_package_mask(self):
         with open(pjoin(self.pdir, 'package.mask'), 'w') as f:
             f.write(textwrap.dedent('''\
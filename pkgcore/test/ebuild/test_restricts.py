@@ -0,0 +1,42 @@
+# License: GPL2/BSD
+
+from snakeoil.test import TestCase
+
+from pkgcore.ebuild import conditionals
+from pkgcore.ebuild.atom import atom
+from pkgcore.ebuild.restricts import DependencyMatch
+from pkgcore.restrictions import values
+
+
+class TestDependencyMatch(TestCase):
+
+    def test_match(self):
+        depset = conditionals.DepSet.parse(
+            'dev-util/foo foo? ( >=dev-libs/bar-2 !dev-libs/baz )', atom)
+        seen = []
+
+        def func(dep):
+            seen.append(dep)
+            return True
+
+        r = DependencyMatch(['dev-libs/bar'], values.FunctionRestriction(func))
+        self.assertTrue(r.match(depset))
+        # atoms on other keys aren't checked
+        self.assertEqual(seen, [atom('>=dev-libs/bar-2')])
+        self.assertFalse(DependencyMatch(
+            ['dev-libs/bar'], values.FunctionRestriction(func), negate=True).match(depset))
+        self.assertFalse(DependencyMatch(
+            ['dev-util/bar'], values.AlwaysTrue).match(depset))
+        self.assertTrue(DependencyMatch(
+            ['dev-libs/baz'], values.AlwaysTrue).match(depset))
+        self.assertFalse(DependencyMatch(
+            ['dev-util/foo'], values.AlwaysFalse).match(depset))
+
+    def test_hash(self):
+        r = DependencyMatch(['dev-libs/bar', 'dev-libs/baz'], values.AlwaysTrue)
+        same = DependencyMatch(['dev-libs/baz', 'dev-libs/bar'], values.AlwaysTrue)
+        self.assertEqual(r, same)
+        self.assertEqual(hash(r), hash(same))
+        self.assertEqual(len(set([r, same])), 1)
+        self.assertNotEqual(
+            r, DependencyMatch(['dev-libs/bar', 'dev-libs/baz'], values.AlwaysTrue, negate=True))
@@ -0,0 +1,98 @@
+# License: GPL2/BSD
+
+import copy
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from snakeoil.test import TestCase
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.ebuild.misc import ChunkedDataDict, chunked_data
+from pkgcore.ebuild.use_universe import UseUniverse, UseFlagSet
+from pkgcore.test.misc import FakePkg
+
+
+class TestUseFlagSet(TestCase):
+
+    def setUp(self):
+        self.universe = UseUniverse()
+
+    def test_set_protocol(self):
+        foo = self.universe.flagset(['foo', 'bar'])
+        self.assertEqual(len(self.universe), 2)
+        self.assertIn('foo', foo)
+        self.assertNotIn('baz', foo)
+        self.assertNotIn('unknown', foo)
+        self.assertEqual(sorted(foo), ['bar', 'foo'])
+        self.assertEqual(len(foo), 2)
+        self.assertTrue(foo)
+        self.assertFalse(self.universe.flagset())
+        self.assertEqual(foo, frozenset(['foo', 'bar']))
+        self.assertEqual(set(['foo', 'bar']), foo)
+        self.assertNotEqual(foo, set(['foo']))
+        self.assertEqual(hash(foo), hash(frozenset(['foo', 'bar'])))
+        self.assertEqual(hash(foo), hash(foo))
+        self.assertRaises(AttributeError, setattr, foo, 'mask', 0)
+
+        # immutable, so copies are the same object
+        self.assertIdentical(copy.copy(foo), foo)
+        self.assertIdentical(copy.deepcopy(foo), foo)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(
+                pickle.loads(pickle.dumps(foo, protocol)), frozenset(foo))
+
+    def test_operations(self):
+        foo = self.universe.flagset(['foo', 'bar'])
+        bar = self.universe.flagset(['bar', 'baz'])
+        # equal sets are shared
+        self.assertIdentical(foo, self.universe.flagset(['bar', 'foo']))
+        self.assertIdentical(foo.union(), foo)
+        for result, expected in (
+                (foo | bar, ['bar', 'baz', 'foo']),
+                (foo & bar, ['bar']),
+                (foo - bar, ['foo']),
+                (foo.union(['new']), ['bar', 'foo', 'new']),
+                (foo.intersection(['foo', 'unknown']), ['foo']),
+                (foo.difference(set(['foo'])), ['bar']),
+                (foo ^ bar, ['baz', 'foo']),
+                (foo.symmetric_difference(['foo', 'new']), ['bar', 'new']),
+                (frozenset(['foo', 'unknown']) ^ foo, ['bar', 'unknown']),
+                ):
+            self.assertIsInstance(result, UseFlagSet)
+            self.assertEqual(sorted(result), expected)
+        self.assertFalse(foo.isdisjoint(bar))
+        self.assertTrue(foo.isdisjoint(['baz', 'unknown']))
+        self.assertTrue((foo & bar).issubset(foo))
+        self.assertTrue(foo.issubset(['foo', 'bar', 'baz']))
+        self.assertFalse(foo.issubset(bar))
+        self.assertTrue(foo.issuperset(['foo']))
+        self.assertFalse(foo.issuperset(['foo', 'unknown']))
+
+        # reversed operations with builtin sets
+        self.assertEqual(frozenset(['foo', 'unknown']) - foo, frozenset(['unknown']))
+        self.assertEqual(set(['bar', 'baz']) | foo, frozenset(['foo', 'bar', 'baz']))
+        self.assertEqual(set(['bar', 'baz']) & foo, frozenset(['bar']))
+
+        # strict subsets and supersets
+        self.assertTrue(foo & bar < foo)
+        self.assertFalse(foo < foo)
+        self.assertTrue(foo < frozenset(['foo', 'bar', 'baz']))
+        self.assertFalse(foo < bar)
+        self.assertTrue(foo > foo & bar)
+        self.assertFalse(foo > foo)
+        self.assertTrue(foo > frozenset(['foo']))
+        self.assertFalse(foo > frozenset(['foo', 'unknown']))
+
+    def test_render_chunks(self):
+        d = ChunkedDataDict()
+        d.add_bare_global((), ('foo', 'bar'))
+        d.update_from_stream([
+            chunked_data(atom('dev-util/foo'), ('foo',), ('baz',))])
+        d.freeze()
+        for cpv in ('dev-util/foo-1', 'dev-util/bar-1'):
+            pkg = FakePkg(cpv)
+            flags = d.pull_flagset(pkg, self.universe)
+            self.assertIsInstance(flags, UseFlagSet)
+            self.assertEqual(flags, d.pull_data(pkg))
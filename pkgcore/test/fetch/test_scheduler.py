@@ -0,0 +1,104 @@
+# License: GPL2/BSD
+
+import threading
+
+from snakeoil.test import TestCase
+
+from pkgcore.fetch import fetchable
+from pkgcore.fetch.scheduler import FetchScheduler
+from pkgcore.operations import format
+
+
+class TestFetchScheduler(TestCase):
+
+    def test_results(self):
+        sched = FetchScheduler(3)
+        for x in range(10):
+            sched.add(x, lambda val: val * 2, x)
+        sched.start()
+        self.assertEqual([sched.wait(x) for x in reversed(range(10))],
+                         [x * 2 for x in reversed(range(10))])
+        sched.shutdown()
+        self.assertRaises(KeyError, sched.wait, 0)
+
+    def test_parallel(self):
+        # jobs block until all of them are running
+        barrier = threading.Semaphore(0)
+        running = []
+        lock = threading.Lock()
+
+        def job(x):
+            with lock:
+                running.append(x)
+                if len(running) == 3:
+                    for _ in range(3):
+                        barrier.release()
+            barrier.acquire()
+            return x
+
+        sched = FetchScheduler(3)
+        for x in range(3):
+            sched.add(x, job, x)
+        sched.start()
+        self.assertEqual([sched.wait(x) for x in range(3)], [0, 1, 2])
+        sched.shutdown()
+
+    def test_exceptions(self):
+        class fail(Exception):
+            pass
+
+        def job():
+            raise fail()
+
+        sched = FetchScheduler(2)
+        sched.add('bad', job)
+        sched.add('good', lambda: True)
+        sched.start()
+        self.assertRaises(fail, sched.wait, 'bad')
+        self.assertTrue(sched.wait('good'))
+        sched.shutdown()
+
+    def test_shutdown(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def job():
+            started.set()
+            return finish.wait()
+
+        sched = FetchScheduler(1)
+        sched.add(0, job)
+        sched.add(1, lambda: 1)
+        sched.start()
+        self.assertIn(1, sched)
+        started.wait()
+        # queued jobs are dropped while running ones finish
+        sched.shutdown(wait=False)
+        self.assertNotIn(1, sched)
+        finish.set()
+        self.assertTrue(sched.wait(0))
+        sched.shutdown()
+        self.assertRaises(KeyError, sched.wait, 1)
+
+    def test_deferred_failures(self):
+        # failures of background fetches are handled in the main thread,
+        # pkg_nofetch requires an ebuild processor
+        failed = []
+
+        class fetch_op(format.fetch_base):
+            def failed_fetch(self, target, observer):
+                failed.append((target.filename, threading.current_thread().name))
+
+        files = [fetchable(x) for x in ('a', 'b', 'c')]
+        op = fetch_op(None, None, files, lambda f: None if f.filename == 'b' else f.filename)
+        sched = FetchScheduler(3)
+        for x in files:
+            sched.add(x.filename, op.fetch_one, x, None, True)
+        sched.start()
+        self.assertEqual([sched.wait(x.filename) for x in files], [True, False, True])
+        sched.shutdown()
+        self.assertEqual(failed, [])
+        op.report_failures(None)
+        self.assertEqual(failed, [('b', threading.current_thread().name)])
+        op.report_failures(None)
+        self.assertEqual(len(failed), 1)
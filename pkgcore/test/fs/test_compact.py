@@ -0,0 +1,119 @@
+# License: GPL2/BSD
+
+import os
+
+from snakeoil.data_source import data_source, local_source
+from snakeoil.test import TestCase
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.fs import contents, fs, livefs
+from pkgcore.fs.compact import CompactContentsSet
+from pkgcore.test.fs import test_contents
+
+
+class TestCompactContentsSet(test_contents.TestContentsSet):
+
+    kls = CompactContentsSet
+
+
+class TestColumns(TempDirMixin, TestCase):
+
+    def assertSameObj(self, obj1, obj2):
+        self.assertEqual(obj1.__class__, obj2.__class__)
+        self.assertEqual(obj1.location, obj2.location)
+        for attr in obj1.__attrs__:
+            if attr in ('chksums', 'data'):
+                continue
+            self.assertEqual(
+                getattr(obj1, attr), getattr(obj2, attr), msg=(obj1, attr))
+            self.assertEqual(
+                type(getattr(obj1, attr)), type(getattr(obj2, attr)),
+                msg=(obj1, attr))
+
+    def test_roundtrip(self):
+        objs = [
+            fs.fsFile("/vdb/file", chksums={"md5": 2 ** 127 + 5}, mtime=100L,
+                      strict=False),
+            fs.fsFile("/image/file", mode=0644, uid=0, gid=0, mtime=1.5,
+                      data=local_source("/tmp/image/file"), dev=1, inode=2,
+                      chksums={"size": 10}),
+            fs.fsFile("/lazy", strict=False),
+            fs.fsFile("/archive", data=data_source("foo"), strict=False),
+            fs.fsDir("/dir", mode=0755, strict=False),
+            fs.fsSymlink("/sym", "dir", mtime=100L, strict=False),
+            fs.fsDev("/dev/null", major=1, minor=3, mode=020666, strict=False),
+            fs.fsFifo("/fifo", strict=False),
+        ]
+        cset = CompactContentsSet(objs)
+        self.assertEqual(len(cset), len(objs))
+        self.assertEqual(
+            [x.location for x in cset], sorted(x.location for x in objs))
+        for obj in objs:
+            self.assertSameObj(obj, cset[obj.location])
+
+        self.assertEqual(cset["/vdb/file"].chksums, {"md5": 2 ** 127 + 5})
+        self.assertEqual(cset["/image/file"].data.path, "/tmp/image/file")
+        self.assertEqual(cset["/image/file"].chksums, {"size": 10})
+        self.assertEqual(cset["/lazy"].data.path, "/lazy")
+        self.assertIsInstance(cset["/lazy"].chksums, fs._LazyChksums)
+        # objects that don't fit the columns are kept as is
+        self.assertIdentical(cset["/archive"], objs[3])
+        self.assertEqual(cset, contents.contentsSet(objs))
+
+    def test_livefs(self):
+        for x in ("a/b", "c"):
+            os.makedirs(os.path.join(self.dir, x))
+            with open(os.path.join(self.dir, x, "file"), "w") as f:
+                f.write(x)
+        os.symlink("a", os.path.join(self.dir, "sym"))
+        orig = livefs.scan(self.dir, offset=self.dir)
+        cset = CompactContentsSet(orig)
+        for obj in orig:
+            self.assertSameObj(obj, cset[obj.location])
+        self.assertEqual(cset["/c/file"].chksums["size"], 1)
+
+        # offset changes keep data sources pointing at the original files
+        offset = cset.insert_offset("/foo")
+        self.assertEqual(offset, orig.insert_offset("/foo"))
+        self.assertEqual(offset["/foo/a/b/file"].data.path,
+                         os.path.join(self.dir, "a/b/file"))
+        self.assertEqual(offset.change_offset("/foo", "/"), orig)
+
+    def test_modifications(self):
+        # exercise merging buffered modifications
+        cset = CompactContentsSet(mutable=True)
+        cset._dict.max_pending = 5
+        files = [fs.fsFile("/dir/%03i" % x, strict=False) for x in range(50)]
+        for obj in reversed(files):
+            cset.add(obj)
+        self.assertEqual([x.location for x in cset], [x.location for x in files])
+        for obj in files[::2]:
+            cset.remove(obj)
+        cset.add(fs.fsDir("/dir/001", strict=False))
+        self.assertTrue(cset["/dir/001"].is_dir)
+        self.assertNotIn("/dir/000", cset)
+        self.assertEqual(len(cset), 25)
+        self.assertEqual(len(cset.dirs()), 1)
+
+    def test_set_ops(self):
+        mk = lambda paths: CompactContentsSet(
+            fs.fsFile(x, strict=False) for x in paths)
+        a = mk(["/a", "/b", "/c", "/e"])
+        b = CompactContentsSet(
+            [fs.fsDir("/b", strict=False), fs.fsFile("/d", strict=False),
+             fs.fsFile("/e", strict=False)])
+        self.assertEqual(sorted(a.difference(b)), sorted(mk(["/a", "/c"])))
+        both = a.intersection(b)
+        self.assertEqual([x.location for x in both], ["/b", "/e"])
+        self.assertTrue(both["/b"].is_dir)
+        self.assertEqual([x.location for x in a.union(b)],
+                         ["/a", "/b", "/c", "/d", "/e"])
+        self.assertTrue(a.union(b)["/b"].is_reg)
+        a.difference_update(b)
+        self.assertEqual([x.location for x in a], ["/a", "/c"])
+
+        cset = mk(["/usr", "/usr-foo", "/usr/bin", "/usr/bin/x"])
+        self.assertEqual([x.location for x in cset.child_nodes("/usr")],
+                         ["/usr/bin", "/usr/bin/x"])
+        self.assertEqual([x.location for x in cset.iter_child_nodes("/")],
+                         ["/usr", "/usr-foo", "/usr/bin", "/usr/bin/x"])
@@ -24,6 +24,8 @@ del x
 
 class TestContentsSet(TestCase):
 
+    kls = contents.contentsSet
+
     locals().update((x, globals()[x]) for x in
         ("mk_file", "mk_dir", "mk_link", "mk_dev", "mk_fifo"))
 
@@ -43,16 +45,16 @@ class TestContentsSet(TestCase):
         self.all = self.dirs + self.links + self.devs + self.fifos
 
     def test_init(self):
-        self.assertEqual(len(self.all), len(contents.contentsSet(self.all)))
-        self.assertRaises(TypeError, contents.contentsSet, self.all + [1])
-        contents.contentsSet(self.all)
-        contents.contentsSet(self.all, mutable=True)
+        self.assertEqual(len(self.all), len(self.kls(self.all)))
+        self.assertRaises(TypeError, self.kls, self.all + [1])
+        self.kls(self.all)
+        self.kls(self.all, mutable=True)
         # test to ensure no one screwed up the optional initials
         # making it mandatory
-        self.assertEqual(len(contents.contentsSet()), 0)
+        self.assertEqual(len(self.kls()), 0)
 
     def test_add(self):
-        cs = contents.contentsSet(self.files + self.dirs, mutable=True)
+        cs = self.kls(self.files + self.dirs, mutable=True)
         map(cs.add, self.links)
         for x in self.links:
             self.assertIn(x, cs)
@@ -60,24 +62,24 @@ class TestContentsSet(TestCase):
             len(cs),
             len(set(x.location for x in self.files + self.dirs + self.links)))
         self.assertRaises(AttributeError,
-            lambda:contents.contentsSet(mutable=False).add(self.devs[0]))
+            lambda:self.kls(mutable=False).add(self.devs[0]))
         self.assertRaises(TypeError, cs.add, 1)
         self.assertRaises(TypeError, cs.add, self.fifos)
 
     def test_remove(self):
         self.assertRaises(AttributeError,
-            contents.contentsSet(mutable=False).remove, self.devs[0])
+            self.kls(mutable=False).remove, self.devs[0])
         self.assertRaises(AttributeError,
-            contents.contentsSet(mutable=False).remove, 1)
-        cs = contents.contentsSet(self.all, mutable=True)
+            self.kls(mutable=False).remove, 1)
+        cs = self.kls(self.all, mutable=True)
         map(cs.remove, self.all)
-        cs = contents.contentsSet(self.all, mutable=True)
+        cs = self.kls(self.all, mutable=True)
         map(cs.remove, (x.location for x in self.all))
         self.assertEqual(len(cs), 0)
         self.assertRaises(KeyError, cs.remove, self.all[0])
 
     def test_contains(self):
-        cs = contents.contentsSet(mutable=True)
+        cs = self.kls(mutable=True)
         for x in [y[0] for y in [
                 self.files, self.dirs, self.links, self.devs, self.fifos]]:
             self.assertFalse(x in cs)
@@ -88,17 +90,17 @@ class TestContentsSet(TestCase):
             cs.remove(x)
 
     def test_clear(self):
-        cs = contents.contentsSet(self.all, mutable=True)
+        cs = self.kls(self.all, mutable=True)
         self.assertTrue(len(cs))
         cs.clear()
         self.assertEqual(len(cs), 0)
 
     def test_len(self):
-        self.assertEqual(len(contents.contentsSet(self.all)), len(self.all))
+        self.assertEqual(len(self.kls(self.all)), len(self.all))
 
     def iterobj(self, name, obj_class=None, forced_name=None):
         s = set(getattr(self, name))
-        cs = contents.contentsSet(s)
+        cs = self.kls(s)
         if forced_name is None:
             forced_name = "iter"+name
 
@@ -120,7 +122,7 @@ class TestContentsSet(TestCase):
 
     def listobj(self, name, obj_class=None):
         valid_list = getattr(self, name)
-        cs = contents.contentsSet(valid_list)
+        cs = self.kls(valid_list)
         test_list = getattr(cs, name)()
         if obj_class is not None:
             for x in test_list:
@@ -156,7 +158,7 @@ class TestContentsSet(TestCase):
             source = [[fs.fsDir("/tmp", strict=False)],
                       [fs.fsFile("/tmp", strict=False)]]
 
-        c1, c2 = [contents.contentsSet(x) for x in source]
+        c1, c2 = [self.kls(x) for x in source]
         if name.endswith("_update"):
             getattr(c1, name)(c2)
             c3 = c1
@@ -166,7 +168,7 @@ class TestContentsSet(TestCase):
             set(ret),
             set(x.location for x in c3))
 
-        c1, c2 = [contents.contentsSet(x) for x in source]
+        c1, c2 = [self.kls(x) for x in source]
         if name.endswith("_update"):
             getattr(c1, name)(iter(c2))
             c3 = c1
@@ -204,8 +206,8 @@ class TestContentsSet(TestCase):
 
     def check_complex_set_op(self, name, *test_cases):
         for required, data1, data2 in test_cases:
-            cset1 = contents.contentsSet(data1)
-            cset2 = contents.contentsSet(data2)
+            cset1 = self.kls(data1)
+            cset2 = self.kls(data2)
             f = getattr(cset1, name)
             got = f(cset2)
             self.assertEqual(got, required,
@@ -247,14 +249,14 @@ class TestContentsSet(TestCase):
 
     def test_child_nodes(self):
         self.assertEqual(sorted(['/usr', '/usr/bin', '/usr/foo']),
-            sorted(x.location for x in contents.contentsSet(
+            sorted(x.location for x in self.kls(
                 [self.mk_dir("/usr"), self.mk_dir("/usr/bin"),
                 self.mk_file("/usr/foo")])))
 
     def test_map_directory_structure(self):
-        old = contents.contentsSet([self.mk_dir("/dir"),
+        old = self.kls([self.mk_dir("/dir"),
             self.mk_link("/sym", "dir")])
-        new = contents.contentsSet([self.mk_file("/sym/a"),
+        new = self.kls([self.mk_file("/sym/a"),
             self.mk_dir("/sym")])
         # verify the machinery is working as expected.
         ret = new.map_directory_structure(old)
@@ -276,7 +278,7 @@ class TestContentsSet(TestCase):
     def test_add_missing_directories(self):
         src = [self.mk_file("/dir1/a"), self.mk_file("/dir2/dir3/b"),
             self.mk_dir("/dir1/dir4")]
-        cs = contents.contentsSet(src)
+        cs = self.kls(src)
         cs.add_missing_directories()
         self.assertEqual(sorted(x.location for x in cs),
             ['/dir1', '/dir1/a', '/dir1/dir4', '/dir2', '/dir2/dir3',
@@ -291,7 +293,7 @@ class TestContentsSet(TestCase):
             target = {k: sorted(v) for k, v in target.iteritems()}
             self.assertEqual(d, target)
 
-        cs = contents.contentsSet()
+        cs = self.kls()
         f1 = self.mk_file("/f", dev=1, inode=1)
         cs.add(f1)
         check_it({(1,1):[f1]})
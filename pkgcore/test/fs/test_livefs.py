@@ -3,11 +3,16 @@
 
 import os
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 from snakeoil.osutils import pjoin
 from snakeoil.test import TestCase
 from snakeoil.test.mixins import TempDirMixin
 
-from pkgcore.fs import fs, livefs
+from pkgcore.fs import compact, fs, livefs
 from pkgcore.fs.contents import contentsSet
 
 
@@ -103,6 +108,44 @@ class FsObjsTest(TempDirMixin, TestCase):
             seen.append(obj.location)
         self.assertEqual((files[0],), tuple(sorted(seen)))
 
+    def test_scan(self):
+        path = pjoin(self.dir, "scan")
+        for x in ("a/b", "c"):
+            os.makedirs(pjoin(path, x))
+        for x in ("a/foo", "a/b/bar", "baz"):
+            with open(pjoin(path, x), "w") as f:
+                f.write(x)
+        os.symlink("baz", pjoin(path, "sym"))
+        os.mkfifo(pjoin(path, "fifo"))
+        expected = contentsSet(livefs.iter_scan(path, offset=path))
+
+        # fs objs are created on access
+        cset = livefs.scan(path, offset=path)
+        self.assertInstance(cset, compact.CompactContentsSet)
+        self.assertTrue(cset.mutable)
+        self.assertEqual(sorted(cset), sorted(expected))
+        for obj in cset:
+            self.check_attrs(obj, obj.location, offset=path)
+        self.assertEqual(cset["/sym"].target, "baz")
+        self.assertEqual(
+            cset["/a/b/bar"].data.text_fileobj().read(), "a/b/bar")
+        self.assertFalse(livefs.scan(path, mutable=False).mutable)
+
+        # entries not fitting the columns in bulk are added one by one,
+        # those not fitting them at all are stored as objs
+        with mock.patch.object(compact._Columns, "from_stats", return_value=None):
+            self.assertEqual(sorted(livefs.scan(path, offset=path)), sorted(expected))
+            with mock.patch.object(compact, "_valid_int", return_value=False):
+                cset = livefs.scan(path, offset=path)
+                self.assertEqual(sorted(cset), sorted(expected))
+                self.assertEqual(
+                    list(cset._dict.columns().flags), [compact._OBJ] * len(expected))
+
+        # as are scans with non-default checksums
+        cset = livefs.scan(path, offset=path, chksum_types=["md5"])
+        self.assertNotInstance(cset, compact.CompactContentsSet)
+        self.assertEqual(sorted(cset), sorted(expected))
+
     def test_sorted_scan(self):
         path = os.path.join(self.dir, "sorted_scan")
         os.mkdir(path)
@@ -127,6 +170,46 @@ class FsObjsTest(TempDirMixin, TestCase):
         sorted_files = livefs.sorted_scan(nonexistent_path, nonexistent=True)
         self.assertEqual(sorted_files, [nonexistent_path])
 
+        # symlinks are only included if followed and pointing at files
+        os.symlink(files[0], pjoin(path, 'link'))
+        os.symlink(dirs[0], pjoin(path, 'dirlink'))
+        open(pjoin(dirs[0], 'sub'), 'w').close()
+        self.assertEqual(
+            livefs.sorted_scan(path),
+            [pjoin(path, x) for x in ['a/sub', 'blah', 'dar', 'tmp']])
+        self.assertEqual(
+            livefs.sorted_scan(path, follow_symlinks=True),
+            [pjoin(path, x) for x in
+             ['a/sub', 'blah', 'dar', 'dirlink/sub', 'link', 'tmp']])
+
+    def test_iter_scan_entries(self):
+        path = pjoin(self.dir, "entries")
+        os.mkdir(path)
+        os.mkdir(pjoin(path, "dir"))
+        open(pjoin(path, "dir", "file"), "w").close()
+        os.symlink("dir/file", pjoin(path, "link"))
+
+        entries = sorted(livefs.iter_scan_entries(path, stat=False))
+        self.assertEqual(entries, [
+            (path, 'directory'),
+            (pjoin(path, 'dir'), 'directory'),
+            (pjoin(path, 'dir/file'), 'file'),
+            (pjoin(path, 'link'), 'symlink')])
+        self.assertEqual(
+            sorted(livefs.iter_scan_entries(
+                path, follow_symlinks=True, stat=False))[-1],
+            (pjoin(path, 'link'), 'file'))
+
+        entries = sorted(livefs.iter_scan_entries(path, offset=path))
+        self.assertEqual(
+            [x[0] for x in entries], ['/dir', '/dir/file', '/link'])
+        for location, st in entries:
+            self.assertEqual(st, os.lstat(path + location))
+        # matches the objects iter_scan generates
+        self.assertEqual(
+            sorted(x.location for x in livefs.iter_scan(path, offset=path)),
+            [x[0] for x in entries])
+
 
     def test_relative_sym(self):
         f = os.path.join(self.dir, "relative-symlink-test")
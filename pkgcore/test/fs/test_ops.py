@@ -1,10 +1,16 @@
 # Copyright: 2006 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD
 
+import errno
 import os
 import shutil
 
-from snakeoil.data_source import local_source
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from snakeoil.data_source import data_source, local_source
 from snakeoil.osutils import pjoin
 from snakeoil.test import TestCase, SkipTest
 from snakeoil.test.mixins import TempDirMixin
@@ -116,6 +122,89 @@ class TestCopyFile(VerifyMixin, TempDirMixin, TestCase):
         self.assertRaises(ops.CannotOverwrite, ops.default_copyfile, f)
 
 
+class TestTransferData(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.src = pjoin(self.dir, "src")
+        self.dest = pjoin(self.dir, "dest")
+        with open(self.src, "w") as f:
+            f.write("asdf\n" * 1000)
+        with open(self.dest, "w") as f:
+            f.write("stale\n" * 2000)
+        self.transfer_modes = ops._transfer_modes
+
+    def tearDown(self):
+        ops._transfer_modes = self.transfer_modes
+        ops._unsupported_transfers.clear()
+        TempDirMixin.tearDown(self)
+
+    def check(self, data):
+        with open(self.dest) as f:
+            self.assertEqual(f.read(), data)
+
+    def test_local(self):
+        self.assertIn(
+            ops.default_transfer_data(local_source(self.src), self.dest),
+            ('reflink', 'copy_file_range', 'sendfile', 'buffered'))
+        self.check("asdf\n" * 1000)
+
+    def test_buffered(self):
+        self.assertEqual(
+            ops.default_transfer_data(data_source("foo"), self.dest), 'buffered')
+        self.check("foo")
+
+    def test_fallback(self):
+        calls = []
+
+        def unsupported(src_fd, dst_fd, size):
+            calls.append(size)
+            os.write(dst_fd, "partial")
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+        def failing(src_fd, dst_fd, size):
+            raise OSError(errno.EIO, os.strerror(errno.EIO))
+
+        orig = ops._transfer_modes
+        ops._transfer_modes = (('unsupported', unsupported),) + orig
+        self.assertNotEqual(
+            ops.default_transfer_data(local_source(self.src), self.dest),
+            'unsupported')
+        self.check("asdf\n" * 1000)
+        # failing modes aren't retried for the same filesystems
+        ops.default_transfer_data(local_source(self.src), self.dest)
+        self.assertEqual(calls, [5000])
+
+        # other errors are propagated
+        ops._transfer_modes = (('failing', failing),)
+        self.assertRaises(
+            EnvironmentError, ops.default_transfer_data,
+            local_source(self.src), self.dest)
+
+        # without usable modes data is copied through buffers
+        ops._transfer_modes = ()
+        self.assertEqual(
+            ops.default_transfer_data(local_source(self.src), self.dest),
+            'buffered')
+        self.check("asdf\n" * 1000)
+
+    def test_short_copy(self):
+        def short(src_fd, dst_fd, size):
+            # the kernel copies a single chunk, then stops early
+            rets = [os.write(dst_fd, os.read(src_fd, 100)), 0]
+            ops._kernel_copy(lambda n: rets.pop(0), size)
+
+        orig = ops._transfer_modes
+        ops._transfer_modes = (('short', short),)
+        self.assertEqual(
+            ops.default_transfer_data(local_source(self.src), self.dest),
+            'buffered')
+        self.check("asdf\n" * 1000)
+        # the mode is still used for other files
+        self.assertFalse(
+            [x for x in ops._unsupported_transfers if x[0] == 'short'])
+
+
 class ContentsMixin(VerifyMixin, TempDirMixin, TestCase):
 
     entries_norm1 = {
@@ -213,6 +302,41 @@ class Test_merge_contents(ContentsMixin):
         os.mkdir(fp)
         ops.merge_contents(cset)
 
+    def test_parallel(self):
+        src = self.gen_dir("src")
+        entries = {"dir": ["dir"], "dir/sym": ["sym", "file0"]}
+        entries.update(("dir/file%i" % x, ["reg"]) for x in range(20))
+        self.generate_tree(src, entries)
+        for x in range(20):
+            with open(pjoin(src, "dir/file%i" % x), "w") as f:
+                f.write("x" * x)
+        os.link(pjoin(src, "dir/file3"), pjoin(src, "hardlink"))
+        cset = livefs.scan(src, offset=src)
+
+        merged = []
+        stats = {}
+        dest = self.gen_dir("dest")
+        self.assertTrue(ops.merge_contents(
+            cset, offset=dest, callback=merged.append, parallelism=4, stats=stats))
+        self.assertEqual(livefs.scan(src, offset=src), livefs.scan(dest, offset=dest))
+        # entries are reported in order, directories first
+        self.assertEqual(
+            [x.location for x in merged],
+            [x.location for x in contents.offset_rewriter(
+                dest, sorted(cset.iterdirs()) + list(cset.iterdirs(invert=True)))])
+        self.assertEqual(
+            os.stat(pjoin(dest, "hardlink")).st_ino,
+            os.stat(pjoin(dest, "dir/file3")).st_ino)
+        self.assertEqual(stats['files'], 20)
+        self.assertEqual(stats['bytes'], sum(range(20)))
+        self.assertEqual(sum(stats['modes'].itervalues()), 20)
+
+        # failures in copying threads are propagated
+        os.unlink(pjoin(src, "dir/file7"))
+        self.assertRaises(
+            EnvironmentError, ops.merge_contents, cset,
+            offset=self.gen_dir("dest"), parallelism=4)
+
     def test_dir_over_file(self):
         # according to the spec, dirs can't be merged over files that
         # aren't dirs or symlinks to dirs
@@ -260,3 +384,36 @@ class Test_unmerge_contents(ContentsMixin):
         open(fp, "w").close()
         self.assertTrue(ops.unmerge_contents(cset, offset=img))
         self.assertTrue(os.path.exists(fp))
+
+    def test_pruning(self):
+        entries = {"a": ["dir"], "a/b": ["dir"], "a/b/c": ["dir"], "a/d": ["dir"],
+                   "e": ["dir"], "e/f": ["dir"]}
+        entries.update(("%s/file" % k, ["reg"]) for k in list(entries))
+        img, cset = self.generic_unmerge_bits(entries)
+        open(pjoin(img, "e/f/linger"), "w").close()
+
+        removed = []
+        stats = {}
+        with mock.patch('os.rmdir', wraps=os.rmdir) as rmdir:
+            self.assertTrue(ops.unmerge_contents(
+                cset, offset=img, callback=removed.append, parallelism=4,
+                keep_dirs=frozenset([pjoin(img, "a/b")]), stats=stats))
+        # kept directories and the parents of ones still in use are skipped
+        self.assertEqual(
+            sorted(x[0][0] for x in rmdir.call_args_list),
+            [pjoin(img, x) for x in ("a/b/c", "a/d", "e/f")])
+        self.assertEqual(
+            sorted(x.location for x in removed if x.is_dir),
+            [pjoin(img, "a/b/c"), pjoin(img, "a/d")])
+        self.assertEqual(
+            sorted(x.location for x in livefs.scan(img, offset=img)),
+            ["/a", "/a/b", "/e", "/e/f", "/e/f/linger"])
+        self.assertEqual((stats['files'], stats['dirs']), (6, 2))
+
+        # failures in unlinking threads are propagated
+        img, cset = self.generic_unmerge_bits(entries)
+        os.unlink(pjoin(img, "a/d/file"))
+        os.mkdir(pjoin(img, "a/d/file"))
+        self.assertRaises(
+            EnvironmentError, ops.unmerge_contents, cset, offset=img,
+            parallelism=4)
@@ -3,12 +3,14 @@
 
 import os
 
+from snakeoil import data_source
 from snakeoil.osutils import pjoin
 from snakeoil.test import TestCase
 from snakeoil.test.mixins import tempdir_decorator
 
 from pkgcore.fs import livefs
-from pkgcore.fs.contents import contentsSet
+from pkgcore.fs.compact import CompactContentsSet
+from pkgcore.fs.contents import contentsSet, OrderedContentsSet
 from pkgcore.merge import engine
 from pkgcore.test.fs.fs_util import fsFile, fsDir, fsSymlink
 from pkgcore.test.merge.util import fake_engine
@@ -69,6 +71,21 @@ class Test_MergeEngineCsets(TestCase):
         self.assertCsetEqual(self.simple_cset, new_cset)
         # must differ; shouldn't be modifying the original cset
         self.assertNotIdentical(self.simple_cset, new_cset)
+        # large csets are stored compactly
+        new_cset = self.kls.get_pkg_contents(
+            fake_engine(compact_cset_threshold=1), None, fake_pkg(self.simple_cset))
+        self.assertIsInstance(new_cset, CompactContentsSet)
+        self.assertCsetEqual(self.simple_cset, new_cset)
+        # but not if their order matters or their data isn't on disk
+        ordered = OrderedContentsSet(reversed(list(self.simple_cset)))
+        archived = contentsSet(
+            x.change_attributes(data=data_source.data_source('foo'))
+            if x.is_reg else x for x in self.simple_cset)
+        for cset in (ordered, archived):
+            new_cset = self.kls.get_pkg_contents(
+                fake_engine(compact_cset_threshold=1), None, fake_pkg(cset))
+            self.assertNotIsInstance(new_cset, CompactContentsSet)
+            self.assertEqual(list(new_cset), list(cset))
 
     def test_get_remove_cset(self):
         files = contentsSet(self.simple_cset.iterfiles(invert=True))
@@ -649,3 +649,70 @@ class TestPruneFiles(TestCase):
         self.assertNotIn('/sporks-suck', ' '.join(info))
         self.assertIn('/foons-rule', ' '.join(info))
         self.assertIn('/mango', ' '.join(info))
+
+
+class TestUnmerge(mixins.TempDirMixin, TestCase):
+
+    kls = triggers.unmerge
+
+    def test_owned_dirs(self):
+        cset = contentsSet([
+            fs.fsDir('/off/usr', strict=False),
+            fs.fsDir('/off/usr/share', strict=False),
+            fs.fsDir('/off/opt', strict=False),
+            fs.fsFile('/off/usr/share/foo', strict=False),
+        ])
+        owners = {
+            '/usr': ('cat/pkg-1', 'dev-util/bar-2'),
+            '/usr/share': ('cat/pkg-1',),
+            '/usr/share/foo': ('cat/pkg-1',),
+        }
+
+        class fake_vdb(object):
+            indexed = True
+
+            def owners(self, paths, indexed_only=False):
+                if indexed_only and not self.indexed:
+                    return None
+                return {k: owners[k] for k in paths if k in owners}
+
+        class fake_pkg(object):
+            cpvstr = 'cat/pkg-1'
+            repo = fake_vdb()
+
+        engine = fake_engine(mode=const.UNINSTALL_MODE, offset='/off/', old=fake_pkg())
+        self.assertEqual(self.kls._owned_dirs(engine, cset), frozenset(['/off/usr']))
+        # the reverse index isn't built from scratch for an unmerge
+        fake_pkg.repo.indexed = False
+        self.assertEqual(self.kls._owned_dirs(engine, cset), frozenset())
+        # vdbs lacking a reverse index don't protect anything
+        fake_pkg.repo = object()
+        self.assertEqual(self.kls._owned_dirs(engine, cset), frozenset())
+        engine = fake_engine(mode=const.UNINSTALL_MODE, offset='/')
+        self.assertEqual(self.kls._owned_dirs(engine, cset), frozenset())
+
+    def test_keep_owned_dirs(self):
+        # empty directories owned by other packages are left in place
+        for x in ('usr/share/foo', 'opt/foo'):
+            os.makedirs(pjoin(self.dir, x))
+            open(pjoin(self.dir, x, 'file'), 'w').close()
+        cset = scan(self.dir)
+
+        class fake_vdb(object):
+            @staticmethod
+            def owners(paths, indexed_only=False):
+                return {k: ('dev-util/bar-2',) for k in paths if k == '/usr/share'}
+
+        class fake_pkg(object):
+            cpvstr = 'cat/pkg-1'
+            repo = fake_vdb()
+
+        removed = []
+        engine = fake_engine(
+            mode=const.UNINSTALL_MODE, offset=self.dir, old=fake_pkg(), parallelism=1,
+            observer=fake_reporter(removing_fs_obj=removed.append, debug=lambda *a: None))
+        self.assertTrue(self.kls().trigger(engine, cset))
+        self.assertEqual(
+            sorted(x.location for x in scan(self.dir, offset=self.dir)),
+            ['/usr', '/usr/share'])
+        self.assertNotIn(pjoin(self.dir, 'usr/share'), [x.location for x in removed])
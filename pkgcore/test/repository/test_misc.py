@@ -0,0 +1,71 @@
+# License: GPL2/BSD
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.repository.misc import caching_repo
+from pkgcore.test.misc import FakePkg, FakeRepo
+from snakeoil.test import TestCase
+
+
+class CountingRepo(FakeRepo):
+
+    def __init__(self, *args, **kwds):
+        FakeRepo.__init__(self, *args, **kwds)
+        self.queries = []
+
+    def itermatch(self, restrict, **kwds):
+        self.queries.append(restrict)
+        return FakeRepo.itermatch(self, restrict, **kwds)
+
+
+class TestCachingRepo(TestCase):
+
+    def setUp(self):
+        self.db = CountingRepo(
+            [FakePkg('dev-util/foo-1'), FakePkg('dev-util/foo-2'),
+             FakePkg('dev-util/bar-1')])
+
+    def test_cache(self):
+        repo = caching_repo(self.db, sorted)
+        foo = atom('dev-util/foo')
+        self.assertEqual(
+            [x.cpvstr for x in repo.match(foo)], ['dev-util/foo-1', 'dev-util/foo-2'])
+        self.assertIdentical(repo.match(foo), repo.match(foo))
+        self.assertEqual(len(list(repo.itermatch(foo))), 2)
+        self.assertEqual(self.db.queries, [foo])
+        self.assertEqual(repo.cache_stats(), {
+            'hits': 3, 'misses': 1, 'negative_hits': 0, 'evictions': 0,
+            'entries': 1, 'negative_entries': 0})
+
+    def test_negative(self):
+        repo = caching_repo(self.db, sorted, max_entries=1)
+        missing = atom('dev-util/missing')
+        self.assertFalse(repo.match(missing))
+        self.assertFalse(list(repo.itermatch(missing)))
+        self.assertEqual(self.db.queries, [missing])
+        self.assertEqual(repo.negative_entries, set([missing]))
+        stats = repo.cache_stats()
+        self.assertEqual((stats['negative_hits'], stats['entries']), (1, 0))
+
+        repo.clear(negative=False)
+        self.assertFalse(repo.match(missing))
+        self.assertEqual(len(self.db.queries), 1)
+        repo.clear()
+        self.assertFalse(repo.match(missing))
+        self.assertEqual(len(self.db.queries), 2)
+
+    def test_max_entries(self):
+        repo = caching_repo(self.db, sorted, max_entries=2)
+        foo, bar = atom('dev-util/foo'), atom('dev-util/bar')
+        foo1 = atom('=dev-util/foo-1')
+        repo.match(foo)
+        repo.match(bar)
+        # refresh foo, making bar the least recently used entry
+        repo.match(foo)
+        repo.match(foo1)
+        self.assertEqual(repo.cache_stats()['evictions'], 1)
+        del self.db.queries[:]
+        repo.match(foo)
+        self.assertEqual(self.db.queries, [])
+        repo.match(bar)
+        self.assertEqual(self.db.queries, [bar])
+        self.assertEqual(repo.cache_stats()['entries'], 2)
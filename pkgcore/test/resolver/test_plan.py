@@ -2,10 +2,14 @@
 # License: GPL2/BSD
 
 from snakeoil.currying import post_curry
+from snakeoil.osutils import pjoin
 from snakeoil.test import TestCase
+from snakeoil.test.mixins import TempDirMixin
 
+from pkgcore.ebuild.atom import atom
 from pkgcore.resolver import plan
-from pkgcore.test.misc import FakePkg
+from pkgcore.restrictions import packages, values
+from pkgcore.test.misc import FakePkg, FakeRepo
 
 
 class TestPkgSorting(TestCase):
@@ -30,3 +34,33 @@ class TestPkgSorting(TestCase):
 
     test_pkg_sort_lowest = post_curry(check_it, plan.pkg_sort_lowest,
         [11,9,1,6], [1,6,9,11])
+
+
+class TestQueryCache(TempDirMixin):
+
+    def mk_plan(self):
+        db = FakeRepo([FakePkg('dev-util/foo-1')], livefs=False)
+        return plan.merge_plan(
+            [db], plan.pkg_sort_highest,
+            plan.merge_plan.prefer_highest_version_strategy)
+
+    def test_persistence(self):
+        path = pjoin(self.dir, 'cache', 'resolver')
+        resolver = self.mk_plan()
+        self.assertEqual(resolver.load_query_cache(path, 'a'), 0)
+        missing = atom('dev-util/missing')
+        self.assertFalse(resolver.all_raw_dbs[0].match(missing))
+        self.assertTrue(resolver.all_raw_dbs[0].match(atom('dev-util/foo')))
+        self.assertFalse(resolver.all_raw_dbs[0].match(
+            packages.PackageRestriction('package', values.StrExactMatch('bar'))))
+        resolver.save_query_cache(path, 'a')
+
+        # only atoms are stored
+        resolver = self.mk_plan()
+        self.assertEqual(resolver.load_query_cache(path, 'a'), 1)
+        self.assertEqual(resolver.all_raw_dbs[0].negative_entries, set([missing]))
+        self.assertFalse(resolver.all_raw_dbs[0].match(missing))
+        self.assertEqual(resolver.cache_stats()['negative_hits'], 1)
+
+        # changed fingerprints invalidate the cache
+        self.assertEqual(self.mk_plan().load_query_cache(path, 'b'), 0)
@@ -0,0 +1,80 @@
+# License: GPL2/BSD
+
+import json
+from StringIO import StringIO
+
+from snakeoil.test import TestCase
+
+from pkgcore.resolver.profiler import resolver_profiler
+
+
+class FakeState(object):
+
+    def __init__(self):
+        self.plan = []
+
+    def backtrack(self, state_pos):
+        del self.plan[state_pos:]
+
+
+class FakeResolver(object):
+
+    def __init__(self, deps):
+        self.deps = deps
+        self.state = FakeState()
+        self.all_raw_dbs = []
+
+    def _rec_add_atom(self, atom, stack, dbs):
+        self._viable(atom)
+        self.insert_choice(atom)
+        for dep in self.deps.get(atom, ()):
+            if self._rec_add_atom(dep, stack, dbs):
+                self.state.backtrack(0)
+                return [atom]
+        self.check_for_cycles(atom)
+        return atom == 'broken'
+
+    def _viable(self, atom):
+        pass
+
+    def insert_choice(self, atom):
+        self.state.plan.append(atom)
+
+    def check_for_cycles(self, atom):
+        pass
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        self.resolver = FakeResolver({'a': ('b', 'c'), 'c': ('b', 'broken')})
+        self.profiler = resolver_profiler()
+        self.profiler.attach(self.resolver)
+        self.resolver._rec_add_atom('a', [], None)
+
+    def test_stats(self):
+        p = self.profiler
+        self.assertEqual(p.calls['_rec_add_atom'][0], 5)
+        self.assertEqual(p.calls['_viable'][0], 5)
+        self.assertEqual(p.calls['insert_choice'][0], 5)
+        # b twice, broken
+        self.assertEqual(p.calls['check_for_cycles'][0], 3)
+        # c reverts the whole plan, leaving nothing for a to revert
+        self.assertEqual((p.backtracks, p.reverted), (1, 5))
+        atoms = {x[0]: x[1:3] for x in p.atom_stats()}
+        self.assertEqual(
+            atoms, {'a': (1, 1), 'b': (2, 0), 'c': (1, 1), 'broken': (1, 1)})
+
+        data = json.loads(json.dumps(p.to_dict()))
+        self.assertEqual(data['backtracks'], {'count': 1, 'reverted': 5})
+        self.assertEqual(sorted(x['atom'] for x in data['atoms']),
+                         ['a', 'b', 'broken', 'c'])
+
+    def test_flamegraph(self):
+        f = StringIO()
+        self.profiler.write_flamegraph(f)
+        stacks = [line.rsplit(' ', 1) for line in f.getvalue().splitlines()]
+        self.assertEqual(
+            [x[0] for x in stacks], ['a', 'a;b', 'a;c', 'a;c;b', 'a;c;broken'])
+        for _, usecs in stacks:
+            self.assertTrue(int(usecs) >= 0)
@@ -0,0 +1,184 @@
+# License: GPL2/BSD
+
+import threading
+import time
+
+from snakeoil.test import TestCase
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.resolver.scheduler import build_barriers, JobScheduler
+from pkgcore.test.misc import FakePkg
+
+
+class fake_choices(object):
+
+    def __init__(self, depends=(), rdepends=()):
+        self.depends = [[atom(x)] for x in depends]
+        self.rdepends = [[atom(x)] for x in rdepends]
+
+
+class fake_op(object):
+
+    def __init__(self, cpv, desc='add', **kwds):
+        self.desc = desc
+        self.pkg = FakePkg(cpv)
+        self.choices = fake_choices(**kwds)
+
+
+class TestBuildBarriers(TestCase):
+
+    def test_barriers(self):
+        ops = [
+            fake_op('dev-libs/a-1'),
+            fake_op('dev-libs/b-1', rdepends=['dev-libs/a']),
+            fake_op('dev-libs/c-1'),
+            fake_op('dev-libs/old-1', desc='remove'),
+            # build dep on b, which requires a at runtime
+            fake_op('app-misc/d-1', depends=['dev-libs/b', '!dev-libs/c']),
+            fake_op('app-misc/e-1', depends=['dev-libs/c', 'dev-libs/old']),
+            fake_op('app-misc/f-1', rdepends=['app-misc/e']),
+        ]
+        self.assertEqual(build_barriers(ops), [-1, -1, -1, -1, 1, 2, -1])
+
+    def test_runtime_closure(self):
+        ops = [
+            fake_op('dev-libs/a-1'),
+            fake_op('dev-libs/b-1', rdepends=['dev-libs/c']),
+            fake_op('dev-libs/c-1', rdepends=['dev-libs/a']),
+            fake_op('app-misc/d-1', depends=['dev-libs/b']),
+        ]
+        self.assertEqual(build_barriers(ops), [-1, -1, -1, 2])
+
+    def test_unknown_deps(self):
+        op = fake_op('app-misc/d-1')
+        op.choices.depends = None
+        self.assertEqual(
+            build_barriers([fake_op('dev-libs/a-1'), op]), [-1, 0])
+
+
+class TestJobScheduler(TestCase):
+
+    def test_run(self):
+        lock = threading.Lock()
+        events = []
+        # job 2 has to wait for job 0 to be merged
+        barriers = [-1, -1, 0, -1]
+        release = threading.Event()
+
+        def build(idx):
+            with lock:
+                events.append(('build', idx))
+            if idx == 0:
+                # hold up merging until the other buildable jobs started
+                release.wait()
+            return idx * 2
+
+        def merge(idx, result):
+            with lock:
+                events.append(('merge', idx, result))
+
+        sched = JobScheduler(3)
+        t = threading.Thread(target=lambda: sched.run(4, barriers, build, merge))
+        t.start()
+        try:
+            while True:
+                with lock:
+                    if len(events) == 3:
+                        break
+                time.sleep(0.01)
+        finally:
+            release.set()
+        t.join()
+        self.assertEqual(
+            sorted(events[:3]), [('build', 0), ('build', 1), ('build', 3)])
+        self.assertEqual(
+            [x for x in events if x[0] == 'merge'],
+            [('merge', 0, 0), ('merge', 1, 2), ('merge', 2, 4), ('merge', 3, 6)])
+        self.assertTrue(events.index(('build', 2)) > events.index(('merge', 0, 0)))
+
+    def test_jobs_limit(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def build(idx):
+            with lock:
+                running.append(idx)
+                peak.append(len(running))
+            with lock:
+                running.remove(idx)
+
+        sched = JobScheduler(2)
+        self.assertTrue(sched.run(10, [-1] * 10, build, lambda idx, result: None))
+        self.assertTrue(max(peak) <= 2)
+
+    def test_abort(self):
+        merged = []
+        discarded = []
+
+        def merge(idx, result):
+            merged.append(idx)
+            return idx != 1
+
+        sched = JobScheduler(1)
+        self.assertFalse(sched.run(
+            4, [-1, 0, 1, 2], lambda idx: idx, merge,
+            discard=lambda idx, result: discarded.append(idx)))
+        self.assertEqual(merged, [0, 1])
+        self.assertEqual(discarded, [])
+
+    def test_exceptions(self):
+        class fail(Exception):
+            pass
+
+        def build(idx):
+            if idx == 1:
+                raise fail()
+            return idx
+
+        discarded = []
+        sched = JobScheduler(4)
+        self.assertRaises(
+            fail, sched.run, 3, [-1, -1, -1], build, lambda idx, result: None,
+            discard=lambda idx, result: discarded.append(idx))
+        self.assertEqual(discarded, [2])
+
+    def test_interrupt(self):
+        release = threading.Event()
+
+        def build(idx):
+            if idx:
+                release.wait()
+            return idx
+
+        def merge(idx, result):
+            raise KeyboardInterrupt()
+
+        sched = JobScheduler(2)
+        start = time.time()
+        try:
+            # running builds aren't waited on
+            self.assertRaises(
+                KeyboardInterrupt, sched.run, 2, [-1, -1], build, merge)
+            self.assertTrue(time.time() - start < 5)
+            self.assertFalse(release.is_set())
+        finally:
+            release.set()
+
+    def test_load_average(self):
+        sched = JobScheduler(4, load_average=0)
+        sched._overloaded = lambda: True
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def build(idx):
+            with lock:
+                running.append(idx)
+                peak.append(len(running))
+            with lock:
+                running.remove(idx)
+
+        self.assertTrue(sched.run(5, [-1] * 5, build, lambda idx, result: None))
+        # only one build at a time is allowed while overloaded
+        self.assertEqual(max(peak), 1)
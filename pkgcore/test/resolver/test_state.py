@@ -0,0 +1,42 @@
+# License: GPL2/BSD
+
+from snakeoil.test import TestCase
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.resolver import state
+from pkgcore.restrictions import packages
+from pkgcore.test.misc import FakePkg
+
+
+class TestLearnedConflicts(TestCase):
+
+    def test_check(self):
+        plan = state.plan_state()
+        conflicts = state.learned_conflicts()
+        foo, bar = FakePkg('dev-util/foo-1'), FakePkg('dev-util/foo-2')
+        blocker = atom('!dev-util/foo')
+        a = atom('dev-util/foo')
+
+        state.add_op(None, foo).apply(plan)
+        self.assertEqual(state.add_op(None, bar).apply(plan), [foo])
+        conflicts.add(a, bar, [foo])
+        self.assertEqual(len(conflicts), 1)
+        # conflicts only apply to the atom and pkg they were found for
+        self.assertEqual(conflicts.check(plan, a, foo), None)
+        self.assertEqual(conflicts.check(plan, atom('=dev-util/foo-2'), bar), None)
+        self.assertEqual(conflicts.check(plan, a, bar), (foo,))
+        self.assertEqual(conflicts.pruned, 1)
+
+        # and only while the conflicting entries remain in the plan
+        plan.backtrack(0)
+        self.assertEqual(conflicts.check(plan, a, bar), None)
+        plan.add_blocker(None, blocker)
+        conflicts.add(a, bar, [blocker])
+        self.assertEqual(conflicts.check(plan, a, bar), (blocker,))
+        self.assertEqual(conflicts.pruned, 2)
+
+        # unkeyed blockers aren't recorded
+        conflicts.add(a, foo, [packages.AndRestriction(blocker)])
+        self.assertEqual(len(conflicts), 2)
+        conflicts.clear()
+        self.assertEqual(conflicts.check(plan, a, bar), None)
@@ -212,3 +212,53 @@ class JustOneRestrictionTest(base, TestCase):
                 true, false, true, node_type='foo').match(None))
         self.assertFalse(self.kls(
                 true, true, true, node_type='foo').match(None))
+
+
+class OptimizeTest(TestCase):
+
+    def test_cost(self):
+        from pkgcore.restrictions import packages, values
+        cat = packages.PackageRestriction('category', values.StrExactMatch('foo'))
+        eapi = packages.PackageRestriction('eapi', values.StrExactMatch('5'))
+        maint = packages.PackageRestriction(
+            'maintainers', values.ContainmentMatch('foo'))
+        self.assertEqual(boolean.restriction_cost(packages.AlwaysTrue), 0)
+        self.assertTrue(
+            boolean.restriction_cost(cat) <
+            boolean.restriction_cost(eapi) <
+            boolean.restriction_cost(maint))
+        self.assertEqual(
+            boolean.restriction_cost(packages.AndRestriction(cat, eapi)),
+            boolean.restriction_cost(cat) + boolean.restriction_cost(eapi))
+
+    def test_optimize(self):
+        from pkgcore.ebuild.atom import atom
+        from pkgcore.restrictions import packages, values
+        cat = packages.PackageRestriction('category', values.StrExactMatch('foo'))
+        pkg = packages.PackageRestriction('package', values.StrExactMatch('bar'))
+        eapi = packages.PackageRestriction('eapi', values.StrExactMatch('5'))
+        maint = packages.PackageRestriction(
+            'maintainers', values.ContainmentMatch('foo'))
+
+        # already ordered trees are returned as is
+        r = packages.AndRestriction(cat, eapi)
+        self.assertIdentical(boolean.optimize(r), r)
+        self.assertIdentical(boolean.optimize(cat), cat)
+
+        r = packages.AndRestriction(
+            maint, packages.OrRestriction(eapi, pkg), cat, negate=True)
+        o = boolean.optimize(r)
+        self.assertEqual(
+            o, packages.AndRestriction(
+                cat, packages.OrRestriction(pkg, eapi), maint, negate=True))
+        self.assertEqual(o.type, r.type)
+
+        # ties keep their original ordering
+        r = packages.OrRestriction(eapi, pkg, maint, cat)
+        self.assertEqual(
+            list(boolean.optimize(r)), [pkg, cat, eapi, maint])
+
+        # atoms aren't rebuilt
+        a = atom('>=dev-util/foo-1')
+        r = packages.AndRestriction(maint, a)
+        self.assertIdentical(boolean.optimize(r).restrictions[0], a)
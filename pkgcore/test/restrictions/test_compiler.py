@@ -0,0 +1,93 @@
+# License: GPL2/BSD
+
+import types
+
+from snakeoil.test import TestCase
+
+from pkgcore import log
+from pkgcore.ebuild import restricts
+from pkgcore.ebuild.atom import atom
+from pkgcore.restrictions import packages, values
+from pkgcore.restrictions.compiler import compile_match, cost
+from pkgcore.test import malleable_obj, silence_logging
+from pkgcore.test.misc import FakePkg
+
+
+class TestCompileMatch(TestCase):
+
+    pkgs = [
+        FakePkg('dev-util/foo-1', iuse=('bar',)),
+        FakePkg('dev-util/foo-2', iuse=('foo', 'bar')),
+        FakePkg('dev-libs/foo-1', iuse=('foo',)),
+        FakePkg('app-misc/bar-1', iuse=()),
+    ]
+
+    def assertMatches(self, restrict):
+        matcher = compile_match(restrict)
+        self.assertEqual(
+            [matcher(pkg) for pkg in self.pkgs],
+            [restrict.match(pkg) for pkg in self.pkgs],
+            msg="compiled %s doesn't match its uncompiled form" % (restrict,))
+
+    def test_equivalence(self):
+        iuse = packages.PackageRestriction('iuse', values.ContainmentMatch('foo'))
+        cat = restricts.CategoryDep('dev-util')
+        pkg = restricts.PackageDep('foo')
+        glob = packages.PackageRestriction('category', values.StrGlobMatch('dev-'))
+        for restrict in (
+                packages.AlwaysTrue,
+                packages.AlwaysFalse,
+                cat,
+                restricts.CategoryDep('dev-util', negate=True),
+                packages.PackageRestriction(
+                    'package', values.StrExactMatch('foo', negate=True), negate=True),
+                packages.AndRestriction(iuse, cat),
+                packages.AndRestriction(iuse, cat, negate=True),
+                packages.OrRestriction(iuse, cat),
+                packages.OrRestriction(iuse, cat, negate=True),
+                packages.AndRestriction(
+                    packages.OrRestriction(cat, glob),
+                    packages.AndRestriction(pkg, iuse)),
+                packages.OrRestriction(
+                    packages.AndRestriction(cat, iuse),
+                    packages.OrRestriction(restricts.PackageDep('bar'))),
+                packages.AndRestriction(atom('>=dev-util/foo-2'), iuse),
+                packages.AndRestriction(),
+                packages.OrRestriction(),
+                ):
+            self.assertMatches(restrict)
+
+        # package restrictions are specialized, whether native or not
+        self.assertIsInstance(compile_match(cat), types.FunctionType)
+        self.assertIsInstance(compile_match(iuse), types.FunctionType)
+
+    def test_ordering(self):
+        seen = []
+
+        class tracking(values.base):
+            __slots__ = ('name',)
+
+            def __init__(self, name):
+                object.__setattr__(self, 'name', name)
+
+            def match(self, val):
+                seen.append(self.name)
+                return False
+
+        restrict = packages.AndRestriction(
+            packages.PackageRestriction('description', tracking('description')),
+            packages.PackageRestriction('category', tracking('category')))
+        self.assertTrue(cost(restrict.restrictions[0]) > cost(restrict.restrictions[1]))
+        self.assertFalse(compile_match(restrict)(self.pkgs[0]))
+        # the expensive metadata attr isn't even pulled
+        self.assertEqual(seen, ['category'])
+
+    @silence_logging(log.logging.root)
+    def test_missing_attrs(self):
+        pkg = malleable_obj(category='dev-util')
+        for negate in (False, True):
+            restrict = packages.AndRestriction(
+                restricts.CategoryDep('dev-util'),
+                packages.PackageRestriction(
+                    'missing', values.StrExactMatch('foo'), negate=negate))
+            self.assertEqual(compile_match(restrict)(pkg), restrict.match(pkg))
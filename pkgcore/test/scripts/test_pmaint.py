@@ -235,3 +235,19 @@ class TestRegen(TestCase, ArgParseMixin):
         self.assertEqual(
             [options.repos[0].__class__, options.threads],
             [TestSimpleTree, 2])
+
+        options = self.parse(
+            'spork', '--processes', '4', spork=basics.HardCodedConfigSection(
+                {'class': fake_repo}))
+        self.assertEqual(options.processes, 4)
+
+        options = self.parse(
+            'spork', '--ebd-pool-size', '2', '--ebd-max-uses', '0',
+            spork=basics.HardCodedConfigSection({'class': fake_repo}))
+        self.assertEqual(
+            [options.ebd_pool_size, options.ebd_max_uses, options.ebd_min_warm],
+            [2, 0, None])
+        self.assertError(
+            "--ebd-min-warm must be a non-negative integer: -1",
+            'spork', '--ebd-min-warm', '-1', spork=basics.HardCodedConfigSection(
+                {'class': fake_repo}))
@@ -1,6 +1,11 @@
 # Copyright: 2006 Marien Zwart <marienz@gentoo.org>
 # License: BSD/GPL2
 
+import os
+
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
 from pkgcore.config import basics
 from pkgcore.ebuild import formatter
 from pkgcore.repository import util
@@ -68,3 +73,61 @@ class TargetParsingTest(TestCase):
         self.assertEqual(len(a), 1)
         self.assertEqual(a[0].key, 'foo/bar')
         self.assertTrue(isinstance(a[0].key, str))
+
+
+class fake_repo(object):
+
+    def __init__(self, location):
+        self.location = location
+
+
+class fake_domain(object):
+
+    def __init__(self, config_dir, **settings):
+        self.config_dir = config_dir
+        self.settings = settings
+        self.profile = None
+
+
+class ResolverCacheFingerprintTest(TempDirMixin, TestCase):
+
+    def fingerprint(self, **settings):
+        settings.setdefault('USE', set(['foo', 'bar']))
+        settings.setdefault('ACCEPT_KEYWORDS', set(['amd64']))
+        domain = fake_domain(pjoin(self.dir, 'etc'), **settings)
+        return pmerge._resolver_cache_fingerprint(
+            domain, [fake_repo(pjoin(self.dir, 'repo'))])
+
+    def test_fingerprint(self):
+        pkg = pjoin(self.dir, 'repo', 'cat', 'pkg')
+        ensure_dirs(pkg)
+        ensure_dirs(pjoin(self.dir, 'etc'))
+        orig = self.fingerprint()
+        self.assertEqual(orig, self.fingerprint(USE=set(['bar', 'foo'])))
+
+        # effective settings, e.g. USE from the environment
+        self.assertNotEqual(orig, self.fingerprint(USE=set(['foo'])))
+        self.assertNotEqual(orig, self.fingerprint(ACCEPT_LICENSE=('*',)))
+        # unserializable settings are skipped
+        self.assertEqual(orig, self.fingerprint(fetcher=object()))
+
+        # package directories
+        os.utime(pkg, (1, 1))
+        changed = self.fingerprint()
+        self.assertNotEqual(orig, changed)
+        # but not package files
+        with open(pjoin(pkg, 'pkg-1.ebuild'), 'w') as f:
+            f.write('foo')
+        os.utime(pkg, (1, 1))
+        self.assertEqual(changed, self.fingerprint())
+
+        # synced repos are covered by their timestamp
+        timestamp = pjoin(self.dir, 'repo', 'metadata', 'timestamp.chk')
+        ensure_dirs(os.path.dirname(timestamp))
+        with open(timestamp, 'w') as f:
+            f.write('foo')
+        changed = self.fingerprint()
+        os.utime(pkg, (2, 2))
+        self.assertEqual(changed, self.fingerprint())
+        os.utime(timestamp, (2, 2))
+        self.assertNotEqual(changed, self.fingerprint())
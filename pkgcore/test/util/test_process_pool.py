@@ -0,0 +1,59 @@
+# License: GPL2/BSD 3 clause
+
+import os
+import signal
+
+from snakeoil.test import TestCase
+
+from pkgcore.util import process_pool
+
+
+def _square(iterable):
+    for x in iterable:
+        yield x * x
+
+
+def _pids(iterable):
+    for x in iterable:
+        yield os.getpid()
+
+
+def _explode(iterable):
+    for x in iterable:
+        raise ValueError(x)
+    # generator marker
+    yield
+
+
+def _killed(iterable):
+    for x in iterable:
+        if x == 2:
+            os.kill(os.getpid(), signal.SIGKILL)
+        yield x
+
+
+class TestMapAsync(TestCase):
+
+    def test_results(self):
+        self.assertEqual(
+            sorted(process_pool.map_async(range(20), _square, processes=3)),
+            [x * x for x in range(20)])
+
+    def test_forked(self):
+        pids = set(process_pool.map_async(range(10), _pids, processes=2))
+        self.assertTrue(pids)
+        self.assertNotIn(os.getpid(), pids)
+
+    def test_empty(self):
+        self.assertEqual(list(process_pool.map_async([], _square)), [])
+
+    def test_worker_exception(self):
+        self.assertRaises(
+            RuntimeError, list,
+            process_pool.map_async(range(5), _explode, processes=2))
+
+    def test_worker_death(self):
+        # dead workers are noticed instead of waiting on them forever
+        self.assertRaises(
+            RuntimeError, list,
+            process_pool.map_async(range(5), _killed, processes=2))
@@ -0,0 +1,91 @@
+# License: GPL2/BSD
+
+import os
+
+from snakeoil.osutils import pjoin
+from snakeoil.test import TestCase
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.vdb import ondisk
+
+
+class TestIndexedTree(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.vdb = pjoin(self.dir, 'vdb')
+        self.cache = pjoin(self.dir, 'cache')
+        os.mkdir(self.vdb)
+        self.add_pkg('dev-util', 'foo-1', SLOT='0', USE='a b')
+        self.add_pkg('dev-util', 'foo-2', SLOT='2', repository='gentoo')
+        self.add_pkg('sys-apps', 'bar-1.0', SLOT='0')
+        os.mkdir(pjoin(self.vdb, 'dev-util', '-MERGING-foo-3'))
+        self.set_mtime('dev-util', 'sys-apps')
+
+    def add_pkg(self, category, pf, **files):
+        path = pjoin(self.vdb, category, pf)
+        os.makedirs(path)
+        for key, val in files.iteritems():
+            with open(pjoin(path, key), 'w') as f:
+                f.write(val + '\n')
+        open(pjoin(path, 'CONTENTS'), 'w').close()
+        open(pjoin(path, pf + '.ebuild'), 'w').close()
+
+    def set_mtime(self, *categories):
+        # avoid the summary treating freshly modified dirs as racy
+        for category in categories:
+            mtime = os.stat(pjoin(self.vdb, category)).st_mtime - 100
+            os.utime(pjoin(self.vdb, category), (mtime, mtime))
+
+    def get_repo(self, indexed=True):
+        return ondisk.tree(self.vdb, cache_location=self.cache, indexed=indexed)
+
+    def write_slot(self, category, pf, slot):
+        with open(pjoin(self.vdb, category, pf, 'SLOT'), 'w') as f:
+            f.write(slot + '\n')
+
+    def test_summary(self):
+        repo = self.get_repo()
+        self.assertEqual(
+            sorted(pkg.cpvstr for pkg in repo),
+            ['dev-util/foo-1', 'dev-util/foo-2', 'sys-apps/bar-1.0'])
+        self.assertTrue(os.path.exists(pjoin(self.cache, repo.summary_filename)))
+        pkg = repo.match(repo.package_class('dev-util', 'foo', '2').versioned_atom)[0]
+        data = repo._get_metadata(pkg)
+        self.assertEqual(data['SLOT'], '2\n')
+        self.assertEqual(data['repository'], 'gentoo\n')
+        self.assertRaises(KeyError, data.__getitem__, 'USE')
+
+        # file modifications that don't touch the category dir aren't seen,
+        # metadata is pulled from the summary
+        self.write_slot('dev-util', 'foo-2', '3')
+        repo = self.get_repo()
+        self.assertEqual(repo._get_metadata(pkg)['SLOT'], '2\n')
+        self.assertEqual(self.get_repo(False)._get_metadata(pkg)['SLOT'], '3\n')
+
+        # while modified categories get rescanned
+        self.add_pkg('dev-util', 'foo-4', SLOT='4')
+        self.set_mtime('dev-util')
+        repo = self.get_repo()
+        self.assertEqual(
+            sorted(pkg.cpvstr for pkg in repo),
+            ['dev-util/foo-1', 'dev-util/foo-2', 'dev-util/foo-4', 'sys-apps/bar-1.0'])
+        self.assertEqual(repo._get_metadata(pkg)['SLOT'], '3\n')
+
+    def test_notify_pkg_modified(self):
+        repo = self.get_repo()
+        pkg = repo.package_class('sys-apps', 'bar', '1.0')
+        self.assertEqual(repo._get_metadata(pkg)['SLOT'], '0\n')
+        self.write_slot('sys-apps', 'bar-1.0', '1')
+        repo._notify_pkg_modified(pkg)
+        self.assertEqual(repo._get_metadata(pkg)['SLOT'], '1\n')
+        self.assertEqual(self.get_repo()._get_metadata(pkg)['SLOT'], '1\n')
+
+    def test_corrupt_summary(self):
+        os.mkdir(self.cache)
+        with open(pjoin(self.cache, ondisk.tree.summary_filename), 'w') as f:
+            f.write('garbage')
+        repo = self.get_repo()
+        self.assertEqual(len(repo), 3)
+        pkg = repo.package_class('dev-util', 'foo', '1')
+        self.assertEqual(repo._get_metadata(pkg)['USE'], 'a b\n')
@@ -0,0 +1,97 @@
+# License: GPL2/BSD
+
+import os
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from snakeoil.osutils import pjoin
+from snakeoil.test import TestCase
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.vdb import ondisk
+
+
+class TestOwnersIndex(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.vdb = pjoin(self.dir, 'vdb')
+        self.cache = pjoin(self.dir, 'cache')
+        os.mkdir(self.vdb)
+        self.add_pkg('dev-util/foo-1', '/usr', '/usr/bin', '/usr/bin/foo')
+        self.add_pkg('dev-util/bar-1', '/usr', '/usr/bin', '/usr/bin/bar')
+
+    def add_pkg(self, cpvstr, *paths):
+        path = pjoin(self.vdb, cpvstr)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        with open(pjoin(path, 'CONTENTS'), 'w') as f:
+            for x in paths:
+                if x.startswith('/usr/bin/'):
+                    f.write('obj %s d41d8cd98f00b204e9800998ecf8427e 100\n' % x)
+                else:
+                    f.write('dir %s\n' % x)
+
+    def get_repo(self):
+        return ondisk.tree(self.vdb, cache_location=self.cache)
+
+    def test_owners(self):
+        repo = self.get_repo()
+        self.assertEqual(
+            repo.owners(['/usr/bin/foo', '/usr/bin/bar', '/usr/bin', '/nonexistent']),
+            {'/usr/bin/foo': ('dev-util/foo-1',),
+             '/usr/bin/bar': ('dev-util/bar-1',),
+             '/usr/bin': ('dev-util/bar-1', 'dev-util/foo-1')})
+        self.assertTrue(os.path.exists(pjoin(self.cache, repo.owners_filename)))
+
+        # packages modified outside of pkgcore are reindexed
+        self.add_pkg('dev-util/bar-1', '/usr', '/usr/bin', '/usr/bin/baz')
+        self.add_pkg('dev-util/foo-2', '/usr/bin/foo2')
+        repo = self.get_repo()
+        self.assertEqual(
+            repo.owners(['/usr/bin/bar', '/usr/bin/baz', '/usr/bin/foo2']),
+            {'/usr/bin/baz': ('dev-util/bar-1',),
+             '/usr/bin/foo2': ('dev-util/foo-2',)})
+
+    def test_update(self):
+        repo = self.get_repo()
+        self.assertEqual(repo.owners(['/usr/bin/foo']), {'/usr/bin/foo': ('dev-util/foo-1',)})
+        pkg = repo.package_class('dev-util', 'foo', '1')
+        os.unlink(pjoin(self.vdb, 'dev-util/foo-1/CONTENTS'))
+        os.rmdir(pjoin(self.vdb, 'dev-util/foo-1'))
+        index = pjoin(self.cache, repo.owners_filename)
+        os.utime(index, (1000, 1000))
+        with mock.patch('pkgcore.vdb.owners.atexit') as atexit:
+            repo._notify_pkg_modified(pkg)
+            repo._notify_pkg_modified(pkg)
+        self.assertEqual(repo.owners(['/usr/bin/foo', '/usr']), {'/usr': ('dev-util/bar-1',)})
+        # updates are written once, on exit
+        self.assertEqual(os.stat(index).st_mtime, 1000)
+        self.assertEqual(atexit.register.call_count, 1)
+        self.assertEqual(
+            self.get_repo().owners(['/usr/bin/foo', '/usr']), {'/usr': ('dev-util/bar-1',)})
+        repo._owners.flush()
+        self.assertNotEqual(os.stat(index).st_mtime, 1000)
+        self.assertEqual(
+            self.get_repo().owners(['/usr/bin/foo', '/usr']), {'/usr': ('dev-util/bar-1',)})
+
+        self.add_pkg('dev-util/foo-1', '/usr/bin/foo')
+        repo._notify_pkg_modified(pkg)
+        self.assertEqual(repo.owners(['/usr/bin/foo']), {'/usr/bin/foo': ('dev-util/foo-1',)})
+
+    def test_indexed_only(self):
+        # building the index from scratch is skipped on request
+        repo = self.get_repo()
+        self.assertIdentical(repo.owners(['/usr/bin/foo'], indexed_only=True), None)
+        self.assertIdentical(repo._owners._owners, None)
+        repo.owners(['/usr'])
+        self.assertEqual(
+            repo.owners(['/usr/bin/foo'], indexed_only=True),
+            {'/usr/bin/foo': ('dev-util/foo-1',)})
+        # persisted indexes are used
+        self.assertEqual(
+            self.get_repo().owners(['/usr/bin/foo'], indexed_only=True),
+            {'/usr/bin/foo': ('dev-util/foo-1',)})
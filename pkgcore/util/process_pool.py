@@ -0,0 +1,112 @@
+# License: GPL2/BSD 3 clause
+
+"""
+forked worker process analog of :obj:`pkgcore.util.thread_pool`
+"""
+
+from snakeoil import compatibility
+from snakeoil.demandload import demandload
+
+demandload(
+    'traceback',
+    'multiprocessing',
+    'multiprocessing:cpu_count',
+)
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+# seconds between checks for workers that died without reporting back
+_poll_interval = 1
+
+
+def _iter_queue(q):
+    while True:
+        item = q.get()
+        if item is None:
+            return
+        yield item
+
+
+def _process_worker(functor, args, kwds, work_queue, result_queue):
+    try:
+        for result in functor(_iter_queue(work_queue), *args, **kwds):
+            result_queue.put(('result', result))
+    except compatibility.IGNORED_EXCEPTIONS as e:
+        if not isinstance(e, KeyboardInterrupt):
+            result_queue.put(('error', traceback.format_exc()))
+    except Exception:
+        result_queue.put(('error', traceback.format_exc()))
+    result_queue.put(('done', None))
+
+
+def map_async(iterable, functor, *args, **kwds):
+    """Feed an iterable to forked worker processes, yielding their results.
+
+    Each worker calls ``functor`` with an iterator of work items (plus any
+    extra args and kwds); ``functor`` must be a generator and everything it
+    yields is passed back to the parent and yielded here in completion order.
+    Work items and results are pickled, so keep them simple.
+
+    Since workers are forked, any state they require (repositories, observers,
+    etc) is inherited from the parent at the time of the call.
+
+    :param processes: number of worker processes, defaults to the cpu count
+    """
+    parallelism = kwds.pop("processes", None)
+    if parallelism is None:
+        parallelism = cpu_count()
+
+    if hasattr(iterable, '__len__'):
+        # if there are less items than parallelism, don't
+        # spawn pointless processes.
+        parallelism = max(min(len(iterable), parallelism), 0)
+
+    work_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+
+    procs = []
+    finished = False
+    for x in xrange(parallelism):
+        procs.append(multiprocessing.Process(
+            target=_process_worker,
+            args=(functor, args, kwds, work_queue, result_queue)))
+
+    try:
+        for x in procs:
+            x.start()
+        # the work queue is unbounded with puts handled by a feeder thread,
+        # so queue everything up front then consume the results.
+        for data in iterable:
+            work_queue.put(data)
+        for x in procs:
+            work_queue.put(None)
+
+        running = len(procs)
+        while running:
+            try:
+                status, data = result_queue.get(timeout=_poll_interval)
+            except Empty:
+                # workers always report back unless killed, e.g. by a
+                # segfault or the OOM killer; don't wait on them forever
+                for x in procs:
+                    if x.exitcode not in (None, 0):
+                        raise RuntimeError(
+                            "worker process %i died with exit code %i" %
+                            (x.pid, x.exitcode))
+                continue
+            if status == 'result':
+                yield data
+            elif status == 'done':
+                running -= 1
+            else:
+                raise RuntimeError(
+                    "exception occurred in worker process:\n%s" % (data,))
+        finished = True
+    finally:
+        for x in procs:
+            if not finished and x.is_alive():
+                x.terminate()
+            x.join()
@@ -12,7 +12,7 @@ from snakeoil import compatibility, data_source, klass
 from snakeoil.demandload import demandload
 from snakeoil.fileutils import readfile
 from snakeoil.mappings import IndeterminantDict
-from snakeoil.osutils import listdir_dirs, pjoin
+from snakeoil.osutils import listdir_dirs, listdir_files, pjoin
 
 from pkgcore.config import ConfigHint
 from pkgcore.ebuild import ebuild_built
@@ -20,13 +20,190 @@ from pkgcore.ebuild.cpv import versioned_CPV
 from pkgcore.ebuild.errors import InvalidCPV
 from pkgcore.repository import errors, multiplex, prototype
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 demandload(
+    'time',
+    'snakeoil.fileutils:AtomicWriteFile',
+    'snakeoil.osutils:ensure_dirs',
     'pkgcore.log:logger',
     'pkgcore.vdb:repo_ops',
+    'pkgcore.vdb.owners:OwnersIndex',
     'pkgcore.vdb.contents:ContentsFile',
 )
 
 
+def _is_pkg_dir(name):
+    """Filter out in progress merges and other non package vdb entries."""
+    return not (name.startswith(".") or name.endswith(".lockfile") or
+                name.startswith("-MERGING-"))
+
+
+class _SummaryIndex(object):
+    """Persistent summary of the small per package vdb files.
+
+    Entries are grouped by category and tagged with the category directory's
+    mtime; merges and unmerges (ours via renames of temp dirs, portage's via
+    -MERGING- dirs) touch it, so a changed mtime means that category has to
+    be rescanned.  Files that are large or parsed separately (CONTENTS,
+    environment, the ebuild) aren't stored.
+    """
+
+    version = 1
+    max_file_size = 64 * 1024
+    skip_files = frozenset(["CONTENTS", "environment", "environment.bz2"])
+
+    def __init__(self, location, path):
+        self.location = location
+        self.path = path
+        self._categories = None
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("failed reading vdb summary %r: %s", self.path, e)
+            return {}
+        except compatibility.IGNORED_EXCEPTIONS:
+            raise
+        except Exception as e:
+            logger.warning("ignoring corrupt vdb summary %r: %s", self.path, e)
+            return {}
+        if not isinstance(data, dict) or data.get('version') != self.version \
+                or data.get('location') != self.location:
+            return {}
+        return data['categories']
+
+    def _write(self):
+        data = {
+            'version': self.version,
+            'location': self.location,
+            'categories': self._categories,
+        }
+        handler = None
+        try:
+            try:
+                if not ensure_dirs(os.path.dirname(self.path), mode=0755):
+                    raise EnvironmentError(
+                        errno.EACCES, "failed creating directory", os.path.dirname(self.path))
+                handler = AtomicWriteFile(self.path, binary=True)
+                pickle.dump(data, handler, pickle.HIGHEST_PROTOCOL)
+                handler.close()
+            except EnvironmentError as e:
+                # unprivileged users just don't get the persistent summary
+                logger.debug("failed writing vdb summary %r: %s", self.path, e)
+        finally:
+            if handler is not None:
+                handler.discard()
+
+    def _scan_pkg(self, path):
+        entry = {}
+        for filename in listdir_files(path):
+            if filename in self.skip_files or filename.endswith(".ebuild"):
+                continue
+            fp = pjoin(path, filename)
+            try:
+                with open(fp) as f:
+                    if os.fstat(f.fileno()).st_size > self.max_file_size:
+                        # read on demand
+                        entry[filename] = None
+                    else:
+                        entry[filename] = f.read()
+            except EnvironmentError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return entry
+
+    def _scan_category(self, category):
+        """Return a (mtime, packages) tuple for a category, None if it's gone."""
+        cpath = pjoin(self.location, category)
+        try:
+            # stat prior to scanning; changes during the scan are caught
+            # by the next mtime check
+            mtime = os.stat(cpath).st_mtime
+            pkgs = {}
+            for pf in listdir_dirs(cpath):
+                if not _is_pkg_dir(pf):
+                    continue
+                try:
+                    pkgs[pf] = self._scan_pkg(pjoin(cpath, pf))
+                except EnvironmentError as e:
+                    # unmerged in the midst of scanning
+                    if e.errno != errno.ENOENT:
+                        raise
+        except EnvironmentError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            return None
+        if abs(time.time() - mtime) < 2:
+            # racy; the dir may change again without its mtime changing
+            # due to timestamp granularity, so force a rescan next time
+            mtime = None
+        return mtime, pkgs
+
+    def _load(self):
+        categories = self._read()
+        try:
+            current = [x for x in listdir_dirs(self.location) if not x.startswith('.')]
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            current = []
+        changed = len(categories) != len(current)
+        valid = {}
+        for category in current:
+            data = categories.get(category)
+            if data is not None and data[0] is not None:
+                try:
+                    if os.stat(pjoin(self.location, category)).st_mtime == data[0]:
+                        valid[category] = data
+                        continue
+                except EnvironmentError as e:
+                    if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                        raise
+                    changed = True
+                    continue
+            data = self._scan_category(category)
+            if data is not None:
+                valid[category] = data
+            changed = True
+        self._categories = valid
+        if changed:
+            self._write()
+
+    def __getitem__(self, category):
+        """Return the package entries for a category."""
+        if self._categories is None:
+            self._load()
+        return self._categories[category][1]
+
+    def get(self, category, pf):
+        """Return the summary for a package, None if it isn't available."""
+        if self._categories is None:
+            self._load()
+        data = self._categories.get(category)
+        if data is None:
+            return None
+        return data[1].get(pf)
+
+    def update(self, category):
+        """Rescan a category after its packages were modified."""
+        if self._categories is None:
+            self._load()
+            return
+        data = self._scan_category(category)
+        if data is None:
+            self._categories.pop(category, None)
+        else:
+            self._categories[category] = data
+        self._write()
+
+
 class tree(prototype.tree):
     livefs = True
     configured = False
@@ -38,11 +215,18 @@ class tree(prototype.tree):
     pkgcore_config_type = ConfigHint(
         {'location': 'str',
          'cache_location': 'str', 'repo_id': 'str',
-         'disable_cache': 'bool'},
+         'disable_cache': 'bool', 'indexed': 'bool'},
         typename='repo')
 
+    summary_filename = "vdb-summary"
+    owners_filename = "vdb-owners"
+
     def __init__(self, location, cache_location=None, repo_id='vdb',
-                 disable_cache=False):
+                 disable_cache=False, indexed=False):
+        """
+        :param indexed: load package metadata from a consolidated summary
+            stored in the cache location instead of the individual vdb files
+        """
         prototype.tree.__init__(self, frozen=False)
         self.repo_id = repo_id
         self.location = location
@@ -51,6 +235,14 @@ class tree(prototype.tree):
         elif cache_location is None:
             cache_location = pjoin("/var/cache/edb/dep", location.lstrip("/"))
         self.cache_location = cache_location
+        self._index = None
+        if indexed and cache_location is not None:
+            self._index = _SummaryIndex(
+                location, pjoin(cache_location, self.summary_filename))
+        owners_path = None
+        if cache_location is not None:
+            owners_path = pjoin(cache_location, self.owners_filename)
+        self._owners = OwnersIndex(self, owners_path)
         self._versions_tmp_cache = {}
         try:
             st = os.stat(self.location)
@@ -88,7 +280,14 @@ class tree(prototype.tree):
         d = {}
         bad = False
         try:
-            for x in listdir_dirs(cpath):
+            if self._index is not None:
+                try:
+                    pkg_dirs = self._index[category]
+                except KeyError:
+                    raise EnvironmentError(errno.ENOENT, "no such category", cpath)
+            else:
+                pkg_dirs = listdir_dirs(cpath)
+            for x in pkg_dirs:
                 if x.startswith(".tmp.") or x.endswith(".lockfile") \
                         or x.startswith("-MERGING-"):
                     continue
@@ -146,12 +345,26 @@ class tree(prototype.tree):
     }
 
     def _get_metadata(self, pkg):
+        pf = "%s-%s" % (pkg.package, pkg.fullver)
+        summary = None
+        if self._index is not None:
+            summary = self._index.get(pkg.category, pf)
         return IndeterminantDict(
-            partial(self._internal_load_key, pjoin(
-                self.location, pkg.category,
-                "%s-%s" % (pkg.package, pkg.fullver))))
+            partial(self._internal_load_key,
+                    pjoin(self.location, pkg.category, pf), summary=summary))
+
+    @staticmethod
+    def _read_key(path, key, summary):
+        if summary is not None:
+            try:
+                data = summary[key]
+            except KeyError:
+                return None
+            if data is not None:
+                return data
+        return readfile(pjoin(path, key), True)
 
-    def _internal_load_key(self, path, key):
+    def _internal_load_key(self, path, key, summary=None):
         key = self._metadata_rewrites.get(key, key)
         if key == "contents":
             data = ContentsFile(pjoin(path, "CONTENTS"), mutable=True)
@@ -169,17 +382,33 @@ class tree(prototype.tree):
             data = data_source.local_source(fp)
         elif key == 'repo':
             # try both, for portage/paludis compatibility.
-            data = readfile(pjoin(path, 'repository'), True)
+            data = self._read_key(path, 'repository', summary)
             if data is None:
-                data = readfile(pjoin(path, 'REPOSITORY'), True)
+                data = self._read_key(path, 'REPOSITORY', summary)
                 if data is None:
                     raise KeyError(key)
         else:
-            data = readfile(pjoin(path, key), True)
+            data = self._read_key(path, key, summary)
             if data is None:
                 raise KeyError((path, key))
         return data
 
+    def owners(self, paths, indexed_only=False):
+        """Find the installed packages owning the given paths.
+
+        :param paths: iterable of absolute paths
+        :param indexed_only: if True, return None if the reverse index
+            would have to be built from scratch
+        :return: mapping of owned paths to tuples of owning cpv strings
+        """
+        return self._owners.owners(paths, indexed_only=indexed_only)
+
+    def _notify_pkg_modified(self, pkg):
+        """Keep the vdb indexes coherent after merging or unmerging a package."""
+        if self._index is not None:
+            self._index.update(pkg.category)
+        self._owners.update(pkg.cpvstr)
+
     def notify_remove_package(self, pkg):
         remove_it = len(self.packages[pkg.category]) == 1
         prototype.tree.notify_remove_package(self, pkg)
@@ -0,0 +1,205 @@
+# License: GPL2/BSD
+
+"""
+persistent reverse index mapping installed paths to their owning packages
+"""
+
+__all__ = ("OwnersIndex",)
+
+import atexit
+import errno
+import os
+
+from snakeoil import compatibility
+from snakeoil.demandload import demandload
+from snakeoil.osutils import pjoin
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+demandload(
+    'snakeoil.fileutils:AtomicWriteFile',
+    'snakeoil.osutils:ensure_dirs',
+    'pkgcore.log:logger',
+    'pkgcore.vdb.contents:ContentsFile',
+)
+
+
+class OwnersIndex(object):
+    """Reverse index of the CONTENTS of all packages in a vdb.
+
+    Each package's entry is tagged with the stat info of its CONTENTS file;
+    when loading, packages with modified CONTENTS files (or ones merged or
+    unmerged behind our back) are reindexed while the rest of the index is
+    reused as is.  Updates for merged or unmerged packages are written back
+    on exit.
+    """
+
+    version = 1
+
+    def __init__(self, repo, path=None):
+        """
+        :param repo: :obj:`pkgcore.vdb.ondisk.tree` instance to index
+        :param path: file the index is stored in, if None it's only kept
+            in memory
+        """
+        self.repo = repo
+        self.path = path
+        self._pkgs = None
+        self._owners = None
+        self._dirty = False
+        self._registered = False
+
+    def _read(self):
+        if self.path is None:
+            return {}, {}
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("failed reading vdb owners index %r: %s", self.path, e)
+            return {}, {}
+        except compatibility.IGNORED_EXCEPTIONS:
+            raise
+        except Exception as e:
+            logger.warning("ignoring corrupt vdb owners index %r: %s", self.path, e)
+            return {}, {}
+        if not isinstance(data, dict) or data.get('version') != self.version \
+                or data.get('location') != self.repo.location:
+            return {}, {}
+        return data['pkgs'], data['owners']
+
+    def flush(self):
+        """Write the index if it was modified."""
+        if not self._dirty or self.path is None:
+            return
+        data = {
+            'version': self.version,
+            'location': self.repo.location,
+            'pkgs': self._pkgs,
+            'owners': self._owners,
+        }
+        handler = None
+        try:
+            try:
+                if not ensure_dirs(os.path.dirname(self.path), mode=0755):
+                    raise EnvironmentError(
+                        errno.EACCES, "failed creating directory", os.path.dirname(self.path))
+                handler = AtomicWriteFile(self.path, binary=True)
+                pickle.dump(data, handler, pickle.HIGHEST_PROTOCOL)
+                handler.close()
+                self._dirty = False
+            except EnvironmentError as e:
+                # unprivileged users just don't get the persistent index
+                logger.debug("failed writing vdb owners index %r: %s", self.path, e)
+        finally:
+            if handler is not None:
+                handler.discard()
+
+    def _contents_path(self, cpvstr):
+        return pjoin(self.repo.location, cpvstr, 'CONTENTS')
+
+    def _stamp(self, cpvstr):
+        """Return the identifying stat info of a package's CONTENTS file."""
+        try:
+            st = os.stat(self._contents_path(cpvstr))
+        except EnvironmentError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            return None
+        return st.st_ino, st.st_size, st.st_mtime
+
+    def _add(self, cpvstr, stamp):
+        paths = ()
+        if stamp is not None:
+            try:
+                paths = tuple(frozenset(
+                    obj.location for obj in ContentsFile(self._contents_path(cpvstr))))
+            except EnvironmentError as e:
+                # unmerged in the midst of indexing
+                if e.errno != errno.ENOENT:
+                    raise
+        self._pkgs[cpvstr] = (stamp, paths)
+        owners = self._owners
+        for path in paths:
+            l = owners.get(path)
+            if l is None:
+                owners[path] = [cpvstr]
+            else:
+                l.append(cpvstr)
+
+    def _remove(self, cpvstr):
+        _stamp, paths = self._pkgs.pop(cpvstr)
+        owners = self._owners
+        for path in paths:
+            l = owners.get(path)
+            if l is not None and cpvstr in l:
+                l.remove(cpvstr)
+                if not l:
+                    del owners[path]
+
+    def _sync(self, cpvstr):
+        """Reindex a package if needed, returning True if anything changed."""
+        stamp = self._stamp(cpvstr)
+        entry = self._pkgs.get(cpvstr)
+        if entry is not None:
+            if entry[0] == stamp:
+                return False
+            self._remove(cpvstr)
+        self._add(cpvstr, stamp)
+        return True
+
+    def _load(self):
+        self._pkgs, self._owners = self._read()
+        installed = frozenset(pkg.cpvstr for pkg in self.repo)
+        changed = False
+        for cpvstr in frozenset(self._pkgs).difference(installed):
+            self._remove(cpvstr)
+            changed = True
+        for cpvstr in installed:
+            changed = self._sync(cpvstr) or changed
+        if changed:
+            self._dirty = True
+            self.flush()
+
+    def owners(self, paths, indexed_only=False):
+        """Return a mapping of the given paths to the cpvs owning them.
+
+        Paths that aren't owned by any package are left out.
+
+        :param indexed_only: if True, return None instead of building the
+            index from scratch when it's neither loaded nor persisted, since
+            that requires parsing the CONTENTS of every installed package
+        """
+        if self._owners is None:
+            if indexed_only and (self.path is None or not os.path.exists(self.path)):
+                return None
+            self._load()
+        owners = self._owners
+        d = {}
+        for path in paths:
+            l = owners.get(path)
+            if l:
+                d[path] = tuple(sorted(l))
+        return d
+
+    def update(self, cpvstr):
+        """Reindex a package after it was merged or unmerged."""
+        if self._owners is None:
+            # changes get picked up when loading
+            return
+        if self._stamp(cpvstr) is None:
+            if cpvstr not in self._pkgs:
+                return
+            self._remove(cpvstr)
+        elif not self._sync(cpvstr):
+            return
+        # rewriting the whole index per package would make merging many
+        # packages quadratic, so write it once on exit instead
+        self._dirty = True
+        if not self._registered:
+            self._registered = True
+            atexit.register(self.flush)
@@ -119,6 +119,7 @@ class install(repo_ops.install):
     def finalize_data(self):
         os.rename(self.tmp_write_path, self.install_path)
         update_mtime(self.repo.location)
+        self.repo._notify_pkg_modified(self.new_pkg)
         return True
 
 
@@ -136,6 +137,7 @@ class uninstall(repo_ops.uninstall):
         update_mtime(self.repo.location)
         shutil.rmtree(self.remove_path)
         update_mtime(self.repo.location)
+        self.repo._notify_pkg_modified(self.old_pkg)
         return True
 
 